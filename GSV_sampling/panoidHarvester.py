@@ -0,0 +1,494 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: concurrent harvester of Street View panoid metadata for candidate sample locations.  Replaces
+#          one-at-a-time streetview.panoids calls with asyncio requests over a shared pool of keep-alive
+#          connections, with bounded concurrency, rate limiting, and retries with exponential backoff.
+#          By default the harvester sends the same panorama search as streetview.panoids and returns the same
+#          list of nearby panoids, including older captures.  The Street View metadata API, which only returns
+#          the most recent panorama nearest each location, can be used instead by setting source to 'metadata'.
+#          A harvester keeps one session, and its keep-alive connections, for its whole life, so connections are
+#          reused between batches.  Responses are stored in a SQLite cache keyed by source and rounded coordinate, so rerunning a category,
+#          adding a road type, or resuming an interrupted sample only queries locations that were never harvested.
+#          Passing the url of StubPanoidServer runs the harvester against a local stub HTTP server, so the
+#          harvester can be tested without network access or an API key.
+
+# import dependencies
+import asyncio
+import concurrent.futures
+import sqlite3
+import random
+import json
+import time
+import re
+try:
+    import aiohttp
+    from aiohttp import web
+except ImportError:
+    # only needed when harvesting or running the stub server, the cache can be read without it
+    aiohttp = None
+    web = None
+
+# define global constants
+PANOID_URL = "https://maps.googleapis.com/maps/api/js/GeoPhotoService.SingleImageSearch?pb=!1m5!1sapiv3!5sUS!11m2!1m1!1b0!2m4!1m2!3d{lat}!4d{lon}!2d50!3m10!2m2!1sen!2sGB!9m1!1e2!11m4!1m3!1e2!2b1!3e2!4m10!1e1!1e2!1e3!1e4!1e8!1e6!5m1!1e2!6m1!1e2&callback=_xdc_._v2mub5" # panorama search sent by streetview.panoids
+METADATA_URL = "https://maps.googleapis.com/maps/api/streetview/metadata?location={lat},{lon}&key={key}" # Street View metadata API, requires an API key
+DEFAULT_SOURCE = 'search' # 'search' (all nearby panoids, same as streetview.panoids) or 'metadata' (most recent panoid only)
+API_KEY = 'insert api key here'
+CACHE_DECIMALS = 5 # coordinates are rounded to 5 decimal places (about 1m) to create cache keys
+MAX_CONCURRENT = 32 # maximum number of requests in flight, and of open connections
+MAX_PER_SECOND = 50 # maximum number of requests started per second
+MAX_RETRIES = 5 # number of times a failed request is retried
+BACKOFF_BASE = 0.5 # seconds to wait before the first retry.  The wait doubles with each retry
+BACKOFF_MAX = 30 # maximum seconds to wait between retries
+REQUEST_TIMEOUT = 30 # seconds before a request is cancelled and retried
+RETRY_STATUS = [429,500,502,503,504] # http status codes of transient failures
+BATCH_SIZE = 1000 # number of locations harvested before results are checked against the sample size
+COMMIT_EVERY = 200 # number of responses written to the cache between commits
+DB_TIMEOUT = 300 # seconds to wait for another process to release a lock on the cache
+
+# error raised when a request fails in a way that retrying could fix (e.g. rate limits, server errors)
+class TransientError(Exception):
+    pass
+
+# custom class for limiting the rate at which requests are started.  Requests are spaced evenly, so bursts
+# don't trigger rate limits on the server
+class RateLimiter:
+
+    # INPUTS:
+    #    perSecond (float) - maximum number of requests started per second
+    def __init__(self,perSecond):
+        self.interval = 1.0/perSecond
+        self.nextTime = 0.0
+        self.lock = asyncio.Lock()
+
+    # wait until the next request can start
+    async def wait(self):
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            startTime = max(now,self.nextTime)
+            self.nextTime = startTime + self.interval
+        if(startTime > now):
+            await asyncio.sleep(startTime - now)
+
+# custom class for harvesting panoids for many locations, reading from and writing to the on-disk cache
+class PanoidHarvester:
+
+    # INPUTS:
+    #    cacheFile (string) - absolute filepath to the SQLite cache
+    #    source (string) - 'search' or 'metadata', see DEFAULT_SOURCE
+    #    url (string) - optional, request url with {lat}, {lon}, and {key} placeholders.  Defaults to the url of
+    #                   the source
+    #    apiKey (string) - Street View API key, only needed by the metadata source
+    #    maxConcurrent (int) - maximum number of requests in flight
+    #    maxPerSecond (float) - maximum number of requests started per second
+    #    maxRetries (int) - number of times a failed request is retried
+    #    decimals (int) - number of decimal places used to create cache keys
+    def __init__(self,cacheFile,source=DEFAULT_SOURCE,url=None,apiKey=API_KEY,maxConcurrent=MAX_CONCURRENT,
+                 maxPerSecond=MAX_PER_SECOND,maxRetries=MAX_RETRIES,decimals=CACHE_DECIMALS):
+        if(aiohttp is None):
+            raise ImportError("aiohttp is required to harvest panoids")
+        if(source not in PANOID_SOURCES):
+            raise ValueError("unknown panoid source %s" %(source))
+        self.connection = openCache(cacheFile)
+        self.source = source
+        self.url = url or PANOID_SOURCES[source][0]
+        self.parser = PANOID_SOURCES[source][1]
+        self.apiKey = apiKey
+        self.maxConcurrent = maxConcurrent
+        self.maxPerSecond = maxPerSecond
+        self.maxRetries = maxRetries
+        self.decimals = decimals
+        self.counts = {'cached':0,'requests':0,'retries':0,'failed':0}
+        # event loop used by harvest, and the session of keep-alive connections shared by every call to harvest
+        self.loop = asyncio.new_event_loop()
+        self.session = None
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self,excType,excValue,traceback):
+        self.close()
+        return(False)
+
+    # close the shared session and its connections, and commit the cache
+    def close(self):
+        try:
+            if(self.session is not None):
+                runOnLoop(self.loop,self.session.close())
+                self.session = None
+            self.loop.close()
+        finally:
+            self.connection.commit()
+            self.connection.close()
+
+    # get panoids for a set of locations.  Cached locations are read from the cache, and the rest are requested
+    # INPUTS:
+    #    locations (list of (lat,lon) tuples) - locations to harvest
+    # OUTPUTS:
+    #    list of panoid lists in the same order as locations.  None for locations where all retries failed
+    def harvest(self,locations):
+        return(runOnLoop(self.loop,self.harvestAsync(locations)))
+
+    # async version of harvest, for callers that already run an event loop.  Sessions can only be used in the
+    # event loop they were created in, so each call from another event loop opens and closes its own session
+    async def harvestAsync(self,locations):
+        keys = [getCoordKey(lat,lon,self.decimals) for lat,lon in locations]
+        results = readCache(self.connection,self.source,keys)
+        self.counts['cached'] += len(results)
+        toRequest = {}
+        for key,location in zip(keys,locations):
+            if(key not in results):
+                toRequest[key] = location
+        if(len(toRequest) > 0):
+            results.update(await self.requestAll(toRequest))
+        return([results.get(key) for key in keys])
+
+    # get the session for the running event loop.  Requests sent by harvest share one session for the life of
+    # the harvester, so keep-alive connections are reused between batches
+    # OUTPUTS:
+    #    aiohttp ClientSession
+    def getSession(self):
+        if(asyncio.get_running_loop() is not self.loop):
+            return(createSession(self.maxConcurrent))
+        if(self.session is None):
+            self.session = createSession(self.maxConcurrent)
+        return(self.session)
+
+    # request panoids for all uncached locations with a fixed pool of workers sharing one session
+    # INPUTS:
+    #    toRequest (dict) - location tuples, keyed by cache key
+    # OUTPUTS:
+    #    dictionary of panoid lists, keyed by cache key.  Locations where all retries failed are left out
+    async def requestAll(self,toRequest):
+        queue = asyncio.Queue()
+        for item in toRequest.items():
+            queue.put_nowait(item)
+        results = {}
+        limiter = RateLimiter(self.maxPerSecond)
+        session = self.getSession()
+        workers = [
+            asyncio.create_task(self.requestWorker(session,limiter,queue,results))
+            for i in range(min(self.maxConcurrent,len(toRequest)))
+        ]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            # keep everything harvested so far if the sample is interrupted
+            for worker in workers:
+                worker.cancel()
+            self.connection.commit()
+            if(session is not self.session):
+                await session.close()
+        return(results)
+
+    # take locations off the queue until it is empty, and cache each response as it arrives
+    # INPUTS:
+    #    session (aiohttp ClientSession) - shared connection pool
+    #    limiter (RateLimiter) - shared rate limiter
+    #    queue (asyncio Queue) - (cache key, location) tuples
+    #    results (dict) - panoid lists, keyed by cache key
+    async def requestWorker(self,session,limiter,queue,results):
+        while not queue.empty():
+            key,(lat,lon) = queue.get_nowait()
+            try:
+                panoids = await self.requestOne(session,limiter,lat,lon)
+            except Exception as e:
+                self.counts['failed'] +=1
+                print("couldn't get panoids for %s: %s" %(key,str(e)))
+                continue
+            results[key] = panoids
+            writeCache(self.connection,self.source,key,panoids)
+            if(len(results) % COMMIT_EVERY == 0):
+                self.connection.commit()
+
+    # request panoids for a single location, retrying transient failures with exponential backoff and jitter
+    # INPUTS:
+    #    session (aiohttp ClientSession) - shared connection pool
+    #    limiter (RateLimiter) - shared rate limiter
+    #    lat, lon (float) - location coordinates
+    # OUTPUTS:
+    #    list of panoid dictionaries
+    async def requestOne(self,session,limiter,lat,lon):
+        url = self.url.format(lat=lat,lon=lon,key=self.apiKey)
+        for attempt in range(self.maxRetries+1):
+            await limiter.wait()
+            self.counts['requests'] +=1
+            retryAfter = None
+            try:
+                async with session.get(url) as response:
+                    if(response.status in RETRY_STATUS):
+                        retryAfter = response.headers.get('Retry-After')
+                        raise TransientError("http status %i" %(response.status))
+                    response.raise_for_status()
+                    return(self.parser(await response.text()))
+            except (TransientError,aiohttp.ClientConnectionError,aiohttp.ClientPayloadError,asyncio.TimeoutError):
+                if(attempt == self.maxRetries):
+                    raise
+            self.counts['retries'] +=1
+            await asyncio.sleep(calcBackoff(attempt,retryAfter))
+
+# stand-in for the panoid services, for testing the harvester without an API key.  Returns a deterministic
+# set of panoids near each requested location, formatted as a panorama search response (url) or a metadata
+# response (metadataUrl), and fails a fraction of requests with transient errors
+class StubPanoidServer:
+
+    # INPUTS:
+    #    port (int) - local port to listen on
+    #    failureRate (float) - probability that a request fails with http status 503, to test retries
+    #    delay (float) - seconds to wait before responding, to simulate network latency
+    def __init__(self,port=8765,failureRate=0.0,delay=0.0):
+        if(aiohttp is None):
+            raise ImportError("aiohttp is required to run the stub panoid server")
+        self.port = port
+        self.failureRate = failureRate
+        self.delay = delay
+        self.requests = 0
+        self.runner = None
+        self.url = "http://127.0.0.1:" + str(port) + "/search?lat={lat}&lon={lon}"
+        self.metadataUrl = "http://127.0.0.1:" + str(port) + "/metadata?lat={lat}&lon={lon}&key={key}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/search',self.handle)
+        app.router.add_get('/metadata',self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner,'127.0.0.1',self.port).start()
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def handle(self,request):
+        self.requests +=1
+        if(self.delay > 0):
+            await asyncio.sleep(self.delay)
+        if(random.random() < self.failureRate):
+            return(web.Response(status=503))
+        panoids = createStubPanoids(float(request.query['lat']),float(request.query['lon']))
+        if(request.path=='/metadata'):
+            return(web.json_response(formatStubMetadata(panoids)))
+        return(web.Response(text=formatStubSearch(panoids)))
+
+# create the synthetic panoids returned by StubPanoidServer, sorted by date like streetview.panoids.  About 1 in
+# 10 locations has no imagery, and the rest have 1 to 4 panoids from different months within about 20m
+# INPUTS:
+#    lat, lon (float) - location coordinates
+# OUTPUTS:
+#    list of panoid dictionaries
+def createStubPanoids(lat,lon):
+    generator = random.Random(getCoordKey(lat,lon))
+    if(generator.random() < 0.1):
+        return([])
+    panoids = []
+    months = generator.sample(range(2007*12,2021*12),generator.randint(1,4))
+    for month in sorted(months):
+        panoids.append({
+            'panoid':"stub%08x" %(generator.getrandbits(32)),
+            'lat':round(lat + generator.uniform(-0.0002,0.0002),7),
+            'lon':round(lon + generator.uniform(-0.0002,0.0002),7),
+            'year':month//12,
+            'month':month%12 + 1
+        })
+    return(panoids)
+
+# format stub panoids as a panorama search response.  The most recent panoid is listed first, and its date last
+# INPUTS:
+#    panoids (list) - panoid dictionaries sorted by date, created by createStubPanoids
+# OUTPUTS:
+#    response text
+def formatStubSearch(panoids):
+    if(len(panoids)==0):
+        return("_xdc_._v2mub5( [[5,\"search returned no images.\"]] )")
+    ordered = panoids[-1:] + panoids[:-1]
+    images = ",".join(['[[2,"%s"],[[null,null,%r,%r]]]' %(p['panoid'],p['lat'],p['lon']) for p in ordered])
+    dates = ",".join(["[%i,%i]" %(p['year'],p['month']) for p in ordered[1:] + ordered[:1]])
+    return("_xdc_._v2mub5( [[0],[%s],[%s]] )" %(images,dates))
+
+# format stub panoids as a Street View metadata response, which only includes the most recent panoid
+# INPUTS:
+#    panoids (list) - panoid dictionaries sorted by date, created by createStubPanoids
+# OUTPUTS:
+#    response dictionary
+def formatStubMetadata(panoids):
+    if(len(panoids)==0):
+        return({'status':'ZERO_RESULTS'})
+    latest = panoids[-1]
+    return({
+        'status':'OK',
+        'pano_id':latest['panoid'],
+        'location':{'lat':latest['lat'],'lng':latest['lon']},
+        'date':"%i-%02i" %(latest['year'],latest['month'])
+    })
+
+# open the panoid cache, creating the response table if needed
+# INPUTS:
+#    cacheFile (string) - absolute filepath to the cache
+# OUTPUTS:
+#    sqlite3 connection
+def openCache(cacheFile):
+    # in notebooks, the harvester runs its event loop in a separate thread (see runOnLoop)
+    connection = sqlite3.connect(cacheFile,timeout=DB_TIMEOUT,check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("""CREATE TABLE IF NOT EXISTS panoids (
+        source TEXT, coord_key TEXT, panoids TEXT, harvested REAL, PRIMARY KEY (source, coord_key))""")
+    return(connection)
+
+# create the cache key for a location
+# INPUTS:
+#    lat, lon (float) - location coordinates
+#    decimals (int) - number of decimal places to round coordinates to
+# OUTPUTS:
+#    key string (e.g. '45.52345,-122.67621')
+def getCoordKey(lat,lon,decimals=CACHE_DECIMALS):
+    return("%.*f,%.*f" %(decimals,round(float(lat),decimals),decimals,round(float(lon),decimals)))
+
+# read cached panoids for a set of cache keys
+# INPUTS:
+#    connection (sqlite3 connection) - created by openCache
+#    source (string) - 'search' or 'metadata'
+#    keys (string array) - created by getCoordKey
+# OUTPUTS:
+#    dictionary of panoid lists, keyed by cache key.  Keys that are not in the cache are left out
+def readCache(connection,source,keys):
+    results = {}
+    uniqueKeys = list(set(keys))
+    # stay below the SQLite limit on query parameters
+    for startIndex in range(0,len(uniqueKeys),500):
+        curKeys = uniqueKeys[startIndex:startIndex+500]
+        rows = connection.execute(
+            "SELECT coord_key, panoids FROM panoids WHERE source = ? AND coord_key IN (%s)" %(",".join("?"*len(curKeys))),
+            [source] + curKeys
+        ).fetchall()
+        for key,panoids in rows:
+            results[key] = json.loads(panoids)
+    return(results)
+
+# write the panoids for one location to the cache.  Locations without imagery are cached as empty lists, so
+# they aren't requested again
+# INPUTS:
+#    connection (sqlite3 connection) - created by openCache
+#    source (string) - 'search' or 'metadata'
+#    key (string) - created by getCoordKey
+#    panoids (list) - panoid dictionaries
+def writeCache(connection,source,key,panoids):
+    connection.execute(
+        "INSERT OR REPLACE INTO panoids VALUES (?,?,?,?)",
+        (source,key,json.dumps(panoids),time.time())
+    )
+
+# convert a panorama search response into the list of panoid dictionaries returned by streetview.panoids,
+# using the same parsing.  Panoids are sorted by date, and panoids without a date are listed last
+# INPUTS:
+#    text (string) - response text
+# OUTPUTS:
+#    list of dictionaries with panoid, lat, lon, and when available, year and month
+def parseSearchResponse(text):
+    pans = re.findall(r'\[[0-9]+,"(.+?)"\].+?\[\[null,null,(-?[0-9]+.[0-9]+),(-?[0-9]+.[0-9]+)',text)
+    pans = [{'panoid':pan[0],'lat':float(pan[1]),'lon':float(pan[2])} for pan in pans]
+    # remove duplicate panoramas
+    pans = [pan for index,pan in enumerate(pans) if pan not in pans[:index]]
+    if(len(pans)==0):
+        return([])
+
+    # dates are listed in the same order as the panoids, except the date of the first (most recent) panoid is
+    # listed last.  Panoids at the end of the list may not have a date
+    dates = re.findall(r'([0-9]?[0-9]?[0-9])?,?\[(20[0-9][0-9]),([0-9]+)\]',text)
+    dates = [[int(date[1]),int(date[2])] for date in dates]
+    dates = [date for date in dates if date[1] >= 1 and date[1] <= 12]
+    if(len(dates) > 0):
+        year,month = dates.pop(-1)
+        pans[0].update({'year':year,'month':month})
+        dates.reverse()
+        for index,(year,month) in enumerate(dates):
+            pans[-1-index].update({'year':year,'month':month})
+    pans.sort(key=lambda pan: (pan['year'],pan['month']) if 'year' in pan else (3000,1))
+    return(pans)
+
+# convert a Street View metadata response into a list with the single panoid it describes
+# INPUTS:
+#    text (string) - response text
+# OUTPUTS:
+#    list of dictionaries with panoid, lat, lon, and when available, year and month
+def parseMetadataResponse(text):
+    payload = json.loads(text)
+    status = payload.get('status')
+    if(status in ['ZERO_RESULTS','NOT_FOUND']):
+        return([])
+    if(status in ['OVER_QUERY_LIMIT','UNKNOWN_ERROR']):
+        raise TransientError(status)
+    if(status != 'OK'):
+        raise ValueError("panoid request failed with status %s: %s" %(status,payload.get('error_message','')))
+    panoid = {
+        'panoid':payload['pano_id'],
+        'lat':payload['location']['lat'],
+        'lon':payload['location']['lng']
+    }
+    # dates are formatted as 'YYYY-MM'
+    if('date' in payload):
+        dateParts = payload['date'].split('-')
+        panoid['year'] = int(dateParts[0])
+        if(len(dateParts) > 1):
+            panoid['month'] = int(dateParts[1])
+    return([panoid])
+
+# calculate how long to wait before retrying a request.  Uses the server's Retry-After header when available,
+# and otherwise exponential backoff with full jitter, so retries from concurrent workers don't line up
+# INPUTS:
+#    attempt (int) - number of attempts that already failed, minus one
+#    retryAfter (string) - value of the Retry-After header, or None
+# OUTPUTS:
+#    seconds to wait
+def calcBackoff(attempt,retryAfter=None):
+    if(retryAfter is not None):
+        try:
+            return(min(float(retryAfter),BACKOFF_MAX))
+        except ValueError:
+            pass
+    return(random.uniform(0,min(BACKOFF_MAX,BACKOFF_BASE*2**attempt)))
+
+# create a session with a pool of keep-alive connections.  Must be called from the event loop that uses it
+# INPUTS:
+#    maxConcurrent (int) - maximum number of open connections
+# OUTPUTS:
+#    aiohttp ClientSession
+def createSession(maxConcurrent):
+    connector = aiohttp.TCPConnector(limit=maxConcurrent,ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    return(aiohttp.ClientSession(connector=connector,timeout=timeout))
+
+# run a coroutine to completion on an event loop that is reused between calls.  Jupyter notebooks already run an
+# event loop, so in notebooks the loop is run in a separate thread
+# INPUTS:
+#    loop (asyncio event loop) - event loop that is not running
+#    coroutine (coroutine) - coroutine to run
+# OUTPUTS:
+#    value returned by the coroutine
+def runOnLoop(loop,coroutine):
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return(runUntilComplete(loop,coroutine))
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        return(executor.submit(runUntilComplete,loop,coroutine).result())
+
+# run a coroutine on an event loop.  If the run is interrupted (e.g. KeyboardInterrupt), the coroutine is
+# cancelled and allowed to clean up, e.g. commit the cache, before the error is raised
+# INPUTS:
+#    loop (asyncio event loop) - event loop that is not running
+#    coroutine (coroutine) - coroutine to run
+# OUTPUTS:
+#    value returned by the coroutine
+def runUntilComplete(loop,coroutine):
+    task = loop.create_task(coroutine)
+    try:
+        return(loop.run_until_complete(task))
+    except BaseException:
+        if(not task.done()):
+            task.cancel()
+            loop.run_until_complete(asyncio.wait([task]))
+        raise
+
+# request url and response parser for each panoid source
+PANOID_SOURCES = {
+    'search':(PANOID_URL,parseSearchResponse),
+    'metadata':(METADATA_URL,parseMetadataResponse)
+}
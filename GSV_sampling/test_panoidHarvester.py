@@ -0,0 +1,109 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: tests the panoid harvester against the local stub panoid server, including retries of transient
+#          failures, rerunning from the cache, resuming an interrupted harvest, and the optional metadata source.
+#          Run with pytest from this folder
+
+# import dependencies
+import asyncio
+import socket
+import threading
+import pytest
+import panoidHarvester
+from panoidHarvester import PanoidHarvester, StubPanoidServer, createStubPanoids
+
+# define global constants
+FAILURE_RATE = 0.2 # probability that the stub server fails a request with a transient error
+GRID_SIZE = 12 # number of locations along each side of the harvested grid
+MAX_RETRIES = 10 # retries per request, enough that a request never fails at FAILURE_RATE
+BACKOFF_BASE = 0.01 # seconds to wait before the first retry, shorter than the harvester default to keep tests fast
+
+# get a free local port for the stub server
+# OUTPUTS:
+#    port number
+def getFreePort():
+    with socket.socket() as curSocket:
+        curSocket.bind(('127.0.0.1',0))
+        return(curSocket.getsockname()[1])
+
+# run the stub server in its own event loop and thread, since the harvester runs its own event loop
+@pytest.fixture(scope='module')
+def stub():
+    server = StubPanoidServer(port=getFreePort(),failureRate=FAILURE_RATE)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever,daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(server.start(),loop).result()
+    yield(server)
+    asyncio.run_coroutine_threadsafe(server.stop(),loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+# shorten the wait between retries in every test
+@pytest.fixture(autouse=True)
+def fastBackoff(monkeypatch):
+    monkeypatch.setattr(panoidHarvester,'BACKOFF_BASE',BACKOFF_BASE)
+
+# create a grid of locations about 100m apart
+# OUTPUTS:
+#    list of (lat,lon) tuples
+def createGrid():
+    return([(45.5 + row*0.001,-122.7 + col*0.001) for row in range(GRID_SIZE) for col in range(GRID_SIZE)])
+
+# create a harvester for the stub server
+# INPUTS:
+#    cacheFile (string) - absolute filepath to the cache
+#    url (string) - stub server url
+#    source (string) - 'search' or 'metadata'
+# OUTPUTS:
+#    PanoidHarvester
+def createHarvester(cacheFile,url,source='search'):
+    return(PanoidHarvester(cacheFile,source=source,url=url,apiKey='stub',maxPerSecond=1000,maxRetries=MAX_RETRIES))
+
+def test_harvest_and_rerun(stub,tmp_path):
+    cacheFile = str(tmp_path / "cache.db")
+    grid = createGrid()
+    with createHarvester(cacheFile,stub.url) as harvester:
+        results = harvester.harvest(grid)
+        counts = dict(harvester.counts)
+    assert results == [createStubPanoids(lat,lon) for lat,lon in grid]
+    assert counts['retries'] > 0
+    assert counts['failed'] == 0
+
+    # a rerun reads every location from the cache
+    stub.requests = 0
+    with createHarvester(cacheFile,stub.url) as harvester:
+        assert harvester.harvest(grid) == results
+        assert harvester.counts['cached'] == len(grid)
+        assert harvester.counts['requests'] == 0
+    assert stub.requests == 0
+
+def test_resume(stub,tmp_path):
+    cacheFile = str(tmp_path / "cache.db")
+    grid = createGrid()
+    half = len(grid)//2
+    with createHarvester(cacheFile,stub.url) as harvester:
+        harvester.harvest(grid[:half])
+
+    # after reopening the cache, only the missing half of the grid is requested
+    with createHarvester(cacheFile,stub.url) as harvester:
+        results = harvester.harvest(grid)
+        counts = dict(harvester.counts)
+    assert results == [createStubPanoids(lat,lon) for lat,lon in grid]
+    assert counts['cached'] == half
+    assert counts['requests'] - counts['retries'] == len(grid) - half
+    assert counts['failed'] == 0
+
+def test_metadata_source(stub,tmp_path):
+    cacheFile = str(tmp_path / "cache.db")
+    grid = createGrid()
+    with createHarvester(cacheFile,stub.url) as harvester:
+        harvester.harvest(grid)
+
+    # the metadata source only returns the most recent panoid, and doesn't share cached responses with search
+    with createHarvester(cacheFile,stub.metadataUrl,source='metadata') as harvester:
+        results = harvester.harvest(grid)
+        counts = dict(harvester.counts)
+    assert results == [createStubPanoids(lat,lon)[-1:] for lat,lon in grid]
+    assert counts['cached'] == 0
+    assert counts['failed'] == 0
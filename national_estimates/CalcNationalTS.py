@@ -5,10 +5,18 @@
 
 # import dependencies
 import pandas as ps
+import numpy as np
 from tsPackage import * 
+import tsArrayPackage
+from imageIndex import ImageIndex, buildImageIndex, saveImageIndex, loadImageIndex, INDEX_FILENAME
+from jobScheduler import createJob, runJobs, assignShards, estimateRowCount
+from pipelineManifest import createTaskKey, isTaskComplete, recordTaskComplete, getTempPath, commitTempFile, fingerprintFiles, MANIFEST_FILENAME
+from tableStorage import readTable, writeTable, getTablePath, DEFAULT_FORMAT
+from telemetry import timeStage, configureTelemetry, getTelemetryFile, writePrometheusFile
 from sklearn import preprocessing
-from multiprocessing import Pool
 import os
+import glob
+import shutil
 
 # define global constants
 LABELS = ['beauty','nature','relaxing','safe_walk','safe_crime'] # one label for each perception
@@ -16,7 +24,28 @@ COMPARISON_LEVELS = ['census_tract','city'] # siamese network models compared im
 PARENT_FOLDER = "insert absolute folderpath where input datasets and results are stored"
 COMPARISON_FOLDER = PARENT_FOLDER + "/All_Cities/MSA_Image_CSV/" # where siamese network model outputs are stored 
 PERCEPTION_FOLDER = PARENT_FOLDER + "Perceptions/" # where output TS scores will be stored
-WORKSTATION_NUMBERS = [3,4,5,8,9] # if using multiple workstations, divide the work across workstations using the first digit of each MSA
+NODE_ID = 0 # if using multiple workstations, index of this workstation (0 to N_SHARDS-1)
+N_SHARDS = 1 # if using multiple workstations, number of workstations.  MSAs are divided into shards with balanced input sizes
+N_WORKERS = 10 # number of CPU workers shared by all MSAs, perceptions, and comparison levels
+MEMORY_LIMIT = 256*1024**3 # maximum estimated memory (bytes) of jobs running at the same time
+MEMORY_BASE = 1024**3 # estimated memory (bytes) of a job, independent of the input size
+MEMORY_PER_ROW = {'stream':16,'array':400,'object':1000} # rough estimated memory (bytes) per siamese network model prediction, by TS_ENGINE
+TS_ENGINE = 'stream' # 'stream' streams predictions through an on-disk shuffle, 'array' loads all predictions into the vectorized engine in tsArrayPackage, 'object' uses the per-image TS objects in tsPackage
+SCRATCH_FOLDER = PARENT_FOLDER + "Scratch/" # where temporary shuffle buckets are written when TS_ENGINE is 'stream'
+SEQUENTIAL_TS = True # apply games one at a time with the compiled kernel in tsKernel (bit-for-bit identical to tsPackage), otherwise in vectorized rounds
+INTERN_IMAGE_IDS = True # store image ids as int32 codes from a per-MSA image index (array and stream engines only)
+MANIFEST_FILE = PARENT_FOLDER + MANIFEST_FILENAME # tracks completed tasks so interrupted runs resume where they stopped
+STORAGE_FORMAT = DEFAULT_FORMAT # format of TS score tables, 'parquet' (requires pyarrow) or 'csv'
+MULTI_LABEL_TS = True # score all perceptions and comparison levels of an MSA in one job with one shared state array, writing the wide perception scores table directly (requires INTERN_IMAGE_IDS and the array or stream engine)
+INCREMENTAL_TS = True # keep a snapshot of the TS states of each MSA and only apply prediction csvs that are new since the snapshot (MULTI_LABEL_TS only)
+STATE_FILENAME = "ts_state.npz" # TS state snapshot, stored in each MSA folder
+BATCH_SUFFIX = "_batch" # later batches of predictions are stored next to the original csvs as mturk_cate_<label>_one_<level>_batch<name>.csv, and applied in filename order
+TS_SEED = 2023 # seed for the random game order, so TS scores can be reproduced.  If None, the order is not reproducible
+N_ORDERINGS = 1 # number of independent, seeded game orderings.  If more than 1, scores are the mean across orderings and the spread is written to a stability table (MULTI_LABEL_TS only, does not use INCREMENTAL_TS)
+PRUNE_SIGMA = None # optional game pruning.  Images whose mean sigma across the 3 levels drops below this value stop receiving games.  If None, images never converge
+PRUNE_QUALITY = None # optional game pruning.  Games whose mean trueskill match quality across the 3 levels is below this value are skipped.  If None, games are never skipped for quality
+PRUNE_DIAGNOSTICS = False # if true and pruning is on, also score every game and add rank correlations against the full run to the pruning table (MULTI_LABEL_TS only, doubles the TS cost)
+TELEMETRY_FILE = None # absolute filepath of a JSON lines file where stage timings, throughput, and memory are appended.  If None, telemetry is off unless the NSV_TELEMETRY_FILE environment variable is set
 
 # given a large set of data, partition data into tuple subsets so tuples can be processed in parallel by multiple CPUs
 # INPUTS:
@@ -33,6 +62,123 @@ def prepParallel(inFolder,comparisonLevel):
         )
     return(parallelTuples)
 
+# get the filepaths of all siamese network model prediction csvs for a single MSA
+# INPUTS:
+#    dataFolder (string) - folder where siamese network perception model comparisons are stored
+# OUTPUTS:
+#    list of absolute filepaths, one for each perception and comparison level plus any later prediction batches
+def getPredictionCSVs(dataFolder):
+    inFiles = []
+    for fieldFiles in getFieldCSVs(dataFolder).values():
+        inFiles += fieldFiles
+    return(inFiles)
+
+# get the filepaths of the siamese network model prediction csvs for each perception and comparison level of a
+# single MSA, in the order they are applied
+# INPUTS:
+#    dataFolder (string) - folder where siamese network perception model comparisons are stored
+# OUTPUTS:
+#    dictionary of kv pairs perception and comparison level name:list of absolute filepaths, starting with the
+#    original csv and followed by prediction batches in filename order
+def getFieldCSVs(dataFolder):
+    fieldCSVs = {}
+    for label in LABELS:
+        for comparisonLevel in COMPARISON_LEVELS:
+            inFile = dataFolder + "mturk_cate_" + label + "_one_" + comparisonLevel + ".csv"
+            batchFiles = sorted(glob.glob(inFile[:-len(".csv")] + BATCH_SUFFIX + "*.csv"))
+            fieldCSVs[label + "_" + comparisonLevel] = [inFile] + batchFiles
+    return(fieldCSVs)
+
+# get the name of the MSA stored in a folder
+# INPUTS:
+#    dataFolder (string) - folder where siamese network perception model comparisons are stored
+# OUTPUTS:
+#    MSA name (string)
+def getMSAName(dataFolder):
+    return(os.path.basename(os.path.normpath(dataFolder)))
+
+# get the manifest key, inputs, and outputs of the image index task for a single MSA
+# INPUTS:
+#    dataFolder (string) - folder where siamese network perception model comparisons are stored
+# OUTPUTS:
+#    tuple of (task key, input filepaths, output filepaths)
+def getIndexTask(dataFolder):
+    taskKey = createTaskKey('image_index',getMSAName(dataFolder))
+    return((taskKey,getPredictionCSVs(dataFolder),[dataFolder + INDEX_FILENAME]))
+
+# get the manifest key, inputs, and outputs of the TS task for a single MSA, perception, and comparison level
+# INPUTS:
+#    dataFolder (string) - folder where siamese network perception model comparisons are stored
+#    label (string) - perception type (e.g. 'beauty')
+#    comparisonLevel (string) - 'city' or 'census_tract'
+# OUTPUTS:
+#    tuple of (task key, input filepaths, output filepaths)
+def getTSTask(dataFolder,label,comparisonLevel):
+    taskKey = createTaskKey('ts_scores',getMSAName(dataFolder),label,comparisonLevel)
+    inFiles = [dataFolder + "mturk_cate_" + label + "_one_" + comparisonLevel + ".csv"]
+    if(INTERN_IMAGE_IDS and TS_ENGINE!='object'):
+        inFiles.append(dataFolder + INDEX_FILENAME)
+    return((taskKey,inFiles,[getTablePath(dataFolder + "ts_scores_" + label + "_" + comparisonLevel,STORAGE_FORMAT)]))
+
+# get the manifest key, inputs, and outputs of the task that combines TS scores for a single MSA
+# INPUTS:
+#    dataFolder (string) - folder where TS scores for a single MSA are stored
+#    MSA (string) - MSA to combine records for
+# OUTPUTS:
+#    tuple of (task key, input filepaths, output filepaths)
+def getCombineTask(dataFolder,MSA):
+    inFiles, outFiles = [], [getTablePath(PERCEPTION_FOLDER + str(MSA) + "_perception_scores",STORAGE_FORMAT)]
+    for label in LABELS:
+        for comparisonLevel in COMPARISON_LEVELS:
+            inFiles += getTSTask(dataFolder,label,comparisonLevel)[2]
+    if(INTERN_IMAGE_IDS and TS_ENGINE!='object'):
+        inFiles.append(dataFolder + INDEX_FILENAME)
+        outFiles.append(PERCEPTION_FOLDER + str(MSA) + "_" + INDEX_FILENAME)
+    return((createTaskKey('perception_scores',MSA),inFiles,outFiles))
+
+# get the manifest key, inputs, and outputs of the task that scores all perceptions and comparison levels of
+# a single MSA in one pass (MULTI_LABEL_TS)
+# INPUTS:
+#    dataFolder (string) - folder where siamese network perception model comparisons are stored
+#    MSA (string) - MSA to score
+# OUTPUTS:
+#    tuple of (task key, input filepaths, output filepaths)
+def getMultiLabelTask(dataFolder,MSA):
+    inFiles = getPredictionCSVs(dataFolder) + [dataFolder + INDEX_FILENAME]
+    outFiles = [
+        getTablePath(PERCEPTION_FOLDER + str(MSA) + "_perception_scores",STORAGE_FORMAT),
+        PERCEPTION_FOLDER + str(MSA) + "_" + INDEX_FILENAME
+    ]
+    if(N_ORDERINGS>1):
+        outFiles.append(getTablePath(PERCEPTION_FOLDER + str(MSA) + "_perception_stability",STORAGE_FORMAT))
+    else:
+        if(INCREMENTAL_TS):
+            outFiles.append(dataFolder + STATE_FILENAME)
+        if(isPruningOn()):
+            outFiles.append(getTablePath(PERCEPTION_FOLDER + str(MSA) + "_pruning",STORAGE_FORMAT))
+    return((createTaskKey('perception_scores',MSA),inFiles,outFiles))
+
+# test if every task for a single MSA is complete and up to date
+# INPUTS:
+#    MSA (string) - MSA to test
+# OUTPUTS:
+#    true if the MSA does not need to be processed
+def isMSAComplete(MSA):
+    dataFolder = COMPARISON_FOLDER + MSA + "/"
+    if(MULTI_LABEL_TS):
+        tasks = [getIndexTask(dataFolder),getMultiLabelTask(dataFolder,MSA)]
+    else:
+        tasks = [getCombineTask(dataFolder,MSA)]
+        if(INTERN_IMAGE_IDS and TS_ENGINE!='object'):
+            tasks.append(getIndexTask(dataFolder))
+        for label in LABELS:
+            for comparisonLevel in COMPARISON_LEVELS:
+                tasks.append(getTSTask(dataFolder,label,comparisonLevel))
+    for taskKey,inFiles,outFiles in tasks:
+        if not(isTaskComplete(MANIFEST_FILE,taskKey,inFiles,outFiles)):
+            return(False)
+    return(True)
+
 # given tuple metadata, create TS scores for a single perception and comparison unit (city or census tract)
 # INPUTS:
 #    dataTuple (tuple) - contains
@@ -45,66 +191,344 @@ def processSingleLabel(dataTuple):
     label = dataTuple[1]
     comparisonLevel = dataTuple[2]
     inFile = dataFolder + "mturk_cate_" + label + "_one_" + comparisonLevel + ".csv"
-    outFile = dataFolder + "ts_scores_" + label + "_" + comparisonLevel + ".csv"
+    outFile = dataFolder + "ts_scores_" + label + "_" + comparisonLevel
 
-    # load perception model predictions from csv and create multinomial TS scores
-    gameDict = createGameDict(inFile)
-    df = convertDictToDF(gameDict)
+    # skip tasks that were completed by a previous run with the same inputs
+    taskKey,taskInputs,taskOutputs = getTSTask(dataFolder,label,comparisonLevel)
+    if(isTaskComplete(MANIFEST_FILE,taskKey,taskInputs,taskOutputs)):
+        print("already processed %s %s %s" %(taskKey[1],label,comparisonLevel))
+        return
 
-    # normalize TS scores from 0 to 1000
-    df[label + "_" + comparisonLevel] = min_max_scaling(df['mu'])*100
-    df.to_csv(outFile,index=False)
+    # image ids are stored as int32 codes from the image index created for the MSA
+    imageIndex = None
+    if(INTERN_IMAGE_IDS and TS_ENGINE!='object'):
+        imageIndex = loadImageIndex(dataFolder + INDEX_FILENAME)
 
-# for a given MSA, combine city and census tract comparisons of all perceptions into a single csv file
+    # load perception model predictions from csv and create multinomial TS scores
+    pruning = GamePruning(PRUNE_SIGMA,PRUNE_QUALITY) if isPruningOn() else None
+    if(TS_ENGINE=='stream'):
+        gameDict = tsArrayPackage.createGameDictStreaming(inFile,SCRATCH_FOLDER,seed=TS_SEED,imageIndex=imageIndex,sequential=SEQUENTIAL_TS,pruning=pruning)
+    elif(TS_ENGINE=='array'):
+        gameDict = tsArrayPackage.createGameDict(inFile,imageIndex,seed=TS_SEED,sequential=SEQUENTIAL_TS,pruning=pruning)
+    else:
+        gameDict = createGameDict(inFile,seed=TS_SEED,pruning=pruning)
+    if(pruning is not None):
+        print("skipped %i of %i games for %s %s %s" %(pruning.skippedGames(),pruning.games,taskKey[1],label,comparisonLevel))
+    # normalize TS scores from 0 to 100.  The image index covers all images in the MSA, so only images compared
+    # in the current csv are kept
+    with timeStage('convert',MSA=taskKey[1],label=label,comparisonLevel=comparisonLevel) as timer:
+        df = convertDictToDF(gameDict,label + "_" + comparisonLevel,comparedOnly=imageIndex is not None)
+        timer.count(rows=len(df))
+    writeTable(df,outFile,STORAGE_FORMAT)
+    recordTaskComplete(MANIFEST_FILE,taskKey,taskInputs,taskOutputs)
+
+# for a given MSA, combine city and census tract comparisons of all perceptions into a single table
 # INPUTS:
 #    inFolder (string) - absolute filepath where all TS scores for a single MSA are stored
 #    MSA (string) - current MSA to combine records for
 def combineTSScores(inFolder,MSA):
+    taskKey,taskInputs,taskOutputs = getCombineTask(inFolder,MSA)
+    if(isTaskComplete(MANIFEST_FILE,taskKey,taskInputs,taskOutputs)):
+        return
     firstData = True
+    interned = os.path.exists(inFolder + INDEX_FILENAME)
+    timer = timeStage('merge',MSA=MSA)
     for label in LABELS:
 
         # two comparison levels, city and census tract
         for comparisonLevel in COMPARISON_LEVELS:
-            df = ps.read_csv(inFolder + "ts_scores_" + label + "_" + comparisonLevel + ".csv")
-            df.drop(['sigma','n','mu'],axis=1,inplace=True)
-            if(firstData):
-                joinedDF = df
-                firstData = False
-            else: joinedDF = ps.merge(joinedDF,df,how='inner',on='img_id')
+            # only the image id and normalized TS score columns are read
+            df = readTable(
+                inFolder + "ts_scores_" + label + "_" + comparisonLevel,STORAGE_FORMAT,
+                columns=['img_id',label + "_" + comparisonLevel],
+                dtype={'img_id':'int32'} if interned else None
+            )
+            with timer.lap():
+                if(firstData):
+                    joinedDF = df
+                    firstData = False
+                else: joinedDF = ps.merge(joinedDF,df,how='inner',on='img_id')
+            timer.count(rows=len(df))
+    timer.record()
+    # image codes refer to the image index, which already has the name suffix removed
+    if(interned):
+        copyImageIndex(inFolder,MSA)
     # remove name suffix that was added during siamese network processing
-    joinedDF['img_id'] = joinedDF['img_id'].str[-len('04005_097627_08W.png'):] 
+    else:
+        joinedDF['img_id'] = joinedDF['img_id'].str[-len('04005_097627_08W.png'):] 
 
-    joinedDF.to_csv(PERCEPTION_FOLDER + str(MSA) + "_perception_scores.csv",index=False)
+    writeTable(joinedDF,PERCEPTION_FOLDER + str(MSA) + "_perception_scores",STORAGE_FORMAT)
+    recordTaskComplete(MANIFEST_FILE,taskKey,taskInputs,taskOutputs)
 
+# keep a copy of the image index next to the perception scores of an MSA, so later stages can join on the
+# image codes
+# INPUTS:
+#    inFolder (string) - absolute filepath where the image index of the MSA is stored
+#    MSA (string) - current MSA
+def copyImageIndex(inFolder,MSA):
+    indexCopy = PERCEPTION_FOLDER + str(MSA) + "_" + INDEX_FILENAME
+    tempCopy = getTempPath(indexCopy)
+    shutil.copyfile(inFolder + INDEX_FILENAME,tempCopy)
+    commitTempFile(tempCopy,indexCopy)
+
+# create TS scores for all perceptions and comparison levels of a single MSA in one pass.  All prediction csvs
+# are scored against the MSA's image index and a single MultiTSArray, and the wide perception scores table
+# comes directly from the shared state array, so no per-label tables are written or merged.  If INCREMENTAL_TS
+# is true, scoring resumes from the MSA's TS state snapshot and only new prediction csvs are applied
+# INPUTS:
+#    dataFolder (string) - folder where siamese network perception model comparisons are stored
+def processAllLabels(dataFolder):
+    MSA = getMSAName(dataFolder)
+    taskKey,taskInputs,taskOutputs = getMultiLabelTask(dataFolder,MSA)
+    if(isTaskComplete(MANIFEST_FILE,taskKey,taskInputs,taskOutputs)):
+        print("already processed MSA %s" %(MSA))
+        return
+    with timeStage('ts_msa',MSA=MSA) as msaTimer:
+        imageIndex = loadImageIndex(dataFolder + INDEX_FILENAME)
+        inputCSVs = getFieldCSVs(dataFolder)
+        scratchFolder = SCRATCH_FOLDER if TS_ENGINE=='stream' else None
+        # ensembles of game orderings always apply every game
+        pruning = createPruning(inputCSVs.keys()) if N_ORDERINGS==1 else None
+        if(N_ORDERINGS>1):
+            scores = processEnsembles(inputCSVs,imageIndex,MSA)
+        elif(INCREMENTAL_TS):
+            multiArray,skipCSVs,appliedFiles = resumeTSState(dataFolder,imageIndex,inputCSVs)
+            gamesBefore = sum([multiArray[name].n for name in multiArray.names])
+            tsArrayPackage.createMultiGameDict(inputCSVs,imageIndex,scratchFolder,TS_SEED,SEQUENTIAL_TS,multiArray=multiArray,skipCSVs=skipCSVs,pruning=pruning)
+            updated = (sum([multiArray[name].n for name in multiArray.names])!=gamesBefore).sum()
+            print("updated TS scores of %i of %i images in MSA %s" %(updated,len(multiArray),MSA))
+            tsArrayPackage.saveTSState(multiArray,imageIndex,dataFolder + STATE_FILENAME,appliedFiles)
+            scores = convertScores(multiArray,MSA)
+        else:
+            multiArray = tsArrayPackage.createMultiGameDict(inputCSVs,imageIndex,scratchFolder,TS_SEED,SEQUENTIAL_TS,pruning=pruning)
+            scores = convertScores(multiArray,MSA)
+        if(pruning is not None):
+            reportPruning(pruning,multiArray,inputCSVs,imageIndex,MSA,msaTimer)
+        copyImageIndex(dataFolder,MSA)
+        writeTable(scores,PERCEPTION_FOLDER + str(MSA) + "_perception_scores",STORAGE_FORMAT)
+        msaTimer.count(images=len(scores))
+    recordTaskComplete(MANIFEST_FILE,taskKey,taskInputs,taskOutputs)
+
+# test if the optional game pruning is on (see tsPackage.GamePruning)
+# OUTPUTS:
+#    true if PRUNE_SIGMA or PRUNE_QUALITY is set
+def isPruningOn():
+    return(PRUNE_SIGMA is not None or PRUNE_QUALITY is not None)
+
+# create one set of game pruning counters for each perception and comparison level
+# INPUTS:
+#    names (string array) - one name for each perception and comparison level
+# OUTPUTS:
+#    dictionary of kv pairs name:GamePruning, or None if pruning is off
+def createPruning(names):
+    if not(isPruningOn()):
+        return(None)
+    return({name:GamePruning(PRUNE_SIGMA,PRUNE_QUALITY) for name in names})
+
+# write the number of games skipped by pruning for each perception and comparison level of an MSA to the MSA's
+# pruning table.  If PRUNE_DIAGNOSTICS is true, every game is also applied without pruning, and rank
+# correlations between the pruned and full scores are added to the table
+# INPUTS:
+#    pruning (dictionary) - kv pairs of perception and comparison level names:GamePruning
+#    multiArray (MultiTSArray) - TS states scored with pruning
+#    inputCSVs (dictionary) - kv pairs of perception and comparison level names:list of prediction csvs
+#    imageIndex (ImageIndex) - image index for the MSA
+#    MSA (string) - current MSA
+#    msaTimer (StageTimer) - telemetry timer of the MSA, counts games and skipped games
+def reportPruning(pruning,multiArray,inputCSVs,imageIndex,MSA,msaTimer):
+    fullArray = None
+    if(PRUNE_DIAGNOSTICS):
+        scratchFolder = SCRATCH_FOLDER if TS_ENGINE=='stream' else None
+        fullArray = tsArrayPackage.createMultiGameDict(inputCSVs,imageIndex,scratchFolder,TS_SEED,SEQUENTIAL_TS)
+    records = []
+    for name,curPruning in pruning.items():
+        record = {'name':name}
+        record.update(curPruning.summarize())
+        if(fullArray is not None):
+            record.update(tsArrayPackage.calcRankAgreement(fullArray[name],multiArray[name]))
+        records.append(record)
+        msaTimer.count(games=curPruning.games,skippedGames=curPruning.skippedGames())
+    records = ps.DataFrame(records)
+    print("skipped %i of %i games in MSA %s" %(records['skippedGames'].sum(),records['games'].sum(),MSA))
+    writeTable(records,PERCEPTION_FOLDER + str(MSA) + "_pruning",STORAGE_FORMAT)
+
+# convert the TS states of an MSA into the wide perception scores table
+# INPUTS:
+#    multiArray (MultiTSArray) - TS states of all perceptions and comparison levels of the MSA
+#    MSA (string) - current MSA
+# OUTPUTS:
+#    pandas dataframe of normalized TS scores, one row per image
+def convertScores(multiArray,MSA):
+    with timeStage('convert',MSA=MSA) as timer:
+        scores = tsArrayPackage.convertMultiToDF(multiArray)
+        timer.count(rows=len(scores))
+    return(scores)
+
+# calculate TS scores for all perceptions and comparison levels of a single MSA in N_ORDERINGS independent
+# game orderings, and write the mean and spread of mu across orderings to the MSA's stability table.  Each
+# prediction csv is read once, no matter how many orderings are replayed.  Orderings run in the current CPU
+# worker, since MSAs are already spread across CPU workers by the job scheduler
+# INPUTS:
+#    inputCSVs (dictionary) - kv pairs of perception and comparison level names:list of prediction csvs
+#    imageIndex (ImageIndex) - image index for the MSA
+#    MSA (string) - current MSA
+# OUTPUTS:
+#    pandas dataframe of normalized TS scores, in the same format as tsArrayPackage.convertMultiToDF
+def processEnsembles(inputCSVs,imageIndex,MSA):
+    ensembles = {}
+    for position,(name,curCSVs) in enumerate(inputCSVs.items()):
+        curSeed = None if TS_SEED is None else TS_SEED + position
+        ensembles[name] = tsArrayPackage.createEnsembleGameDict(curCSVs,imageIndex,SCRATCH_FOLDER,N_ORDERINGS,curSeed,SEQUENTIAL_TS)
+    with timeStage('convert',MSA=MSA) as timer:
+        scores,stability = tsArrayPackage.convertEnsemblesToDF(ensembles)
+        timer.count(rows=len(scores))
+    writeTable(stability,PERCEPTION_FOLDER + str(MSA) + "_perception_stability",STORAGE_FORMAT)
+    return(scores)
+
+# load the TS state snapshot of an MSA and find the prediction csvs that were already applied to it.  If a csv
+# that was applied has since changed or been removed (e.g. predictions from a retrained model), the perception
+# and comparison level is rescored from the TS priors.  Other perceptions and comparison levels keep their states
+# INPUTS:
+#    dataFolder (string) - folder where siamese network perception model comparisons are stored
+#    imageIndex (ImageIndex) - current image index for the MSA
+#    inputCSVs (dictionary) - kv pairs of perception and comparison level names:list of prediction csvs
+# OUTPUTS:
+#    multiArray (MultiTSArray) - TS states loaded from the snapshot
+#    skipCSVs (set) - prediction csvs that are already applied to multiArray
+#    appliedFiles (dictionary) - kv pairs of names:dictionary of prediction csvs and their fingerprints, once the
+#                                remaining csvs are applied
+def resumeTSState(dataFolder,imageIndex,inputCSVs):
+    multiArray,snapshotFiles = tsArrayPackage.loadTSState(dataFolder + STATE_FILENAME,imageIndex,inputCSVs.keys(),SEQUENTIAL_TS)
+    skipCSVs, appliedFiles = set(), {}
+    for name,curCSVs in inputCSVs.items():
+        fingerprints = {inFile:fingerprintFiles([inFile]) for inFile in curCSVs}
+        applied = snapshotFiles.get(name,{})
+        if(any([fingerprints.get(inFile)!=fingerprint for inFile,fingerprint in applied.items()])):
+            print("predictions for %s changed since the TS state snapshot, rescoring from priors" %(name))
+            multiArray.reset(name)
+            applied = {}
+        skipCSVs.update(applied.keys())
+        appliedFiles[name] = fingerprints
+    return((multiArray,skipCSVs,appliedFiles))
+
+# get the size of all siamese network model prediction csvs for each MSA
+# INPUTS:
+#    MSAs (string array) - MSAs to calculate input sizes for
+# OUTPUTS:
+#    dictionary of kv pairs MSA:total bytes of siamese network model predictions
+def getMSASizes(MSAs):
+    MSASizes = {}
+    for curMSA in MSAs:
+        inFiles = getPredictionCSVs(COMPARISON_FOLDER + curMSA + "/")
+        MSASizes[curMSA] = sum([os.path.getsize(inFile) for inFile in inFiles if os.path.exists(inFile)])
+    return(MSASizes)
+
+# create the image index shared by all perceptions and comparison levels for a single MSA.  The index is
+# rebuilt if any of the siamese network model prediction csvs changed since it was created
+# INPUTS:
+#    MSAFolder (string) - folder where siamese network perception model comparisons are stored
+def processImageIndex(MSAFolder):
+    taskKey,taskInputs,taskOutputs = getIndexTask(MSAFolder)
+    if(isTaskComplete(MANIFEST_FILE,taskKey,taskInputs,taskOutputs)):
+        return
+    if(INCREMENTAL_TS and MULTI_LABEL_TS and os.path.exists(MSAFolder + STATE_FILENAME)):
+        imageIndex = extendImageIndex(MSAFolder,taskInputs)
+    else:
+        imageIndex = buildImageIndex(taskInputs)
+
+    # keep an identical existing index, so TS scores that depend on it are not recalculated
+    indexFile = MSAFolder + INDEX_FILENAME
+    if not(os.path.exists(indexFile) and np.array_equal(loadImageIndex(indexFile).names,imageIndex.names)):
+        saveImageIndex(imageIndex,indexFile)
+    recordTaskComplete(MANIFEST_FILE,taskKey,taskInputs,taskOutputs)
+
+# create the image index of an MSA from the images in its TS state snapshot, reading only the prediction csvs
+# that are new or changed since the snapshot.  Images that only appeared in changed or removed csvs stay in the
+# index, but are never compared and are left out of the perception scores
+# INPUTS:
+#    MSAFolder (string) - folder where siamese network perception model comparisons are stored
+#    inFiles (string array) - absolute filepaths to all prediction csvs of the MSA
+# OUTPUTS:
+#    ImageIndex containing every image in the snapshot or in any of the csvs
+def extendImageIndex(MSAFolder,inFiles):
+    snapshotNames,snapshotFiles = tsArrayPackage.readTSStateFiles(MSAFolder + STATE_FILENAME)
+    appliedFiles = {}
+    for fieldFiles in snapshotFiles.values():
+        appliedFiles.update(fieldFiles)
+    newFiles = [inFile for inFile in inFiles if appliedFiles.get(inFile)!=fingerprintFiles([inFile])]
+    if(len(newFiles)==0):
+        return(ImageIndex(snapshotNames))
+    return(ImageIndex(np.union1d(snapshotNames,buildImageIndex(newFiles).names)))
+
+# create one job for each MSA, perception, and comparison level, or one job for each MSA if MULTI_LABEL_TS is
+# true.  If image ids are interned, each MSA also has an image index job that must complete before the MSA's
+# TS jobs start
+# INPUTS:
+#    MSAs (string array) - MSAs to create jobs for
+# OUTPUTS:
+#    jobs (list of dictionaries) - jobs for jobScheduler.runJobs
+def createTSJobs(MSAs):
+    if(MULTI_LABEL_TS and not(INTERN_IMAGE_IDS and TS_ENGINE!='object')):
+        raise ValueError("MULTI_LABEL_TS requires INTERN_IMAGE_IDS and the array or stream TS_ENGINE")
+    jobs = []
+    for curMSA in MSAs:
+        MSAFolder = COMPARISON_FOLDER + curMSA + "/"
+        after = []
+        if(INTERN_IMAGE_IDS and TS_ENGINE!='object'):
+            inFiles = getPredictionCSVs(MSAFolder)
+            indexSize = sum([os.path.getsize(inFile) for inFile in inFiles])
+            jobs.append(createJob(curMSA + "_index",processImageIndex,(MSAFolder,),indexSize,MEMORY_BASE))
+            after = [curMSA + "_index"]
+
+        # csvs are scored one after another within the job, so memory depends on the largest csv
+        if(MULTI_LABEL_TS):
+            memory = MEMORY_BASE + max([estimateRowCount(inFile) for inFile in inFiles])*MEMORY_PER_ROW[TS_ENGINE]
+            jobs.append(createJob(curMSA + "_all_labels",processAllLabels,(MSAFolder,),indexSize,memory,after,curMSA))
+            continue
+        for dataTuple in prepParallel(MSAFolder,COMPARISON_LEVELS):
+            inFile = MSAFolder + "mturk_cate_" + dataTuple[1] + "_one_" + dataTuple[2] + ".csv"
+            memory = MEMORY_BASE + estimateRowCount(inFile)*MEMORY_PER_ROW[TS_ENGINE]
+            jobName = curMSA + "_" + dataTuple[1] + "_" + dataTuple[2]
+            jobs.append(createJob(jobName,processSingleLabel,(dataTuple,),os.path.getsize(inFile),memory,after,curMSA))
+    return(jobs)
 
 # main fuction
 if __name__ == '__main__':
 
-    # get list of MSAs to process, are remove MSAs that have already been processed
+    # stage timings of this process and all CPU workers are appended to the telemetry file
+    configureTelemetry(TELEMETRY_FILE)
+
+    # get list of MSAs to process
     MSAs = os.listdir(COMPARISON_FOLDER)
-    FinishedMSAs = ps.read_csv(PARENT_FOLDER + "FinishedMSA.csv")
-    FinishedMSAs = list(set(FinishedMSAs['MSA']))
 
-    # for each MSA that hasn't yet been processed, divide the work of calculating TS scores among multiple CPU workers,
-    # calculate TS scores for all perceptions and comparison levels, and combine all MSA TS perception scores into a single CSV
-    for curMSA in MSAs:
-        testOutput = PERCEPTION_FOLDER + curMSA + "_perception_scores.csv"
-        if(not os.path.exists(testOutput) and int(curMSA[4:5]) in WORKSTATION_NUMBERS):
-            print("calculating true skill scores for MSA %s" %(curMSA))
-            MSAFolder = COMPARISON_FOLDER + curMSA + "/"
-            
-            # partition work into tuples for spreading across multiple CPUS
-            parallelTuples = prepParallel(MSAFolder,COMPARISON_LEVELS)
-            pool = Pool(processes=len(parallelTuples))
-
-            # give each CPU one comparison level (2 total) and one perception label (5 total) to process (5x2 = 10 parallel CPUs)
-            # this required a lot of memory for large MSAs: needed 256GB RAM to parallel process large cities like NYC metro area.
-            res = pool.map_async(processSingleLabel,parallelTuples)
-            res.get()
-            FinishedMSAs.append(curMSA)
-            df = ps.DataFrame({
-                'MSA':FinishedMSAs
-            }).to_csv(PARENT_FOLDER + "FinishedMSA.csv",index=False)
-            combineTSScores(COMPARISON_FOLDER + curMSA + "/",curMSA)
+    # divide MSAs across workstations into shards with approximately equal input sizes, and remove MSAs
+    # whose tasks are all complete and up to date in the manifest
+    shard = assignShards(getMSASizes(MSAs),N_SHARDS)[NODE_ID]
+    MSAsToProcess = []
+    for curMSA in shard:
+        if not(isMSAComplete(curMSA)):
+            MSAsToProcess.append(curMSA)
         else:
-            print("already processed MSA %s" %(curMSA))
\ No newline at end of file
+            print("already processed MSA %s" %(curMSA))
+
+    # calculate TS scores for all MSAs, perceptions and comparison levels with a single pool of CPU workers.  Jobs
+    # for the largest inputs start first, and jobs only start if their estimated memory fits under MEMORY_LIMIT.
+    # When all perceptions and comparison levels for an MSA are complete, combine the MSA TS perception scores into a single CSV.
+    # Tasks that are already complete in the manifest return immediately
+    remainingJobs = {curMSA:len(LABELS)*len(COMPARISON_LEVELS) for curMSA in MSAsToProcess}
+    def onComplete(job,result):
+        # refresh the Prometheus-style progress file as jobs complete
+        if(getTelemetryFile() is not None):
+            writePrometheusFile(getTelemetryFile())
+        if(job['func'] is processAllLabels):
+            print("completed true skill scores for MSA %s" %(job['tag']))
+        if(job['func'] is not processSingleLabel):
+            return
+        curMSA = job['tag']
+        remainingJobs[curMSA] -=1
+        if(remainingJobs[curMSA]==0):
+            combineTSScores(COMPARISON_FOLDER + curMSA + "/",curMSA)
+            print("completed true skill scores for MSA %s" %(curMSA))
+    runJobs(createTSJobs(MSAsToProcess),N_WORKERS,MEMORY_LIMIT,onComplete)
+    if(getTelemetryFile() is not None):
+        writePrometheusFile(getTelemetryFile())
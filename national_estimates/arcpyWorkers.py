@@ -0,0 +1,274 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: runs arcpy stages of the national pipeline in parallel.  ArcPro CPU workers that share a scratch
+#          workspace overwrite each other's temporary datasets, so every worker is given its own scratch folder
+#          and scratch file geodatabase.  Tasks that fail on transient schema or file locks are retried, and
+#          outputs written to worker geodatabases are merged into the shared geodatabase by the main process.
+#          Setting the ARCPY_BACKEND environment variable to 'stub' replaces arcpy with a stub backend that
+#          implements the arcpy calls used by the pipeline with plain file operations, so the parallel
+#          execution can be tested on machines without ArcPro.
+
+# import dependencies
+from multiprocessing import Pool
+from types import SimpleNamespace
+import random
+import re
+import shutil
+import tempfile
+import time
+import json
+import os
+from telemetry import timeStage
+from rasterStorage import RASTER_NODATA, BLOCK_SIZE
+
+# define global constants
+BACKEND_NAME = os.environ.get('ARCPY_BACKEND','arcpy') # 'arcpy' or 'stub'
+SCRATCH_GDB_NAME = "scratch.gdb" # name of the scratch file geodatabase created in each worker folder
+MAX_RETRIES = 5 # number of times a task that failed on a lock is retried
+RETRY_WAIT = 5 # seconds to wait before the first retry.  The wait increases with each retry
+ARCPY_PIXEL_TYPE = "16_BIT_UNSIGNED" # arcpy name of the rasterStorage.RASTER_DTYPE pixel type
+ARCPY_PYRAMIDS = "PYRAMIDS -1 BILINEAR DEFLATE" # internal overviews of quantized rasters, down to the smallest level
+LOCK_ERRORS = [
+    'ERROR 000464', # cannot get exclusive schema lock
+    'ERROR 160706', # cannot acquire a lock
+    'ERROR 000210', # cannot create output, often because another process holds a lock
+    'being used by another process'
+]
+GENERIC_ERRORS = ['ERROR 999999'] # unexpected errors, only retried if the message also mentions a lock
+LOCK_MESSAGE = r"\block(s|ed)?\b|being used by another process" # text of generic errors caused by a lock (case insensitive)
+workerState = {} # scratch folder and geodatabase of the current CPU worker
+loadedBackend = {} # arcpy backend shared by all scripts in the current process
+
+# stand-in for the arcpy calls used by the pipeline.  Geoprocessing tools write small placeholder outputs that
+# record the call, so the control flow of each script (temporary outputs, renames, merges, and the manifest)
+# can be run and tested without ArcPro.  No spatial processing is done
+class StubArcpy:
+
+    # INPUTS:
+    #    lockFailureRate (float) - probability that a geoprocessing tool fails with a lock error, to test retries
+    def __init__(self,lockFailureRate=0.0):
+        self.lockFailureRate = lockFailureRate
+        self.calls = []
+        self.env = SimpleNamespace(overwriteOutput=False,scratchWorkspace=None,workspace=None)
+        self.management = SimpleNamespace(
+            CreateFileGDB=lambda folder,name,*args,**kwargs: self.createFolder(os.path.join(folder,name)),
+            Delete=lambda path,*args,**kwargs: self.delete(path),
+            Rename=lambda path,outPath,*args,**kwargs: self.rename(path,outPath),
+            Copy=lambda path,outPath,*args,**kwargs: self.copy(path,outPath),
+            XYTableToPoint=lambda inTable,outFeatures,*args,**kwargs: self.runTool('XYTableToPoint',outFeatures,inTable),
+            ProjectRaster=lambda in_raster,out_raster,*args,**kwargs: self.runTool('ProjectRaster',out_raster,in_raster),
+            CopyRaster=lambda in_raster,out_rasterdataset,*args,**kwargs: self.runTool('CopyRaster',out_rasterdataset,in_raster)
+        )
+        self.conversion = SimpleNamespace(
+            PointToRaster=lambda in_features,value_field,out_rasterdataset,*args,**kwargs: self.runTool('PointToRaster',out_rasterdataset,in_features)
+        )
+        self.sa = SimpleNamespace(Int=lambda raster: self.runRasterTool('Int',raster))
+        self.ia = SimpleNamespace(FocalStatistics=lambda in_raster,*args,**kwargs: self.runRasterTool('FocalStatistics',in_raster))
+
+    def Exists(self,path):
+        return(os.path.exists(path))
+
+    def Raster(self,path):
+        return(StubRaster(self,path))
+
+    def createFolder(self,path):
+        os.makedirs(path,exist_ok=True)
+
+    def delete(self,path):
+        if(os.path.isdir(path)):
+            shutil.rmtree(path)
+        elif(os.path.exists(path)):
+            os.remove(path)
+
+    def rename(self,path,outPath):
+        self.failOnLock('Rename')
+        os.replace(path,outPath)
+
+    def copy(self,path,outPath):
+        self.failOnLock('Copy')
+        if(os.path.isdir(path)):
+            shutil.copytree(path,outPath)
+        else:
+            shutil.copyfile(path,outPath)
+
+    # randomly fail with a lock error, at the rate set by lockFailureRate
+    def failOnLock(self,tool):
+        if(random.random()<self.lockFailureRate):
+            raise RuntimeError("ERROR 000464: Cannot get exclusive schema lock (stub %s)" %(tool))
+
+    # record a geoprocessing tool call and write a placeholder output
+    # INPUTS:
+    #    tool (string) - name of the tool
+    #    outPath (string) - output of the tool
+    #    inPath (string) - input of the tool
+    def runTool(self,tool,outPath,inPath):
+        self.failOnLock(tool)
+        inPath = inPath.path if isinstance(inPath,StubRaster) else inPath
+        self.calls.append((tool,inPath,outPath))
+        os.makedirs(os.path.dirname(outPath),exist_ok=True)
+        with open(outPath,'w') as f:
+            json.dump({'tool':tool,'input':inPath,'pid':os.getpid(),'scratch':self.env.scratchWorkspace},f)
+
+    # record a tool that returns a raster object rather than writing an output
+    def runRasterTool(self,tool,raster):
+        self.failOnLock(tool)
+        inPath = raster.path if isinstance(raster,StubRaster) else raster
+        self.calls.append((tool,inPath,None))
+        return(StubRaster(self,inPath))
+
+# raster object returned by the stub backend
+class StubRaster:
+
+    # INPUTS:
+    #    backend (StubArcpy) - backend that created the raster
+    #    path (string) - filepath of the raster the object was created from
+    def __init__(self,backend,path):
+        self.backend = backend
+        self.path = path
+
+    def save(self,outPath):
+        self.backend.runTool('save',outPath,self.path)
+
+# load the arcpy backend for the current process.  All scripts that call this share the same backend
+# OUTPUTS:
+#    arcpy module, StubArcpy if ARCPY_BACKEND is 'stub', or None if arcpy is not installed
+def loadArcpy():
+    if(BACKEND_NAME not in loadedBackend):
+        if(BACKEND_NAME=='stub'):
+            loadedBackend[BACKEND_NAME] = StubArcpy(float(os.environ.get('ARCPY_STUB_LOCK_RATE','0')))
+        else:
+            try:
+                import arcpy
+                loadedBackend[BACKEND_NAME] = arcpy
+            except ImportError:
+                loadedBackend[BACKEND_NAME] = None
+    return(loadedBackend[BACKEND_NAME])
+
+# give the current CPU worker its own scratch folder and scratch file geodatabase.  Used as the pool initializer
+# INPUTS:
+#    scratchFolder (string) - absolute folderpath where worker folders are created
+def initWorker(scratchFolder):
+    arcpy = loadArcpy()
+    workerFolder = os.path.join(scratchFolder,"worker_" + str(os.getpid()))
+    os.makedirs(workerFolder,exist_ok=True)
+    workerGDB = os.path.join(workerFolder,SCRATCH_GDB_NAME)
+    if not(arcpy.Exists(workerGDB)):
+        arcpy.management.CreateFileGDB(workerFolder,SCRATCH_GDB_NAME)
+    arcpy.env.scratchWorkspace = workerGDB
+    arcpy.env.overwriteOutput = True
+    # ArcPro and python write some temporary files to the TEMP folder rather than the scratch workspace
+    os.environ['TEMP'] = os.environ['TMP'] = workerFolder
+    tempfile.tempdir = workerFolder
+    workerState['folder'] = workerFolder
+    workerState['gdb'] = workerGDB
+
+# get the scratch file geodatabase of the current CPU worker
+# OUTPUTS:
+#    absolute filepath of the geodatabase, or None if the current process is not a worker created by runParallel
+def getWorkerGDB():
+    return(workerState.get('gdb'))
+
+# test if an exception was caused by a transient lock.  Generic errors (e.g. ERROR 999999) are only lock errors
+# if the message mentions a lock, so unexplained geoprocessing failures are raised without retrying
+# INPUTS:
+#    error (exception) - exception raised by a task
+# OUTPUTS:
+#    true if the task may succeed if retried
+def isLockError(error):
+    message = str(error)
+    if(any([lockError in message for lockError in LOCK_ERRORS])):
+        return(True)
+    if(any([genericError in message for genericError in GENERIC_ERRORS])):
+        return(re.search(LOCK_MESSAGE,message,re.IGNORECASE) is not None)
+    return(False)
+
+# run a task in a CPU worker, retrying tasks that fail on transient locks.  Tasks must be safe to rerun, e.g.
+# by writing outputs to temporary paths and skipping tasks that are complete in the manifest
+# INPUTS:
+#    taskTuple (tuple) - (function, tuple of arguments)
+# OUTPUTS:
+#    value returned by the function
+def runTask(taskTuple):
+    func,args = taskTuple
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            with timeStage('arcpy_task',task=func.__name__,args=str(args),attempt=attempt):
+                return(func(*args))
+        except Exception as error:
+            if(attempt==MAX_RETRIES or not isLockError(error)):
+                raise
+            print("lock error in worker %i, retrying in %i seconds: %s" %(os.getpid(),RETRY_WAIT*(attempt + 1),str(error)))
+            time.sleep(RETRY_WAIT*(attempt + 1))
+
+# run tasks on a pool of CPU workers that each have their own scratch workspace.  After all tasks complete, the
+# worker scratch folders are removed
+# INPUTS:
+#    func (function) - top-level function to run for each task
+#    argsList (list of tuples) - arguments of each task
+#    nWorkers (int) - number of CPU workers
+#    scratchFolder (string) - absolute folderpath where worker folders are created
+#    onResult (function) - optional, called in the main process with (args, result) after each task completes,
+#                          while worker geodatabases still exist, e.g. to merge worker outputs
+# OUTPUTS:
+#    list of values returned by func, in the order of argsList
+def runParallel(func,argsList,nWorkers,scratchFolder,onResult=None):
+    os.makedirs(scratchFolder,exist_ok=True)
+    results = [None]*len(argsList)
+    pool = Pool(processes=nWorkers,initializer=initWorker,initargs=(scratchFolder,))
+    try:
+        taskTuples = [(func,args) for args in argsList]
+        for index,result in enumerate(pool.imap(runTask,taskTuples,chunksize=1)):
+            results[index] = result
+            if(onResult is not None):
+                onResult(argsList[index],result)
+    except BaseException:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+    for workerFolder in os.listdir(scratchFolder):
+        if(workerFolder.startswith("worker_")):
+            shutil.rmtree(os.path.join(scratchFolder,workerFolder),ignore_errors=True)
+    return(results)
+
+# move an output from a worker geodatabase into its final location, replacing an existing output.  Outputs
+# are copied between geodatabases by the main process only, so the shared geodatabase is never locked by
+# more than one process.  Other applications (e.g. ArcPro with the geodatabase open) can still hold locks, so
+# merges that fail on a lock are retried
+# INPUTS:
+#    tempPath (string) - absolute path of the completed output, e.g. in a worker geodatabase
+#    outPath (string) - absolute path of the final output
+def mergeOutput(tempPath,outPath):
+    runTask((replaceOutput,(tempPath,outPath)))
+
+# save an integer raster as a uint16 Cloud Optimized GeoTIFF with internal overviews, the same format as the
+# rasters written by rasterStorage
+# INPUTS:
+#    raster (arcpy Raster) - integer raster with values from 0 to 1000
+#    outRaster (string) - absolute filepath of the COG
+def saveQuantizedRaster(raster,outRaster):
+    arcpy = loadArcpy()
+    arcpy.env.pyramid = ARCPY_PYRAMIDS
+    arcpy.env.compression = "DEFLATE"
+    arcpy.env.tileSize = "%i %i" %(BLOCK_SIZE,BLOCK_SIZE)
+    arcpy.management.CopyRaster(
+        in_raster=raster,
+        out_rasterdataset=outRaster,
+        nodata_value=str(RASTER_NODATA),
+        pixel_type=ARCPY_PIXEL_TYPE,
+        format="COG"
+    )
+
+# replace an output with a completed temporary output
+# INPUTS:
+#    tempPath (string) - absolute path of the completed output
+#    outPath (string) - absolute path of the final output
+def replaceOutput(tempPath,outPath):
+    arcpy = loadArcpy()
+    if(arcpy.Exists(outPath)):
+        arcpy.management.Delete(outPath)
+    if(os.path.dirname(tempPath)==os.path.dirname(outPath)):
+        arcpy.management.Rename(tempPath,outPath)
+    else:
+        arcpy.management.Copy(tempPath,outPath)
+        arcpy.management.Delete(tempPath)
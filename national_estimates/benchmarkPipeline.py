@@ -0,0 +1,344 @@
+########### benchmarkPipeline.py ###########
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: benchmark the TrueSkill and georeferencing stages of the national pipeline with synthetic data.
+#          Generates siamese network model prediction csvs, TS score tables, and matching IdLink and rasterLink
+#          tables for MSAs from small town to NYC scale, then times each stage in a fresh CPU worker and reports
+#          rows per second and peak memory as JSON lines.  Results can be compared against a baseline file to
+#          catch performance regressions, and against each other to compare TS engines.
+
+# import dependencies
+import numpy as np
+import pandas as ps
+import json
+import time
+import os
+from multiprocessing import Pool
+import tsPackage
+import tsArrayPackage
+import tsKernel
+import CalcNationalTS
+import combineImageTS
+from imageIndex import buildImageIndex, saveImageIndex, loadImageIndex, INDEX_FILENAME
+from tableStorage import writeTable, DEFAULT_FORMAT
+from telemetry import getPeakRSS
+try:
+    # createPerceptionGeoDatabase imports arcpy, so combineGeo is only benchmarked where arcpy is installed
+    import createPerceptionGeoDatabase
+except ImportError:
+    createPerceptionGeoDatabase = None
+
+# define global constants
+BENCHMARK_FOLDER = "insert absolute folderpath where synthetic benchmark data and results are stored"
+RESULTS_FILE = BENCHMARK_FOLDER + "benchmark_results.jsonl" # benchmark results are appended as JSON lines
+BASELINE_FILE = BENCHMARK_FOLDER + "benchmark_baseline.jsonl" # optional, results to compare against
+REGRESSION_TOLERANCE = 0.2 # report stages that are more than 20% slower or larger than the baseline
+MSA_SIZES = { # number of images and mean comparisons per image for each synthetic MSA size
+    'small_town':{'images':2000,'comparisons':20},
+    'mid_size':{'images':50000,'comparisons':20},
+    'large_metro':{'images':500000,'comparisons':20},
+    'nyc':{'images':3000000,'comparisons':20}
+}
+SIZES_TO_RUN = ['small_town','mid_size'] # MSA sizes benchmarked when run as a script
+TS_ENGINES = ['object','array','array_sequential','stream','stream_sequential'] # createGameDict variants to compare
+OBJECT_ENGINE_MAX_ROWS = 2000000 # the per-image TS objects in tsPackage are skipped for larger csvs
+LABELS = CalcNationalTS.LABELS
+COMPARISON_LEVELS = CalcNationalTS.COMPARISON_LEVELS
+RASTER_YEARS = combineImageTS.RASTER_YEARS
+IMAGES_PER_PANORAMA = 4 # street view images at each location, one per viewing angle
+IMG_PREFIX = "images/" # prefix added to image filenames during siamese network processing
+DEGREE_SIGMA = 0.75 # spread of the lognormal distribution of comparisons per image
+WRITE_CHUNK = 1000000 # number of synthetic rows generated and written at a time
+SEED = 20260 # seed for all synthetic data, so every run benchmarks the same data
+
+# create synthetic image filenames in the same 20 character format as street view images
+# INPUTS:
+#    nImages (int) - number of images
+# OUTPUTS:
+#    string array of image filenames, without the siamese network prefix
+def createImgIds(nImages):
+    imgIds = np.arange(nImages)
+    panoramas = imgIds // IMAGES_PER_PANORAMA
+    angles = imgIds % IMAGES_PER_PANORAMA
+    return(np.array([
+        "%05d_%06d_%02d%s.png" %(panorama // 1000000,panorama % 1000000,angle,'NESW'[angle])
+        for panorama,angle in zip(panoramas.tolist(),angles.tolist())
+    ]))
+
+# create synthetic siamese network model predictions.  Images are compared a lognormally distributed number of
+# times, so a few images appear in many comparisons and most appear in a few, and predictions are spread
+# across all outcome levels
+# INPUTS:
+#    outFile (string) - absolute filepath of the csv to create
+#    imgIds (string array) - image filenames
+#    nRows (int) - number of comparisons
+#    rng (numpy Generator) - random number generator
+def writePredictionCSV(outFile,imgIds,nRows,rng):
+    weights = rng.lognormal(0,DEGREE_SIGMA,len(imgIds))
+    cumWeights = np.cumsum(weights/weights.sum())
+    prefixed = np.char.add(IMG_PREFIX,imgIds)
+    header = True
+    for start in range(0,nRows,WRITE_CHUNK):
+        nChunk = min(WRITE_CHUNK,nRows-start)
+        left = np.minimum(np.searchsorted(cumWeights,rng.random(nChunk)),len(imgIds)-1)
+        right = np.minimum(np.searchsorted(cumWeights,rng.random(nChunk)),len(imgIds)-1)
+        right = np.where(left==right,(right + 1) % len(imgIds),right)
+        ps.DataFrame({
+            'pred':np.rint(rng.beta(2,2,nChunk)*100).astype(np.int64),
+            'l_img':prefixed[left],
+            'r_img':prefixed[right]
+        }).to_csv(outFile,index=False,header=header,mode='w' if header else 'a')
+        header = False
+
+# create synthetic TS score tables with interned image codes, in the format written by processSingleLabel
+# INPUTS:
+#    MSAFolder (string) - folder where the tables are written
+#    nImages (int) - number of images in the image index
+#    rng (numpy Generator) - random number generator
+def writeTSScoreTables(MSAFolder,nImages,rng):
+    for label in LABELS:
+        for comparisonLevel in COMPARISON_LEVELS:
+            mu = rng.normal(25,3,nImages)
+            df = ps.DataFrame({
+                'mu':mu,
+                'sigma':rng.uniform(1,6.8,nImages),
+                'img_id':np.arange(nImages,dtype=np.int32),
+                'n':rng.integers(1,60,nImages)
+            })
+            df[label + "_" + comparisonLevel] = tsPackage.min_max_scaling(df['mu'])*100
+            writeTable(df,MSAFolder + "ts_scores_" + label + "_" + comparisonLevel,DEFAULT_FORMAT)
+
+# create synthetic GSV metadata: an IdLink table linking image filenames to panoramas, and a rasterLink table
+# with the location, date, and raster year of each panorama
+# INPUTS:
+#    sizeFolder (string) - folder where the synthetic data for one MSA size is stored
+#    MSA (string) - synthetic MSA name
+#    imgIds (string array) - image filenames
+#    rng (numpy Generator) - random number generator
+def writeGeoLinkTables(sizeFolder,MSA,imgIds,rng):
+    panIds = np.char.add("pan_",np.char.zfill((np.arange(len(imgIds)) // IMAGES_PER_PANORAMA).astype(str),8))
+    ps.DataFrame({'filename':imgIds,'panId':panIds}).to_csv(sizeFolder + "IdLink/" + MSA + ".csv",index=False)
+    uniquePanIds = np.unique(panIds)
+    nPanoramas = len(uniquePanIds)
+    ps.DataFrame({
+        'panId':uniquePanIds,
+        'gridId':rng.integers(0,100000,nPanoramas),
+        'GEOID':rng.integers(0,100000,nPanoramas),
+        'county':rng.integers(0,100,nPanoramas),
+        'imgMonth':rng.integers(1,13,nPanoramas),
+        'fileName':uniquePanIds,
+        'rasterDiff':rng.integers(0,3,nPanoramas),
+        't':rng.integers(0,4,nPanoramas),
+        'imgLat':rng.uniform(40.5,40.9,nPanoramas),
+        'imgLon':rng.uniform(-74.2,-73.7,nPanoramas),
+        'imgYear':rng.integers(2007,2022,nPanoramas),
+        'rasterYear':rng.choice(RASTER_YEARS,nPanoramas)
+    }).to_csv(sizeFolder + "rasterLink.csv",index=False)
+
+# generate all synthetic data for one MSA size, unless it was already generated
+# INPUTS:
+#    sizeName (string) - key in MSA_SIZES
+# OUTPUTS:
+#    absolute folderpath where the synthetic data is stored
+def generateSyntheticMSA(sizeName):
+    sizeFolder = BENCHMARK_FOLDER + sizeName + "/"
+    MSAFolder = sizeFolder + sizeName + "/"
+    completeFile = sizeFolder + "complete.json"
+    if(os.path.exists(completeFile)):
+        return(sizeFolder)
+    for folder in [MSAFolder,sizeFolder + "IdLink/",sizeFolder + "Perceptions/",sizeFolder + "GeoReferenced/"]:
+        os.makedirs(folder,exist_ok=True)
+    rng = np.random.default_rng(SEED)
+    nImages = MSA_SIZES[sizeName]['images']
+    nRows = nImages*MSA_SIZES[sizeName]['comparisons']//2
+    imgIds = createImgIds(nImages)
+    inFiles = CalcNationalTS.getPredictionCSVs(MSAFolder)
+    for inFile in inFiles:
+        writePredictionCSV(inFile,imgIds,nRows,rng)
+    saveImageIndex(buildImageIndex(inFiles),MSAFolder + INDEX_FILENAME)
+    writeTSScoreTables(MSAFolder,len(loadImageIndex(MSAFolder + INDEX_FILENAME)),rng)
+    writeGeoLinkTables(sizeFolder,sizeName,imgIds,rng)
+    with open(completeFile,'w') as f:
+        json.dump({'images':nImages,'rows':nRows,'seed':SEED},f)
+    print("generated synthetic data for %s" %(sizeName))
+    return(sizeFolder)
+
+# point the pipeline scripts at the synthetic data for one MSA size.  Called inside the CPU worker that runs
+# the stage, so the settings never leak into other benchmarks
+# INPUTS:
+#    sizeFolder (string) - folder where the synthetic data for one MSA size is stored
+def configurePipeline(sizeFolder):
+    CalcNationalTS.PERCEPTION_FOLDER = sizeFolder + "Perceptions/"
+    CalcNationalTS.MANIFEST_FILE = sizeFolder + "benchmark_manifest_" + str(os.getpid()) + ".db"
+    CalcNationalTS.STORAGE_FORMAT = DEFAULT_FORMAT
+    combineImageTS.PERCEPTIONS_FOLDER = sizeFolder + "Perceptions/"
+    combineImageTS.LINK_FOLDER = sizeFolder + "IdLink/"
+    combineImageTS.GEOREFERENCED_FOLDER = sizeFolder + "GeoReferenced/"
+    combineImageTS.STORAGE_FORMAT = DEFAULT_FORMAT
+    combineImageTS.MANIFEST_FILE = CalcNationalTS.MANIFEST_FILE
+    if(createPerceptionGeoDatabase is not None):
+        createPerceptionGeoDatabase.GEO_FOLDER = sizeFolder + "GeoReferenced/"
+        createPerceptionGeoDatabase.MANIFEST_FILE = CalcNationalTS.MANIFEST_FILE
+        createPerceptionGeoDatabase.STORAGE_FORMAT = DEFAULT_FORMAT
+
+# calculate multinomial TS scores for one csv with one of the TS engines
+# INPUTS:
+#    engine (string) - one of TS_ENGINES
+#    inFile (string) - absolute filepath to the siamese network model prediction csv
+#    MSAFolder (string) - folder where the csv and image index are stored
+#    scratchFolder (string) - folder for temporary shuffle buckets
+# OUTPUTS:
+#    game dictionary (dictionary of TS objects or TSArray)
+def runTSEngine(engine,inFile,MSAFolder,scratchFolder):
+    imageIndex = loadImageIndex(MSAFolder + INDEX_FILENAME)
+    sequential = engine.endswith('_sequential')
+    if(engine=='object'):
+        return(tsPackage.createGameDict(inFile,seed=SEED))
+    if(engine.startswith('stream')):
+        return(tsArrayPackage.createGameDictStreaming(inFile,scratchFolder,seed=SEED,imageIndex=imageIndex,sequential=sequential))
+    return(tsArrayPackage.createGameDict(inFile,imageIndex,seed=SEED,sequential=sequential))
+
+# run and time a single stage of the pipeline on the synthetic data for one MSA size.  Runs in a fresh CPU
+# worker so peak memory only includes the current stage and its setup
+# INPUTS:
+#    stage (string) - 'createGameDict', 'convertDictToDF', 'combineTSScores', 'geoLinkData', or 'combineGeo'
+#    engine (string) - TS engine for createGameDict and convertDictToDF, None otherwise
+#    sizeName (string) - key in MSA_SIZES
+# OUTPUTS:
+#    result (dictionary) - benchmark result
+def runStage(stage,engine,sizeName):
+    sizeFolder = BENCHMARK_FOLDER + sizeName + "/"
+    MSAFolder = sizeFolder + sizeName + "/"
+    configurePipeline(sizeFolder)
+    inFile = CalcNationalTS.getPredictionCSVs(MSAFolder)[0]
+
+    # setup that is not timed.  Georeferencing stages start from the combined perception scores
+    if(stage=='convertDictToDF'):
+        gameDict = runTSEngine(engine,inFile,MSAFolder,sizeFolder + "Scratch/")
+    elif(stage in ['geoLinkData','combineGeo']):
+        CalcNationalTS.combineTSScores(MSAFolder,sizeName)
+        geoData = combineImageTS.loadGeoLink(sizeFolder + "rasterLink.csv")
+    if(stage=='combineGeo'):
+        linkedData = combineImageTS.geoLinkData(geoData,sizeName)
+        combineImageTS.saveMSAYearSubsets(linkedData,sizeName)
+        nRows = int((linkedData['rasterYear']==RASTER_YEARS[0]).sum())
+
+    # compile the TS kernel before timing, so rows per second doesn't include numba compilation
+    compileSeconds = None
+    if(stage in ['createGameDict','convertDictToDF'] and engine!='object'):
+        startTime = time.perf_counter()
+        tsKernel.warmUp()
+        compileSeconds = time.perf_counter() - startTime
+
+    startTime = time.perf_counter()
+    if(stage=='createGameDict'):
+        runTSEngine(engine,inFile,MSAFolder,sizeFolder + "Scratch/")
+        nRows = json.load(open(sizeFolder + "complete.json"))['rows']
+    elif(stage=='convertDictToDF'):
+        # same arguments as CalcNationalTS.processSingleLabel, which drops uncompared images for indexed engines
+        nRows = len(tsPackage.convertDictToDF(gameDict,LABELS[0] + "_" + COMPARISON_LEVELS[0],comparedOnly=engine!='object'))
+    elif(stage=='combineTSScores'):
+        CalcNationalTS.combineTSScores(MSAFolder,sizeName)
+        nRows = MSA_SIZES[sizeName]['images']*len(LABELS)*len(COMPARISON_LEVELS)
+    elif(stage=='geoLinkData'):
+        nRows = len(combineImageTS.geoLinkData(geoData,sizeName))
+    elif(stage=='combineGeo'):
+        createPerceptionGeoDatabase.combineGeo(RASTER_YEARS[0])
+    seconds = time.perf_counter() - startTime
+
+    if(os.path.exists(CalcNationalTS.MANIFEST_FILE)):
+        os.remove(CalcNationalTS.MANIFEST_FILE)
+    return({
+        'stage':stage,
+        'engine':engine,
+        'size':sizeName,
+        'images':MSA_SIZES[sizeName]['images'],
+        'rows':nRows,
+        'seconds':seconds,
+        'compileSeconds':compileSeconds,
+        'rowsPerSecond':nRows/seconds if seconds>0 else None,
+        'peakRSSBytes':getPeakRSS(),
+        'timestamp':time.time()
+    })
+
+# list the stages to benchmark for one MSA size
+# INPUTS:
+#    sizeName (string) - key in MSA_SIZES
+# OUTPUTS:
+#    list of (stage, engine, sizeName) tuples
+def prepBenchmarks(sizeName):
+    nRows = MSA_SIZES[sizeName]['images']*MSA_SIZES[sizeName]['comparisons']//2
+    benchmarks = []
+    for engine in TS_ENGINES:
+        if(engine=='object' and nRows>OBJECT_ENGINE_MAX_ROWS):
+            continue
+        benchmarks.append(('createGameDict',engine,sizeName))
+    for engine in ['object','array_sequential']:
+        if(engine=='object' and nRows>OBJECT_ENGINE_MAX_ROWS):
+            continue
+        benchmarks.append(('convertDictToDF',engine,sizeName))
+    benchmarks += [('combineTSScores',None,sizeName),('geoLinkData',None,sizeName)]
+    if(createPerceptionGeoDatabase is not None):
+        benchmarks.append(('combineGeo',None,sizeName))
+    else:
+        print("skipping combineGeo, arcpy is not installed")
+    return(benchmarks)
+
+# run benchmarks, each in a fresh CPU worker, and append the results to a JSON lines file
+# INPUTS:
+#    benchmarks (list of tuples) - (stage, engine, sizeName) tuples created by prepBenchmarks
+#    outFile (string) - absolute filepath of the JSON lines file
+# OUTPUTS:
+#    list of benchmark results
+def runBenchmarks(benchmarks,outFile=RESULTS_FILE):
+    results = []
+    for benchmark in benchmarks:
+        with Pool(processes=1) as pool:
+            result = pool.apply(runStage,benchmark)
+        print(json.dumps(result))
+        with open(outFile,'a') as f:
+            f.write(json.dumps(result) + "\n")
+        results.append(result)
+    return(results)
+
+# compare benchmark results against a baseline, matching results by stage, engine, and MSA size
+# INPUTS:
+#    results (list of dictionaries) - benchmark results
+#    baselineFile (string) - absolute filepath of a JSON lines file of baseline results.  The last baseline
+#                            result for each stage, engine, and MSA size is used
+#    tolerance (float) - fractional increase in seconds or peak memory reported as a regression
+# OUTPUTS:
+#    list of dictionaries describing each regression
+def compareToBaseline(results,baselineFile=BASELINE_FILE,tolerance=REGRESSION_TOLERANCE):
+    baseline = {}
+    with open(baselineFile) as f:
+        for line in f:
+            record = json.loads(line)
+            baseline[(record['stage'],record['engine'],record['size'])] = record
+    regressions = []
+    for result in results:
+        key = (result['stage'],result['engine'],result['size'])
+        if(key not in baseline):
+            continue
+        for metric in ['seconds','peakRSSBytes']:
+            if(result[metric] is None or baseline[key][metric] is None):
+                continue
+            if(result[metric] > baseline[key][metric]*(1 + tolerance)):
+                regressions.append({
+                    'stage':key[0],'engine':key[1],'size':key[2],'metric':metric,
+                    'baseline':baseline[key][metric],'current':result[metric]
+                })
+    return(regressions)
+
+# main function
+if __name__ == '__main__':
+    benchmarks = []
+    for sizeName in SIZES_TO_RUN:
+        generateSyntheticMSA(sizeName)
+        benchmarks += prepBenchmarks(sizeName)
+    results = runBenchmarks(benchmarks)
+    if(os.path.exists(BASELINE_FILE)):
+        regressions = compareToBaseline(results)
+        for regression in regressions:
+            print("regression: %s" %(json.dumps(regression)))
+        print("%i regressions compared to %s" %(len(regressions),BASELINE_FILE))
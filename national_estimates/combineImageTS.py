@@ -8,94 +8,215 @@
 
 #import dependencies
 import pandas as ps
+import numpy as np
 import os
+from imageIndex import loadImageIndex, INDEX_FILENAME
+from geoLinkIndex import buildGeoLinkIndex, saveGeoLinkIndex, loadGeoLinkIndex, getGeoLinkIndexFiles, groupMeans, PANID_FIELD
+from jobScheduler import createJob, runJobs, estimateRowCount
+from pipelineManifest import createTaskKey, isTaskComplete, recordTaskComplete, MANIFEST_FILENAME
+from tableStorage import readTable, writePartition, getPartitionFolder, getTablePath, PARTITION_FILENAME, DEFAULT_FORMAT
+from telemetry import timeStage, configureTelemetry, getTelemetryFile, writePrometheusFile
 
 # define global constants
 RASTER_YEARS = [2008,2012,2016,2020]
 PARENT_FOLDER = "insert abolute filepath to where project is stored here"
 PERCEPTIONS_FOLDER = PARENT_FOLDER + "Perceptions/" # where TS perception scores are stored
 LINK_FOLDER = PARENT_FOLDER + "IdLink/" # where GSV metadata (for linking and georeferencing) is stored
-GEOREFERENCED_FOLDER = PARENT_FOLDER + "GeoReferenced/" # where georeferenced perception estimates are stored
+GEOREFERENCED_FOLDER = PARENT_FOLDER + "GeoReferenced/" # where georeferenced perception estimates are stored, partitioned by year and MSA
 GEODATABASE_FOLDER = PARENT_FOLDER + "PerceptionGDB.gdb"
-
-# load GSV metadata from file and drop uneeded variables to reduce memory footprint
+GEO_LINK_FILE = PARENT_FOLDER + "BEACON_comparison_setup/rasterLink.csv" # GSV metadata for georeferencing
+GEO_LINK_INDEX = PARENT_FOLDER + "BEACON_comparison_setup/rasterLink" # GSV metadata sorted by panorama id, memory-mapped by every CPU worker
+N_WORKERS = 8 # number of CPU workers that georeference MSAs
+MEMORY_LIMIT = 64*1024**3 # maximum estimated memory (bytes) of MSAs georeferenced at the same time
+MEMORY_BASE = 512*1024**2 # estimated memory (bytes) of georeferencing an MSA, independent of the MSA size
+MEMORY_PER_ROW = 2000 # rough estimated memory (bytes) per image in the MSA
+MANIFEST_FILE = PARENT_FOLDER + MANIFEST_FILENAME # tracks completed tasks so interrupted runs resume where they stopped
+STORAGE_FORMAT = DEFAULT_FORMAT # format of perception score and georeferenced tables, 'parquet' (requires pyarrow) or 'csv'
+TELEMETRY_FILE = None # absolute filepath of a JSON lines file where stage timings, throughput, and memory are appended.  If None, telemetry is off unless the NSV_TELEMETRY_FILE environment variable is set
+LABEL_CODES = {
+    'beauty':'be',
+    'nature':'na',
+    'relaxing':'re',
+    'safe_walk':'sw',
+    'safe_crime':'sc'
+}
+COMPARISON_CODES = {
+    'census_tract':'ct',
+    'city':'ci'
+}
+
+# load the GSV metadata index, creating it from the metadata csv if it does not exist or the csv changed
+# since it was created.  The index is memory-mapped, so loading it does not read the national table into memory
 # INPUTS:
 #    inFilepath (string) - absolute filepath to metadata csv
+#    indexPath (string) - absolute filepath of the index, without suffix.  Defaults to the csv filepath without
+#                         file extension
 # OUTPUTS:
-#    GSV metadata as a pandas dataframe
-def loadGeoLink(inFilepath):
-    geoLink = ps.read_csv(inFilepath)
-    geoLink.drop(['gridId','GEOID','county','imgMonth','fileName','rasterDiff','t'],axis=1,inplace=True)
-    print("completed loading georeferenced data")
-    return geoLink
+#    GSV metadata as a GeoLinkIndex
+def loadGeoLink(inFilepath,indexPath=None):
+    indexPath = indexPath or os.path.splitext(inFilepath)[0]
+    taskKey = createTaskKey('geo_link_index')
+    indexFiles = getGeoLinkIndexFiles(indexPath)
+    if not(isTaskComplete(MANIFEST_FILE,taskKey,[inFilepath],indexFiles)):
+        saveGeoLinkIndex(buildGeoLinkIndex(inFilepath),indexPath)
+        recordTaskComplete(MANIFEST_FILE,taskKey,[inFilepath],indexFiles)
+        print("completed creating georeferenced data index")
+    return(loadGeoLinkIndex(indexPath))
 
 # join perceptions and GSV metadata for a single MSA. Average perceptions for locations with multiple 
 # viewing angles and perception scores
 # INPUTS:
-#    geoData (pandas dataframe) - contains GSV metadata include panoid and latitude,longitude
+#    geoData (GeoLinkIndex) - GSV metadata include panoid and latitude,longitude
 #    curMSA (string) - MSA to created joined data for
 # OUTPUTS:
 #    joinedAvgs (pandas dataframe) - perceptions and GSV metadata joined into a single pandas dataframe
 def geoLinkData(geoData,curMSA):
-    perceptionData = ps.read_csv(PERCEPTIONS_FOLDER + curMSA + "_perception_scores.csv")
+    indexFile = PERCEPTIONS_FOLDER + curMSA + "_" + INDEX_FILENAME
     idLinker = ps.read_csv(LINK_FOLDER + curMSA + ".csv")
     idLinker = idLinker.rename({'filename': 'img_id'}, axis=1) 
 
-    # join GSV metadata and perceptions
-    joined = ps.merge(idLinker,perceptionData,how='inner',on='img_id')
-    joined.drop(['img_id'],axis=1,inplace=True)
-
-    # calculate average perceptions of multiple images taken at the same location
-    avgs = joined.groupby('panId').mean()
-    joinedAvgs = ps.merge(avgs,geoData,how='inner',on='panId')
+    # if perception scores store int32 image codes, convert GSV metadata filenames into the same codes
+    # so the join uses integer keys
+    if(os.path.exists(indexFile)):
+        perceptionData = readTable(PERCEPTIONS_FOLDER + curMSA + "_perception_scores",STORAGE_FORMAT,dtype={'img_id':'int32'})
+        idLinker['img_id'] = loadImageIndex(indexFile).encode(idLinker['img_id'])
+    else:
+        perceptionData = readTable(PERCEPTIONS_FOLDER + curMSA + "_perception_scores",STORAGE_FORMAT)
+
+    with timeStage('merge',MSA=curMSA) as timer:
+        # join GSV metadata and perceptions, replacing panorama ids with integer panorama ids.  Panoramas without
+        # metadata would be dropped by the join with metadata, so they are dropped here
+        joined = ps.merge(idLinker,perceptionData,how='inner',on='img_id')
+        joined.drop(['img_id'],axis=1,inplace=True)
+        panCodes = geoData.encode(joined[PANID_FIELD])
+        hasMetadata = panCodes>=0
+        valueFields = [field for field in joined.columns if field!=PANID_FIELD]
+
+        # calculate average perceptions of multiple images taken at the same location
+        panCodes,avgs = groupMeans(panCodes[hasMetadata],joined[valueFields].values[hasMetadata])
+
+        # look up the metadata of each location by integer panorama id
+        avgRows,geoRows = geoData.lookup(panCodes)
+        joinedAvgs = ps.DataFrame(avgs[avgRows],columns=valueFields)
+        joinedAvgs.insert(0,PANID_FIELD,geoData.panIds[geoRows].astype(str))
+        records = geoData.records[geoRows]
+        for field in records.dtype.names:
+            joinedAvgs[field] = records[field]
+        timer.count(rows=len(joined))
     return(joinedAvgs)
 
-# subset perception scores for every 4 years and save to csv
+# get the filepath of the georeferenced perception scores for a single year and MSA
+# INPUTS:
+#    year (int) - year of the perception scores
+#    curMSA (string) - MSA of the perception scores
+# OUTPUTS:
+#    absolute filepath of the partition
+def getYearSubsetPath(year,curMSA):
+    partitionFolder = getPartitionFolder(GEOREFERENCED_FOLDER,[('rasterYear',year),('MSA',curMSA)])
+    return(getTablePath(partitionFolder + PARTITION_FILENAME,STORAGE_FORMAT))
+
+#  convert long data format to wide data format, which is better for a Geodatabase attribute table
+# INPUTS:
+#   inData (pandas dataframe) - dataset to convert to wide format
+# OUTPUTS:
+#   input data converted to wide format, also as a pandas dataframe
+def reformatGeoData(inData):
+    keeps = ['panId','imgLat','imgLon','imgYear']
+    outData = inData[keeps].copy()
+    for label in LABEL_CODES.keys():
+        for comp in COMPARISON_CODES.keys():
+            newName = LABEL_CODES[label] + "_" + COMPARISON_CODES[comp]
+            oldName = label + "_" + comp
+            outData[newName] = (inData[oldName]*10).astype('int')
+    return(outData)
+
+# subset perception scores for every 4 years and save as partitions of the georeferenced dataset.  Rows are
+# grouped by year in a single pass, by sorting on year once and slicing each year's rows.  Partitions are stored
+# in the wide format of the national table, so MSAs can be combined without converting rows
 # INPUTS:
 #    msaData (pandas dataframe) - perception scores for the current MSA
 #    curMSA (string) - MSA to create 4 years subsets for
 def saveMSAYearSubsets(msaData,curMSA):
-    for year in RASTER_YEARS:
-        outputFolder = GEOREFERENCED_FOLDER + str(year) + "/"
-        outputFile = outputFolder + curMSA + "_geo.csv"
-        tmp = msaData[msaData['rasterYear']==year]
-        tmp.to_csv(outputFile,index=False)
-
-# georeference data for a single MSA and create 4 year subsets
+    order = np.argsort(msaData['rasterYear'].values,kind='stable')
+    sortedYears = msaData['rasterYear'].values[order]
+    starts = np.searchsorted(sortedYears,RASTER_YEARS,side='left')
+    ends = np.searchsorted(sortedYears,RASTER_YEARS,side='right')
+    geoData = reformatGeoData(msaData)
+    for year,start,end in zip(RASTER_YEARS,starts,ends):
+        writePartition(geoData.iloc[order[start:end]],GEOREFERENCED_FOLDER,[('rasterYear',year),('MSA',curMSA)],STORAGE_FORMAT)
+
+# get the manifest key, inputs, and outputs of the georeferencing task for a single MSA
+# INPUTS:
+#    curMSA (string) - MSA to get the task for
+# OUTPUTS:
+#    tuple of (task key, input filepaths, output filepaths)
+def getGeoTask(curMSA):
+    inFiles = [
+        getTablePath(PERCEPTIONS_FOLDER + curMSA + "_perception_scores",STORAGE_FORMAT),
+        LINK_FOLDER + curMSA + ".csv",
+        GEO_LINK_FILE
+    ]
+    if(os.path.exists(PERCEPTIONS_FOLDER + curMSA + "_" + INDEX_FILENAME)):
+        inFiles.append(PERCEPTIONS_FOLDER + curMSA + "_" + INDEX_FILENAME)
+    outFiles = [getYearSubsetPath(year,curMSA) for year in RASTER_YEARS]
+    return((createTaskKey('georeference',curMSA),inFiles,outFiles))
+
+# georeference data for a single MSA and create 4 year subsets.  Called by CPU workers, which each memory-map
+# the same read-only GSV metadata index
 # INPUTS:
-#    geoData (pandas dataframe) - contains GSV metadata include panoid and latitude,longitude
 #    curMSA (string) - MSA to create 4 years subsets for
-def processMSA(geoData,curMSA):
-    linkedData = geoLinkData(geoData,curMSA)
-    saveMSAYearSubsets(linkedData,curMSA)
-
-# georeference all perception scores and save as 4 year subsets
+#    indexPath (string) - absolute filepath of the GSV metadata index, without suffix
+def processMSA(curMSA,indexPath=GEO_LINK_INDEX):
+    with timeStage('georeference_msa',MSA=curMSA) as timer:
+        linkedData = geoLinkData(loadGeoLinkIndex(indexPath),curMSA)
+        saveMSAYearSubsets(linkedData,curMSA)
+        timer.count(rows=len(linkedData))
+
+# create one georeferencing job for each MSA
+# INPUTS:
+#    MSAs (string array) - MSAs to create jobs for
+# OUTPUTS:
+#    jobs (list of dictionaries) - jobs for jobScheduler.runJobs
+def createGeoJobs(MSAs):
+    jobs = []
+    for curMSA in MSAs:
+        linkFile = LINK_FOLDER + curMSA + ".csv"
+        memory = MEMORY_BASE + estimateRowCount(linkFile)*MEMORY_PER_ROW
+        jobs.append(createJob(curMSA,processMSA,(curMSA,GEO_LINK_INDEX),os.path.getsize(linkFile),memory,tag=curMSA))
+    return(jobs)
+
+# georeference all perception scores and save as 4 year subsets.  MSAs are georeferenced in parallel against
+# the shared GSV metadata index
 def geoReferencePerceptions():
-
-    # load GSV metadata
-    geoLink = loadGeoLink(PARENT_FOLDER + "BEACON_comparison_setup/rasterLink.csv")
-
-    # get list of MSAs that are already processed
-    processedMSAs = ps.read_csv(PARENT_FOLDER + "FinishedGeo.csv")
-    processedMSAs = list((set(processedMSAs['MSA'])))
-    MSAsToProcess = os.listdir(PERCEPTIONS_FOLDER)
-
-    for MSAFile in MSAsToProcess:
-        curMSA = MSAFile[0:len(MSAFile)- len('_perception_scores.csv')]
-        if(curMSA not in processedMSAs):
-
-            # join perceptions and GSV metadata and save 4 year subsets for the current MSA
-            processMSA(geoLink,curMSA)
-
-            # add the current MSA to the list of MSAs that have already been processed
-            processedMSAs.append(curMSA)
-            tempDF = ps.DataFrame({
-                'MSA':processedMSAs
-            })
-            tempDF.to_csv(PARENT_FOLDER + "FinishedGeo.csv",index=False)
-            print("completed processing %s" %(curMSA))
+    MSAsToProcess = []
+    suffix = getTablePath('_perception_scores',STORAGE_FORMAT)
+    for MSAFile in sorted(os.listdir(PERCEPTIONS_FOLDER)):
+        if not(MSAFile.endswith(suffix)):
+            continue
+        curMSA = MSAFile[0:len(MSAFile)- len(suffix)]
+
+        # MSAs are processed if they have not been processed yet, or their inputs changed since
+        taskKey,taskInputs,taskOutputs = getGeoTask(curMSA)
+        if not(isTaskComplete(MANIFEST_FILE,taskKey,taskInputs,taskOutputs)):
+            MSAsToProcess.append(curMSA)
         else:
             print("already processed %s" %(curMSA))
-
-geoReferencePerceptions()
-
+    if(len(MSAsToProcess)==0):
+        return
+
+    # GSV metadata index is only created if at least one MSA needs to be processed
+    loadGeoLink(GEO_LINK_FILE,GEO_LINK_INDEX)
+
+    # join perceptions and GSV metadata and save 4 year subsets for each MSA
+    def onComplete(job,result):
+        taskKey,taskInputs,taskOutputs = getGeoTask(job['tag'])
+        recordTaskComplete(MANIFEST_FILE,taskKey,taskInputs,taskOutputs)
+        if(getTelemetryFile() is not None):
+            writePrometheusFile(getTelemetryFile())
+        print("completed processing %s" %(job['tag']))
+    runJobs(createGeoJobs(MSAsToProcess),N_WORKERS,MEMORY_LIMIT,onComplete)
+
+if __name__ == '__main__':
+    # stage timings of this process and all CPU workers are appended to the telemetry file
+    configureTelemetry(TELEMETRY_FILE)
+    geoReferencePerceptions()
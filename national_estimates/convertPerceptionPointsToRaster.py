@@ -6,50 +6,75 @@
 #          the distribution of street view point sampling ()
 
 # import dependencies
-import arcpy
-arcpy.env.overwriteOutput=True
+from arcpyWorkers import loadArcpy, runParallel, saveQuantizedRaster
+# without arcpy, rasters are created with the open source backend in pointRasterizer
+arcpy = loadArcpy()
+if(arcpy is not None):
+    arcpy.env.overwriteOutput=True
+try:
+    import pointRasterizer
+except ImportError:
+    pointRasterizer = None
 from multiprocessing import Pool
-import os
+from pipelineManifest import createTaskKey, isTaskComplete, recordTaskComplete, getTempPath, commitTempFile, MANIFEST_FILENAME
+from tableStorage import readTable, getTablePath, DEFAULT_FORMAT
+from telemetry import timeStage, configureTelemetry, getTelemetryFile, writePrometheusFile
 
 # define global constants
 PARENT_FOLDER = "insert absolute folderpath where geodatabase is stored here"
 GDB = PARENT_FOLDER + "PerceptionGDB.GDB"
 GEO_FOLDER = PARENT_FOLDER + "GeoReferenced/"
 RASTER_FOLDER = PARENT_FOLDER + "PerceptionRasters/"
+SCRATCH_FOLDER = PARENT_FOLDER + "scratch/" # each CPU worker creates its own ArcPro scratch workspace here
+N_WORKERS = 8 # number of CPU workers for the arcpy backend, which rasterizes years and outcomes in parallel
+MANIFEST_FILE = PARENT_FOLDER + MANIFEST_FILENAME # tracks completed tasks so interrupted runs resume where they stopped
+STORAGE_FORMAT = DEFAULT_FORMAT # format of the national georeferenced perception tables, must match createPerceptionGeoDatabase
+RASTER_BACKEND = 'arcpy' if arcpy is not None else 'numpy' # 'arcpy' rasterizes the point geodatabase one outcome at a time, 'numpy' rasterizes all outcomes from the national table in one pass (requires rasterio)
+TELEMETRY_FILE = None # absolute filepath of a JSON lines file where stage timings, throughput, and memory are appended.  If None, telemetry is off unless the NSV_TELEMETRY_FILE environment variable is set
+OUTCOMES = ['be_ci','be_ct','na_ci','na_ct','re_ci','re_ct','sw_ci','sw_ct','sc_ci','sc_ct'] # attribute fields in the point geodatabase
+WRITE_FLOAT_RASTERS = False # if true, the numpy backend also writes float32 mean rasters to GEO_FOLDER.  Perception rasters are quantized as they are written, so float rasters are not needed by later stages
 
 
-# create a raster from one attribute field in a point geodatabase
+# replace a raster with a completed temporary raster.  Rasters are renamed with arcpy so auxiliary files
+# (e.g. attribute tables and statistics) are renamed with the raster
+# INPUTS:
+#    tempRaster (string) - absolute filepath of the completed temporary raster
+#    outRaster (string) - absolute filepath of the final raster
+def commitRaster(tempRaster,outRaster):
+    if(arcpy.Exists(outRaster)):
+        arcpy.management.Delete(outRaster)
+    arcpy.management.Rename(tempRaster,outRaster)
+
+# create a quantized raster from one attribute field in a point geodatabase.  The mean raster is kept in memory
+# and converted to int as it is saved, so no float raster is written to disk.  Estimates range from 0 to 1000
 # INPUTS:
 #    year (int) - year of interest, perceptions were calculated for every 4 years
 #    perception (string) - perception name and comparison level (needs to match attribute field in geodatabasae)
 def convertToRaster(year,perception):
     inDataset = "geo_" + str(year) + "_point"
-    outRaster = GEO_FOLDER + "geo_" + str(year) + "_" + perception + ".tif"
-    if (os.path.exists(outRaster)):
+    outRaster = RASTER_FOLDER + "geo_" + str(year) + "_" + perception + ".tif"
+
+    # the point dataset is stored in the geodatabase, so the csv it was created from is fingerprinted instead
+    taskKey = createTaskKey('point_raster',label=perception,year=year)
+    taskInputs = [GEO_FOLDER + "geo_" + str(year) + ".csv"]
+    if(isTaskComplete(MANIFEST_FILE,taskKey,taskInputs,[outRaster])):
         print("%s already exists" %(outRaster))
         return
+    meanRaster = "memory/geo_" + str(year) + "_" + perception
     arcpy.conversion.PointToRaster(
         in_features= GDB + "/" + inDataset,
         value_field=perception,
-        out_rasterdataset=outRaster,
+        out_rasterdataset=meanRaster,
         cell_assignment="MEAN",
         priority_field="NONE",
         cellsize=0.0008333,
         build_rat="BUILD"
     )
-
-# convert a floating point raster to int to save disk space.  Estimates range from 0 to 1000
-#    year (int) - year of interest, perceptions were calculated for every 4 years
-#    perception (string) - perception name and comparison level
-def convertRasterToInt(year,perception):
-    inRaster = GEO_FOLDER + "geo_" + str(year) + "_" + perception + ".tif"
-    outRaster = RASTER_FOLDER + "geo_" + str(year) + "_" + perception + ".tif"
-    if(os.path.exists(outRaster)):
-        print("%s already exists" %(outRaster))
-        return
-    raster = arcpy.Raster(inRaster)
-    raster = arcpy.sa.Int(raster)
-    raster.save(outRaster)
+    tempRaster = getTempPath(outRaster)
+    saveQuantizedRaster(arcpy.sa.Int(arcpy.Raster(meanRaster)),tempRaster)
+    arcpy.management.Delete(meanRaster)
+    commitRaster(tempRaster,outRaster)
+    recordTaskComplete(MANIFEST_FILE,taskKey,taskInputs,[outRaster])
 
 # given a year of interest, calculate national perceptions and comparison levels for that year
 # INPUTS:
@@ -58,25 +83,58 @@ def convertAllPerceptionsToRaster(year):
     # key:
     #    be: beauty, na: nature quality, re: relaxing, sw: safety for walking, sc: safety from crime
     #    ci: city level comparison, ct: census tract comparisons 
-    for outcome in ['be_ci','be_ct','na_ci','na_ct','re_ci','re_ct','sw_ci','sw_ct','sc_ci','sc_ct']:
+    for outcome in OUTCOMES:
         print("creating raster for year %i and outcome %s " %(year,outcome))
 
         convertToRaster(year,outcome)
 
-def roundRasterToInt(year):
-    # key:
-    #    be: beauty, na: nature quality, re: relaxing, sw: safety for walking, sc: safety from crime
-    #    ci: city level comparison, ct: census tract comparisons 
-    for outcome in ['be_ci','be_ct','na_ci','na_ct','re_ci','re_ct','sw_ci','sw_ct','sc_ci','sc_ct']:
-        print("creating raster for year %i and outcome %s " %(year,outcome))
-        convertRasterToInt(year,outcome)
+# create the quantized raster of one perception and comparison level for one year of interest.  Each year
+# and outcome is an independent task, so all 40 tasks can run in parallel
+# INPUTS:
+#    year (int) - year of interest
+#    perception (string) - perception name and comparison level
+def processOutcome(year,perception):
+    print("creating raster for year %i and outcome %s " %(year,perception))
+    convertToRaster(year,perception)
+
+# given a year of interest, create the quantized rasters of all perceptions and comparison levels with the
+# open source backend.  The national perception table is read once and all outcomes are rasterized in one
+# pass, producing the same files as convertAllPerceptionsToRaster
+# INPUTS:
+#    year (int) - year of interest
+def rasterizeYear(year):
+    inBase = GEO_FOLDER + "geo_" + str(year)
+    floatFiles = [GEO_FOLDER + "geo_" + str(year) + "_" + outcome + ".tif" for outcome in OUTCOMES] if WRITE_FLOAT_RASTERS else []
+    intFiles = [RASTER_FOLDER + "geo_" + str(year) + "_" + outcome + ".tif" for outcome in OUTCOMES]
+    taskKey = createTaskKey('point_rasters',year=year)
+    taskInputs = [getTablePath(inBase,STORAGE_FORMAT)]
+    if(isTaskComplete(MANIFEST_FILE,taskKey,taskInputs,floatFiles + intFiles)):
+        print("rasters for year %i already exist" %(year))
+        return
+    print("creating rasters for year %i" %(year))
+    pointData = readTable(inBase,STORAGE_FORMAT,columns=[pointRasterizer.LON_FIELD,pointRasterizer.LAT_FIELD] + OUTCOMES)
+    tempFiles = [getTempPath(outFile) for outFile in floatFiles + intFiles]
+    with timeStage('point_rasters',year=year) as timer:
+        pointRasterizer.rasterizePoints(pointData,OUTCOMES,tempFiles[:len(floatFiles)],tempFiles[len(floatFiles):])
+        timer.count(rows=len(pointData),rasters=len(tempFiles))
+    for tempFile,outFile in zip(tempFiles,floatFiles + intFiles):
+        commitTempFile(tempFile,outFile)
+    recordTaskComplete(MANIFEST_FILE,taskKey,taskInputs,floatFiles + intFiles)
 
 
 if __name__ == '__main__':
+    # stage timings of this process and all CPU workers are appended to the telemetry file
+    configureTelemetry(TELEMETRY_FILE)
     years = [2008,2012,2016,2020]
-    pool = Pool(processes=len(years))
-    res = pool.map_async(convertAllPerceptionsToRaster,years)
-    res.get()    
-
-    res = pool.map_async(roundRasterToInt,years)
-    res.get()    
\ No newline at end of file
+    if(RASTER_BACKEND=='numpy'):
+        if(pointRasterizer is None):
+            raise ImportError("rasterio is required for the numpy raster backend")
+        pool = Pool(processes=len(years))
+        res = pool.map_async(rasterizeYear,years)
+        res.get()
+    else:
+        # each CPU worker has its own ArcPro scratch workspace, so every year and outcome can be rasterized in
+        # parallel without PointToRaster temporary datasets conflicting
+        runParallel(processOutcome,[(year,outcome) for year in years for outcome in OUTCOMES],N_WORKERS,SCRATCH_FOLDER)
+    if(getTelemetryFile() is not None):
+        writePrometheusFile(getTelemetryFile())
@@ -5,38 +5,80 @@
 #          create rasters of TS perceptions at 500m and 1000m resolution
 
 # import dependencies
-import arcpy
+from arcpyWorkers import loadArcpy, runParallel, saveQuantizedRaster
+# without arcpy, buffers are created with the open source focal engine in focalMean
+arcpy = loadArcpy()
+if(arcpy is not None):
+    arcpy.env.overwriteOutput= True
+try:
+    import focalMean
+except ImportError:
+    focalMean = None
 import pandas as ps
 import os
 from multiprocessing import Pool
-arcpy.env.overwriteOutput= True
+from pipelineManifest import createTaskKey, isTaskComplete, recordTaskComplete, getTempPath, commitTempFile, writeCSVAtomic, MANIFEST_FILENAME
+from telemetry import timeStage, configureTelemetry, getTelemetryFile, writePrometheusFile
+from rasterStorage import getGrid
 
 # define global constants
 PARENT_FOLDER = "insert absolute folderpath where perception rasters are stored here"
 RASTER_INPUT = PARENT_FOLDER + "PerceptionRasters/"
 INTERMEDIATE_FOLDER = PARENT_FOLDER + "TempRasters/"
 BUFFER_RASTERS = PARENT_FOLDER + "PerceptionBuffers/"
+SCRATCH_FOLDER = PARENT_FOLDER + "scratch/" # each CPU worker creates its own ArcPro scratch workspace here
 BUFFER_DISTANCES = [500,1000]
 COMPARISON_LEVELS = ["ci","ct"]
 LABELS = ["be","na","sc","sw","re"]
 YEARS = [2008,2012,2016,2020]
+MANIFEST_FILE = PARENT_FOLDER + MANIFEST_FILENAME # tracks completed tasks so interrupted runs resume where they stopped
 MERCATOR_COORD = 'PROJCS["WGS_1984_Web_Mercator_Auxiliary_Sphere",GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137.0,298.257223563]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]],PROJECTION["Mercator_Auxiliary_Sphere"],PARAMETER["False_Easting",0.0],PARAMETER["False_Northing",0.0],PARAMETER["Central_Meridian",0.0],PARAMETER["Standard_Parallel_1",0.0],PARAMETER["Auxiliary_Sphere_Type",0.0],UNIT["Meter",1.0]]'
+FOCAL_BACKEND = 'arcpy' if arcpy is not None else 'numpy' # 'arcpy' uses FocalStatistics, 'numpy' uses the tiled focal engine in focalMean (requires rasterio)
+MERCATOR_EPSG = 'EPSG:3857' # Web Mercator, used by the numpy backend
+MERCATOR_CELL_SIZE = 100 # cell size of projected rasters, in meters
+FOCAL_PROCESSES = 8 # number of pool workers that process tiles in the numpy backend
+FOCAL_MODE = 'projected' # 'projected' calculates buffers in Web Mercator, 'geographic' calculates buffers on the native grid with latitude-aware neighborhoods (numpy backend only)
+VALIDATE_FOCAL_MODES = False # if true, compare the two focal modes instead of creating buffers
+VALIDATION_FOLDER = PARENT_FOLDER + "FocalValidation/"
+VALIDATION_REPORT = PARENT_FOLDER + "focalModeValidation.csv"
+TELEMETRY_FILE = None # absolute filepath of a JSON lines file where stage timings, throughput, and memory are appended.  If None, telemetry is off unless the NSV_TELEMETRY_FILE environment variable is set
 WGS84_COORD = 'GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137.0,298.257223563]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]'
 
-# sanity check to test if 500m and 1000m rasters were already created for a single input raster
+# replace a raster with a completed temporary raster.  Rasters are renamed with arcpy so auxiliary files
+# (e.g. attribute tables and statistics) are renamed with the raster
 # INPUTS:
-#    shortName (string) - part of filename nomenclature which corresponds to the input raster
+#    tempRaster (string) - absolute filepath of the completed temporary raster
+#    outRaster (string) - absolute filepath of the final raster
+def commitRaster(tempRaster,outRaster):
+    if(arcpy.Exists(outRaster)):
+        arcpy.management.Delete(outRaster)
+    arcpy.management.Rename(tempRaster,outRaster)
+
+# get the manifest key, inputs, and outputs of the buffer task for a single input raster
+# INPUTS:
+#    compareLevel (string) - either 'ci' or 'ct' (city or census tract)
+#    label (string) - 'be','na','re','sw', or 'sc'
+#    year (int) - 2008, 2012, 2016, or 2020
+# OUTPUTS:
+#    tuple of (task key, input filepaths, output filepaths)
+def getBufferTask(compareLevel,label,year):
+    shortName = "geo_" + str(year) + "_" + label + "_" + compareLevel
+    outFiles = [BUFFER_RASTERS + shortName + "_" + str(buffer) + ".tif" for buffer in BUFFER_DISTANCES]
+    # buffers from the two focal modes differ, so switching modes recreates the buffers
+    stage = 'focal_buffers' if FOCAL_MODE=='projected' else 'focal_buffers_geographic'
+    return((createTaskKey(stage,label=label,level=compareLevel,year=year),[RASTER_INPUT + shortName + ".tif"],outFiles))
+
+# sanity check to test if 500m and 1000m rasters were already created for a single input raster, from the
+# current version of the input raster
+# INPUTS:
+#    compareLevel (string) - either 'ci' or 'ct' (city or census tract)
+#    label (string) - 'be','na','re','sw', or 'sc'
+#    year (int) - 2008, 2012, 2016, or 2020
 # OUTPUTS: 
 #    true if 500m and 1000m rasters were already created for the input raster.  False otherwise
-def testIsComplete(shortName):
-    outputFiles = []
-    for buffer in BUFFER_DISTANCES:
-        curOutput = BUFFER_RASTERS + shortName + "_" + str(buffer) + ".tif"
-        if not(os.path.exists(curOutput)):
-            outputFiles.append(curOutput)
-    if(len(outputFiles)==0):
-        return(True)
-    return(False)
+def testIsComplete(compareLevel,label,year):
+    taskKey,taskInputs,taskOutputs = getBufferTask(compareLevel,label,year)
+    return(isTaskComplete(MANIFEST_FILE,taskKey,taskInputs,taskOutputs))
 
 # create 500m and 1000m rasters from a single input raster
 # INPUTS:
@@ -48,15 +90,16 @@ def processOneRaster(dataTuple):
     compareLevel,label,year = dataTuple[0], dataTuple[1], dataTuple[2]
     shortName = "geo_" + str(year) + "_" + label + "_" + compareLevel
     # test if 500m and 1000m were already created.  If so skip the rest of the function
-    if(testIsComplete(shortName)):
+    if(testIsComplete(compareLevel,label,year)):
         print("buffers for %s already complete " %(shortName))
         return
     # project the raster into a GCS that uses meters rather than decimal degrees
     projectedRaster = INTERMEDIATE_FOLDER + shortName + "proj.tif"
-    if not(os.path.exists(projectedRaster)):
+    projectKey = createTaskKey('project_raster',label=label,level=compareLevel,year=year)
+    if not(isTaskComplete(MANIFEST_FILE,projectKey,[RASTER_INPUT + shortName + ".tif"],[projectedRaster])):
         arcpy.management.ProjectRaster(
             in_raster=RASTER_INPUT + shortName + ".tif",
-            out_raster=INTERMEDIATE_FOLDER + shortName + "proj.tif",
+            out_raster=getTempPath(projectedRaster),
             out_coor_system=MERCATOR_COORD,
             resampling_type="BILINEAR",
             cell_size="100 100",
@@ -65,6 +108,8 @@ def processOneRaster(dataTuple):
             in_coor_system=WGS84_COORD,
             vertical="NO_VERTICAL"
         )
+        commitRaster(getTempPath(projectedRaster),projectedRaster)
+        recordTaskComplete(MANIFEST_FILE,projectKey,[RASTER_INPUT + shortName + ".tif"],[projectedRaster])
     # create 500m and 1000m products from the projected raster using focal statistics
     for buffer in BUFFER_DISTANCES:
         out_raster = arcpy.ia.FocalStatistics(
@@ -75,12 +120,14 @@ def processOneRaster(dataTuple):
             percentile_value=90
         )
         out_raster = arcpy.sa.Int(out_raster)
-        out_raster.save(INTERMEDIATE_FOLDER + shortName + "_" + str(buffer) + ".tif")
 
-        # reproject the raster back into it's native GCS to preserve distance and shape relationships
+        # reproject the raster back into it's native GCS to preserve distance and shape relationships.  The
+        # projected raster is kept in memory and quantized as it is saved
+        bufferRaster = BUFFER_RASTERS + shortName + "_" + str(buffer) + ".tif"
+        memoryRaster = "memory/" + shortName + "_" + str(buffer)
         arcpy.management.ProjectRaster(
-            in_raster=INTERMEDIATE_FOLDER + shortName + "_" + str(buffer) + ".tif",
-            out_raster= BUFFER_RASTERS + shortName + "_" + str(buffer) + ".tif",
+            in_raster=out_raster,
+            out_raster=memoryRaster,
             out_coor_system=WGS84_COORD,
             resampling_type="BILINEAR",
             cell_size="0.0008333 0.0008333",
@@ -89,19 +136,97 @@ def processOneRaster(dataTuple):
             in_coor_system=MERCATOR_COORD,
             vertical="NO_VERTICAL"
         )
+        saveQuantizedRaster(arcpy.Raster(memoryRaster),getTempPath(bufferRaster))
+        arcpy.management.Delete(memoryRaster)
+        commitRaster(getTempPath(bufferRaster),bufferRaster)
+    taskKey,taskInputs,taskOutputs = getBufferTask(compareLevel,label,year)
+    recordTaskComplete(MANIFEST_FILE,taskKey,taskInputs,taskOutputs)
     print("completed calculating buffers for %s" %(shortName))
 
-# convert a floating point raster to int to save disk space
+# create 500m and 1000m rasters with the numpy backend, using the same steps as processOneRaster: project into
+# Web Mercator, calculate focal means, and project back onto the grid of the input raster.  Every step streams
+# tiles so rasters never have to fit in memory, and both buffers are calculated from one read of each tile
+# INPUTS:
+#    datatuple (tuple) - see processOneRaster
+#    bufferRasters (string array) - absolute filepaths of the buffer rasters, one per buffer distance
+#    pool (multiprocessing pool) - pool that processes tiles
+def createProjectedBuffers(dataTuple,bufferRasters,pool):
+    compareLevel,label,year = dataTuple[0], dataTuple[1], dataTuple[2]
+    shortName = "geo_" + str(year) + "_" + label + "_" + compareLevel
+    inRaster = RASTER_INPUT + shortName + ".tif"
+    projectedRaster = INTERMEDIATE_FOLDER + shortName + "proj.tif"
+    projectKey = createTaskKey('project_raster',label=label,level=compareLevel,year=year)
+    if not(isTaskComplete(MANIFEST_FILE,projectKey,[inRaster],[projectedRaster])):
+        transform,width,height = focalMean.getProjectedGrid(inRaster,MERCATOR_EPSG,MERCATOR_CELL_SIZE)
+        focalMean.projectRaster(inRaster,getTempPath(projectedRaster),MERCATOR_EPSG,transform,width,height,cog=False)
+        commitTempFile(getTempPath(projectedRaster),projectedRaster)
+        recordTaskComplete(MANIFEST_FILE,projectKey,[inRaster],[projectedRaster])
+    focalRasters = [INTERMEDIATE_FOLDER + shortName + "_" + str(buffer) + ".tif" for buffer in BUFFER_DISTANCES]
+    focalMean.focalMeanRaster(projectedRaster,focalRasters,BUFFER_DISTANCES,pool,cog=False)
+    crs,transform,width,height = getGrid(inRaster)
+    for focalRaster,bufferRaster in zip(focalRasters,bufferRasters):
+        focalMean.projectRaster(focalRaster,bufferRaster,crs,transform,width,height)
+
+# create 500m and 1000m rasters directly on the grid of the input raster, with neighborhoods measured in meters
+# at the latitude of each row.  No intermediate rasters are written
 # INPUTS:
-#    inRaster (string) - absolute filepath to the floating point raster
-#    outRaster (string) - absolute filepath to the int raster to create
-def convertRasterToInt(inRaster,outRaster):
-    if(os.path.exists(outRaster)):
-        print("%s already exists" %(outRaster))
+#    datatuple (tuple) - see processOneRaster
+#    bufferRasters (string array) - absolute filepaths of the buffer rasters, one per buffer distance
+#    pool (multiprocessing pool) - pool that processes tiles
+def createGeographicBuffers(dataTuple,bufferRasters,pool):
+    compareLevel,label,year = dataTuple[0], dataTuple[1], dataTuple[2]
+    inRaster = RASTER_INPUT + "geo_" + str(year) + "_" + label + "_" + compareLevel + ".tif"
+    focalMean.focalMeanRaster(inRaster,bufferRasters,BUFFER_DISTANCES,pool)
+
+# create 500m and 1000m rasters from a single input raster with the numpy backend, in the focal mode set by
+# FOCAL_MODE
+# INPUTS:
+#    datatuple (tuple) - see processOneRaster
+#    pool (multiprocessing pool) - pool that processes tiles
+def processOneRasterNumpy(dataTuple,pool):
+    compareLevel,label,year = dataTuple[0], dataTuple[1], dataTuple[2]
+    shortName = "geo_" + str(year) + "_" + label + "_" + compareLevel
+    if(testIsComplete(compareLevel,label,year)):
+        print("buffers for %s already complete " %(shortName))
         return
-    raster = arcpy.Raster(inRaster)
-    raster = arcpy.sa.Int(raster)
-    raster.save(outRaster)
+    taskKey,taskInputs,taskOutputs = getBufferTask(compareLevel,label,year)
+    tempRasters = [getTempPath(bufferRaster) for bufferRaster in taskOutputs]
+    with timeStage('focal_buffers',raster=shortName,mode=FOCAL_MODE) as timer:
+        if(FOCAL_MODE=='geographic'):
+            createGeographicBuffers(dataTuple,tempRasters,pool)
+        else:
+            createProjectedBuffers(dataTuple,tempRasters,pool)
+        timer.count(rasters=len(tempRasters))
+    for tempRaster,bufferRaster in zip(tempRasters,taskOutputs):
+        commitTempFile(tempRaster,bufferRaster)
+    recordTaskComplete(MANIFEST_FILE,taskKey,taskInputs,taskOutputs)
+    print("completed calculating buffers for %s" %(shortName))
+
+# compare buffers calculated on the native geographic grid against buffers calculated with the projected
+# pipeline, and save a report with one row per input raster and buffer distance
+# INPUTS:
+#    parallelTuples (list) - tuples created by prepRastersParallel
+#    pool (multiprocessing pool) - pool that processes tiles
+# OUTPUTS:
+#    pandas dataframe of comparison statistics
+def validateFocalModes(parallelTuples,pool):
+    os.makedirs(VALIDATION_FOLDER,exist_ok=True)
+    records = []
+    for dataTuple in parallelTuples:
+        compareLevel,label,year = dataTuple[0], dataTuple[1], dataTuple[2]
+        shortName = "geo_" + str(year) + "_" + label + "_" + compareLevel
+        projectedRasters = [VALIDATION_FOLDER + shortName + "_" + str(buffer) + "_projected.tif" for buffer in BUFFER_DISTANCES]
+        geographicRasters = [VALIDATION_FOLDER + shortName + "_" + str(buffer) + "_geographic.tif" for buffer in BUFFER_DISTANCES]
+        createProjectedBuffers(dataTuple,projectedRasters,pool)
+        createGeographicBuffers(dataTuple,geographicRasters,pool)
+        for buffer,projectedRaster,geographicRaster in zip(BUFFER_DISTANCES,projectedRasters,geographicRasters):
+            record = {'year':year,'label':label,'comparison':compareLevel,'buffer':buffer}
+            record.update(focalMean.compareRasters(projectedRaster,geographicRaster))
+            records.append(record)
+            print("%s %im: mean absolute difference %.2f, correlation %.4f" %(shortName,buffer,record['meanAbsDiff'],record['correlation']))
+    report = ps.DataFrame(records)
+    writeCSVAtomic(report,VALIDATION_REPORT,index=False)
+    return(report)
 
 # transform metadata into tuples to distribute workload across multiple CPUs
 def prepRastersParallel():
@@ -116,8 +241,25 @@ def prepRastersParallel():
     return(parallelTuples)
 
 if __name__ == '__main__':
+    # stage timings of this process and all CPU workers are appended to the telemetry file
+    configureTelemetry(TELEMETRY_FILE)
     parallelTuples = prepRastersParallel()
     print("number of rasters to calculate buffers for: %i" %(len(parallelTuples)))
-    pool = Pool(processes=8)
-    res = pool.map_async(processOneRaster,parallelTuples)
-    a = res.get()
+    if(FOCAL_MODE not in ['projected','geographic']):
+        raise ValueError("unknown focal mode %s" %(FOCAL_MODE))
+    if(focalMean is None and (FOCAL_BACKEND=='numpy' or FOCAL_MODE=='geographic' or VALIDATE_FOCAL_MODES)):
+        raise ImportError("rasterio is required for the numpy focal backend")
+    if(VALIDATE_FOCAL_MODES):
+        pool = Pool(processes=FOCAL_PROCESSES)
+        validateFocalModes(parallelTuples,pool)
+    elif(FOCAL_BACKEND=='numpy' or FOCAL_MODE=='geographic'):
+        # rasters are processed one at a time, with tiles of each raster spread across the pool
+        pool = Pool(processes=FOCAL_PROCESSES)
+        for dataTuple in parallelTuples:
+            processOneRasterNumpy(dataTuple,pool)
+    else:
+        # each CPU worker has its own ArcPro scratch workspace, so FocalStatistics and ProjectRaster
+        # temporary datasets of different rasters do not conflict
+        runParallel(processOneRaster,[(dataTuple,) for dataTuple in parallelTuples],8,SCRATCH_FOLDER)
+    if(getTelemetryFile() is not None):
+        writePrometheusFile(getTelemetryFile())
@@ -5,70 +5,63 @@
 
 
 # import dependencies
-import arcpy
 import pandas as ps
 import os
-from multiprocessing import Pool
+from arcpyWorkers import loadArcpy, runParallel, getWorkerGDB, mergeOutput, isLockError
+from pipelineManifest import createTaskKey, isTaskComplete, recordTaskComplete, MANIFEST_FILENAME
+from tableStorage import listPartitions, concatTableFiles, getTablePath, DEFAULT_FORMAT
+from telemetry import timeStage, configureTelemetry, getTelemetryFile, writePrometheusFile
+arcpy = loadArcpy()
+if(arcpy is None):
+    raise ImportError("arcpy is required to create the point geodatabase")
 arcpy.env.overwriteOutput= True
 
 # define global constants
 PARENT_FOLDER = 'insert absolute folderpath where geolocated data is stored'
 GDB = PARENT_FOLDER + "PerceptionGDB.GDB"
 GEO_FOLDER = PARENT_FOLDER + "GeoReferenced/"
-
-#  convert long data format to wide data format, which is better for a Geodatabase attribute table
-# INPUTS:
-#   inData (pandas dataframe) - dataset to convert to wide format
-# OUTPUTS:
-#   input data converted to wide format, also as a pandas dataframe
-def reformatGeoData(inData):
-    keeps = ['panId','imgLat','imgLon','imgYear']
-    kvLabel = {
-        'beauty':'be',
-        'nature':'na',
-        'relaxing':'re',
-        'safe_walk':'sw',
-        'safe_crime':'sc'
-    }
-    kvComp = {
-        'census_tract':'ct',
-        'city':'ci'
-    }
-    for label in kvLabel.keys():
-        for comp in kvComp.keys():
-            newName = kvLabel[label] + "_" + kvComp[comp]
-            oldName = label + "_" + comp
-            inData[newName] = inData[oldName]*10
-            inData[newName] = inData[newName].astype('int')
-            keeps.append(newName)
-    inData = inData[keeps]
-    return(inData)
+SCRATCH_FOLDER = PARENT_FOLDER + "scratch/" # each CPU worker creates its own ArcPro scratch workspace here
+MANIFEST_FILE = PARENT_FOLDER + MANIFEST_FILENAME # tracks completed tasks so interrupted runs resume where they stopped
+STORAGE_FORMAT = DEFAULT_FORMAT # format of georeferenced tables, 'parquet' (requires pyarrow) or 'csv'
+TELEMETRY_FILE = None # absolute filepath of a JSON lines file where stage timings, throughput, and memory are appended.  If None, telemetry is off unless the NSV_TELEMETRY_FILE environment variable is set
+EXPORT_CSV = True # also export national georeferenced perceptions to csv.  Required by createGeoPoint, arcpy reads the csv
 
 # combine georeferenced perceptions from all MSAs to create a national
-# georeferenced perception CSV 
+# georeferenced perception table, and optionally export it to csv
 # INPUTS: 
 #   year (int) - year of perceptions to combine
 def combineGeo(year):
-    index=0
-    curFolder = GEO_FOLDER + str(year)
 
-    # get list of MSA perceptions that need to be combined
-    geoFiles = os.listdir(curFolder)
-    dataFrames = []
+    # get list of MSA perceptions that need to be combined.  Only partitions for the current year are listed
+    geoFiles = [inFile for inFile,values in listPartitions(GEO_FOLDER,STORAGE_FORMAT,[('rasterYear','=',year)])]
 
-    # load each perceptions for each MSA and then concatenate together
-    for file in geoFiles:
-        tempData = ps.read_csv(curFolder + "/" + file)
-        dataFrames.append(reformatGeoData(tempData))
-        index+=1
-        if(index%500==0):
-            print(index)
-    newDF = ps.concat(dataFrames)
-    newDF.to_csv(GEO_FOLDER + 'geo_' + str(year) + ".csv",index=False)
+    # skip years that were combined by a previous run with the same MSA perceptions
+    outBase = GEO_FOLDER + 'geo_' + str(year)
+    outFiles = [getTablePath(outBase,STORAGE_FORMAT)]
+    if(EXPORT_CSV and STORAGE_FORMAT!='csv'):
+        outFiles.append(getTablePath(outBase,'csv'))
+    taskKey = createTaskKey('combine_geo',year=year)
+    if(isTaskComplete(MANIFEST_FILE,taskKey,geoFiles,outFiles)):
+        print("already combined year %i" %(year))
+        return
 
-# add national georeferenced perceptions from a csv file into a geodatabase
+    # MSA partitions are already in the wide format of the national table, so they are copied one MSA at a time
+    # into the national table and the csv export in the same pass, and the national table is never held in memory
+    storageFormats = [STORAGE_FORMAT]
+    if(EXPORT_CSV and STORAGE_FORMAT!='csv'):
+        storageFormats.append('csv')
+    with timeStage('combine_geo',year=year) as timer:
+        concatTableFiles(geoFiles,outBase,storageFormats,STORAGE_FORMAT)
+        timer.count(files=len(geoFiles))
+    recordTaskComplete(MANIFEST_FILE,taskKey,geoFiles,outFiles)
+
+# add national georeferenced perceptions from a csv file into a geodatabase.  When run by a CPU worker the
+# point file is created in the worker's scratch geodatabase, and must be merged into the national geodatabase
+# by the main process with commitGeoPoint
 # INPUTS:
 #    year (int) - year of perceptions to combine
+# OUTPUTS:
+#    absolute filepath of the completed temporary point file, or None if the point file already exists
 def createGeoPoint(year):
     file = GEO_FOLDER + "geo_" + str(year) + ".csv"
     filename = "geo_" + str(year) + "_point"
@@ -76,30 +69,63 @@ def createGeoPoint(year):
     print(file)
     print(filepth)
 
-    # create point file in geodatabase using the georeferenced perception csv
+    # skip years whose point file was created by a previous run from the same csv.  The point file is
+    # stored in the geodatabase, so only the csv is fingerprinted
+    taskKey = createTaskKey('geo_point',year=year)
+    if(isTaskComplete(MANIFEST_FILE,taskKey,[file],[]) and arcpy.Exists(filepth)):
+        print("already created point file for year %i" %(year))
+        return(None)
+
+    # create point file in geodatabase using the georeferenced perception csv.  The point file is created
+    # under a temporary name and renamed once complete, so a crash never leaves a partial point file in place
+    tempPath = (getWorkerGDB() or GDB) + "/" + filename + "_tmp"
     try:
-        a = arcpy.management.XYTableToPoint(file, filepth, "imgLon", "imgLat", None, 'GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137.0,298.257223563]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]];-400 -400 1000000000;-100000 10000;-100000 10000;8.98315284119521E-09;0.001;0.001;IsHighPrecision')
+        with timeStage('geo_point',year=year):
+            a = arcpy.management.XYTableToPoint(file, tempPath, "imgLon", "imgLat", None, 'GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137.0,298.257223563]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]];-400 -400 1000000000;-100000 10000;-100000 10000;8.98315284119521E-09;0.001;0.001;IsHighPrecision')
         print(a)
+        return(tempPath)
     except Exception as e:
+        # lock errors are raised so the worker retries the year
+        if(isLockError(e)):
+            raise
         print(str(e))
+        return(None)
+
+# move a completed point file into the national geodatabase and record it in the manifest.  Only called by the
+# main process, so the national geodatabase is never written by more than one process
+# INPUTS:
+#    year (int) - year of the point file
+#    tempPath (string) - absolute filepath of the completed temporary point file created by createGeoPoint
+def commitGeoPoint(year,tempPath):
+    if(tempPath is None):
+        return
+    file = GEO_FOLDER + "geo_" + str(year) + ".csv"
+    mergeOutput(tempPath,GDB + "/geo_" + str(year) + "_point")
+    recordTaskComplete(MANIFEST_FILE,createTaskKey('geo_point',year=year),[file],[])
+    print("added point file for year %i to %s" %(year,GDB))
 
 # for a single year of interest, combine georeferenced data from multiple MSAs and then load the combined
 # data into a geodatabase
+# INPUTS:
+#    year (int) - year of interest
+# OUTPUTS:
+#    absolute filepath of the completed temporary point file, or None if the point file already exists
 def processSingleYear(year):
     print("started to process year %i" %(year))
     combineGeo(year)
     print("finished combineGeo for year %i" %(year))
-    createGeoPoint(year)
+    tempPath = createGeoPoint(year)
     print("completed process year %i" %(year))
+    return(tempPath)
 
 if __name__ == '__main__':
-    # parallel processing currently doesn't work - CPU workers have conflicting temporary file 
-    # read/writes in the ArcPro scratch database.  To make this work in parallel define a unique 
-    # ArcPro scratch database for each CPU worker in the multiprocessing pool. 
-    #yearset = [2008,2012,2016,2020]
-    #pool = Pool(processes=len(yearset))
-    #res = pool.map(processSingleYear,yearset)
+    # stage timings of this process and all CPU workers are appended to the telemetry file
+    configureTelemetry(TELEMETRY_FILE)
 
-    # run in a for loop since parallel processing is currently not functional
-    for year in [2008,2012,2016,2020]:
-        createGeoPoint(year)
\ No newline at end of file
+    # each CPU worker has its own ArcPro scratch workspace, so years no longer conflict over temporary files.
+    # Point files are merged into the national geodatabase by the main process as each year completes
+    yearset = [2008,2012,2016,2020]
+    runParallel(processSingleYear,[(year,) for year in yearset],len(yearset),SCRATCH_FOLDER,
+        onResult=lambda args,tempPath: commitGeoPoint(args[0],tempPath))
+    if(getTelemetryFile() is not None):
+        writePrometheusFile(getTelemetryFile())
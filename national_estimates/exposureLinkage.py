@@ -0,0 +1,308 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: link point locations (e.g. cohort addresses) to every national perception surface in a single pass.
+#          Point rasters (PerceptionRasters/geo_<year>_<label>_<level>.tif) and buffer rasters
+#          (PerceptionBuffers/geo_<year>_<label>_<level>_<buffer>.tif) are tiled, compressed, sparse GeoTIFFs,
+#          which cannot be memory-mapped, so points are sorted by raster tile once for each grid, and each tile
+#          of each surface is read and decompressed at most once, no matter how many points fall in it.
+#          Surfaces are sampled in parallel and returned as one wide table, either with every year or with the
+#          year nearest to each point's year.  Cells with NoData and points outside a raster are NaN.
+#          Run as a script to link a table of points, or to benchmark linkage throughput.
+
+# import dependencies
+import numpy as np
+import pandas as ps
+import argparse
+import json
+import time
+import os
+from multiprocessing import Pool
+import rasterio
+from rasterio.windows import Window
+from tableStorage import readTableFile, writeTable
+from telemetry import timeStage, getPeakRSS
+from rasterStorage import getTiledGrid
+
+# define global constants
+PARENT_FOLDER = "insert absolute folderpath where perception rasters are stored here"
+RASTER_FOLDER = PARENT_FOLDER + "PerceptionRasters/" # point rasters created by convertPerceptionPointsToRaster
+BUFFER_FOLDER = PARENT_FOLDER + "PerceptionBuffers/" # 500m and 1000m rasters created by createFocalRasters
+YEARS = [2008,2012,2016,2020]
+LABELS = ["be","na","re","sw","sc"]
+COMPARISON_LEVELS = ["ci","ct"]
+BUFFER_DISTANCES = [500,1000]
+LAT_FIELD = 'lat' # default latitude field of point tables, decimal degrees (WGS 1984)
+LON_FIELD = 'lon' # default longitude field of point tables, decimal degrees (WGS 1984)
+N_WORKERS = 4 # number of CPU workers that sample surfaces in parallel
+FILL_YEARS = False # if true, values that are NoData in the nearest year are taken from the next nearest year with data
+VALUE_DTYPE = np.float32 # dtype of linked values, float32 halves memory for tens of millions of points
+workerState = {} # sorted points of each grid, set in each CPU worker by initWorker
+
+# custom class for points sorted by the tile of a raster grid that contains them
+class PointTiles:
+
+    # INPUTS:
+    #    points (int array) - position in the original points of each sorted point inside the grid
+    #    rows, cols (int arrays) - raster row and column of each sorted point
+    #    tiles (int array) - flat index of each occupied tile
+    #    starts (int array) - position in the sorted points of the first point in each occupied tile
+    def __init__(self,points,rows,cols,tiles,starts):
+        self.points = points
+        self.rows = rows
+        self.cols = cols
+        self.tiles = tiles
+        self.starts = starts
+
+    def __len__(self):
+        return(len(self.points))
+
+    # positions in the sorted points of each occupied tile
+    def tileSlices(self):
+        ends = np.r_[self.starts[1:],len(self.points)]
+        return(zip(self.tiles.tolist(),self.starts.tolist(),ends.tolist()))
+
+# get the perception surfaces that exist on disk
+# INPUTS:
+#    rasterFolder (string) - absolute folderpath of the point rasters
+#    bufferFolder (string) - absolute folderpath of the buffer rasters
+#    years (int array) - years to include
+# OUTPUTS:
+#    pandas dataframe with one row per surface: name (raster filename without extension), year, surface
+#    (perception, comparison level, and buffer, e.g. 'be_ci_500'), and path
+def getSurfaces(rasterFolder=RASTER_FOLDER,bufferFolder=BUFFER_FOLDER,years=YEARS):
+    records = []
+    for year in years:
+        for label in LABELS:
+            for level in COMPARISON_LEVELS:
+                surface = label + "_" + level
+                records.append((year,surface,rasterFolder + "geo_" + str(year) + "_" + surface + ".tif"))
+                for buffer in BUFFER_DISTANCES:
+                    records.append((year,surface + "_" + str(buffer),bufferFolder + "geo_" + str(year) + "_" + surface + "_" + str(buffer) + ".tif"))
+    surfaces = ps.DataFrame(records,columns=['year','surface','path'])
+    surfaces.insert(0,'name',"geo_" + surfaces['year'].astype(str) + "_" + surfaces['surface'])
+    exists = surfaces['path'].apply(os.path.exists)
+    for path in surfaces['path'][~exists]:
+        print("surface %s does not exist, values will be NaN" %(path))
+    return(surfaces[exists].reset_index(drop=True))
+
+# sort points by the tile of a grid that contains them.  Points outside the grid or without coordinates are
+# left out
+# INPUTS:
+#    lon, lat (float arrays) - point coordinates in the coordinate system of the grid
+#    grid (tuple) - created by rasterStorage.getTiledGrid
+# OUTPUTS:
+#    PointTiles
+def locatePoints(lon,lat,grid):
+    crs,transform,width,height,tileHeight,tileWidth = grid
+    a,b,c,d,e,f = tuple(transform)[:6]
+    if(b!=0 or d!=0):
+        raise ValueError("rotated rasters are not supported")
+    with np.errstate(invalid='ignore'):
+        cols = np.floor((np.asarray(lon,dtype=np.float64) - c)/a)
+        rows = np.floor((np.asarray(lat,dtype=np.float64) - f)/e)
+        points = np.flatnonzero((cols>=0) & (cols<width) & (rows>=0) & (rows<height))
+    rows,cols = rows[points].astype(np.int64),cols[points].astype(np.int64)
+    tiles = (rows//tileHeight)*(-(-width//tileWidth)) + cols//tileWidth
+    order = np.argsort(tiles,kind='stable')
+    tiles = tiles[order]
+    starts = np.flatnonzero(np.r_[True,tiles[1:]!=tiles[:-1]]) if len(tiles)>0 else np.empty(0,dtype=np.int64)
+    return(PointTiles(points[order],rows[order],cols[order],tiles[starts],starts))
+
+# read the values of one surface at sorted points.  Each occupied tile is read once
+# INPUTS:
+#    inFile (string) - absolute filepath of the raster
+#    pointTiles (PointTiles) - points sorted by the tiles of the raster's grid
+#    nPoints (int) - number of points in the original order
+# OUTPUTS:
+#    VALUE_DTYPE array with one value per point in the original order, NaN for NoData and points outside the raster
+def sampleSurface(inFile,pointTiles,nPoints):
+    values = np.full(nPoints,np.nan,dtype=VALUE_DTYPE)
+    with timeStage('sample_surface',surface=os.path.basename(inFile)) as timer, rasterio.open(inFile) as src:
+        tileHeight,tileWidth = src.block_shapes[0]
+        nTileCols = -(-src.width//tileWidth)
+        for tile,start,end in pointTiles.tileSlices():
+            row0,col0 = (tile//nTileCols)*tileHeight,(tile%nTileCols)*tileWidth
+            window = Window(col0,row0,min(tileWidth,src.width - col0),min(tileHeight,src.height - row0))
+            tileValues = src.read(1,window=window)[pointTiles.rows[start:end] - row0,pointTiles.cols[start:end] - col0]
+            tileValues = tileValues.astype(VALUE_DTYPE)
+            if(src.nodata is not None):
+                tileValues[tileValues==VALUE_DTYPE(src.nodata)] = np.nan
+            values[pointTiles.points[start:end]] = tileValues
+        timer.count(points=len(pointTiles),tiles=len(pointTiles.tiles))
+    return(values)
+
+# store the sorted points of every grid in the current CPU worker.  Used as the pool initializer, so the points
+# are sent to each worker once rather than once per surface
+# INPUTS:
+#    pointTilesByGrid (dictionary) - kv pairs of grids:PointTiles
+#    nPoints (int) - number of points in the original order
+def initWorker(pointTilesByGrid,nPoints):
+    workerState['pointTiles'] = pointTilesByGrid
+    workerState['nPoints'] = nPoints
+
+# read the values of one surface in a CPU worker
+# INPUTS:
+#    surfaceTuple (tuple) - (absolute filepath of the raster, grid of the raster)
+# OUTPUTS:
+#    see sampleSurface
+def sampleSurfaceWorker(surfaceTuple):
+    inFile,grid = surfaceTuple
+    return(sampleSurface(inFile,workerState['pointTiles'][grid],workerState['nPoints']))
+
+# read the values of every surface at a set of points.  Points are sorted once for each distinct grid
+# INPUTS:
+#    lon, lat (float arrays) - point coordinates in decimal degrees
+#    surfaces (pandas dataframe) - surfaces created by getSurfaces
+#    nWorkers (int) - number of CPU workers.  If 1, surfaces are read in the current process
+# OUTPUTS:
+#    dictionary of kv pairs of surface names:VALUE_DTYPE arrays of values in the original point order
+def sampleSurfaces(lon,lat,surfaces,nWorkers=N_WORKERS):
+    # rasters with the same grid share the same sorted points
+    grids = [getTiledGrid(path) for path in surfaces['path']]
+    pointTilesByGrid = {grid:locatePoints(lon,lat,grid) for grid in set(grids)}
+    surfaceTuples = list(zip(surfaces['path'],grids))
+    if(nWorkers<=1 or len(surfaceTuples)<=1):
+        results = [sampleSurface(path,pointTilesByGrid[grid],len(lon)) for path,grid in surfaceTuples]
+    else:
+        with Pool(processes=nWorkers,initializer=initWorker,initargs=(pointTilesByGrid,len(lon))) as pool:
+            results = pool.map(sampleSurfaceWorker,surfaceTuples,chunksize=1)
+    return(dict(zip(surfaces['name'],results)))
+
+# rank the surface years by their distance from each point's year.  Ties go to the earlier year
+# INPUTS:
+#    pointYears (float array) - year of each point, NaN if unknown
+#    years (int array) - sorted surface years
+# OUTPUTS:
+#    int array of shape (n points, n years), column k is the index in years of the k-th nearest year
+def rankYears(pointYears,years):
+    distance = np.abs(np.asarray(pointYears,dtype=np.float64)[:,None] - np.asarray(years)[None,:])
+    # years are sorted, so a stable sort ranks equal distances from the earliest year
+    return(np.argsort(distance,axis=1,kind='stable'))
+
+# link points to the perception surfaces
+# INPUTS:
+#    points (pandas dataframe) - points to link, with latitude and longitude fields in decimal degrees
+#    surfaces (pandas dataframe) - surfaces created by getSurfaces
+#    yearField (string) - optional, field with the year of each point.  If None, every year of every surface is
+#                         returned (e.g. geo_2008_be_ci_500).  Otherwise, each surface is returned once (e.g.
+#                         be_ci_500), from the year nearest to each point's year, with the year in rasterYear
+#    fillYears (boolean) - if true and yearField is set, NoData values are taken from the next nearest year with
+#                          data, and the year used for each surface is returned in <surface>_year
+#    nWorkers (int) - number of CPU workers
+#    latField, lonField (string) - coordinate fields of points
+# OUTPUTS:
+#    pandas dataframe with the fields of points and one field per linked surface, in the order of points
+def linkPoints(points,surfaces,yearField=None,fillYears=FILL_YEARS,nWorkers=N_WORKERS,latField=LAT_FIELD,lonField=LON_FIELD):
+    with timeStage('link_points') as timer:
+        values = sampleSurfaces(points[lonField].values,points[latField].values,surfaces,nWorkers)
+        if(yearField is None):
+            linked = ps.DataFrame(values,copy=False)
+        else:
+            linked = selectNearestYears(points[yearField].values,surfaces,values,fillYears)
+        linked.index = points.index
+        timer.count(points=len(points),values=len(points)*len(surfaces))
+    return(ps.concat([points,linked],axis=1))
+
+# select the value of each surface from the year nearest to each point's year
+# INPUTS:
+#    pointYears (float array) - year of each point, NaN if unknown
+#    surfaces (pandas dataframe) - surfaces created by getSurfaces
+#    values (dictionary) - values of each surface, created by sampleSurfaces
+#    fillYears (boolean) - see linkPoints
+# OUTPUTS:
+#    pandas dataframe with rasterYear and one field per surface, plus <surface>_year fields if fillYears is true
+def selectNearestYears(pointYears,surfaces,values,fillYears):
+    years = sorted(surfaces['year'].unique())
+    nPoints = len(pointYears)
+    hasYear = ~np.isnan(np.asarray(pointYears,dtype=np.float64))
+    ranks = rankYears(np.where(hasYear,pointYears,0),years)
+    rows = np.arange(nPoints)
+    linked = {'rasterYear':np.where(hasYear,np.asarray(years,dtype=np.float64)[ranks[:,0]],np.nan)}
+    for surface in surfaces['surface'].unique():
+        names = dict(zip(surfaces['year'][surfaces['surface']==surface],surfaces['name'][surfaces['surface']==surface]))
+        stack = np.full((nPoints,len(years)),np.nan,dtype=VALUE_DTYPE)
+        for column,year in enumerate(years):
+            if(year in names):
+                stack[:,column] = values[names[year]]
+        chosen = ranks[:,0].copy()
+        if(fillYears):
+            for rank in range(1,len(years)):
+                missing = np.isnan(stack[rows,chosen])
+                chosen[missing] = ranks[missing,rank]
+        selected = stack[rows,chosen]
+        selected[~hasYear] = np.nan
+        linked[surface] = selected
+        if(fillYears):
+            linked[surface + "_year"] = np.where(hasYear & ~np.isnan(selected),np.asarray(years,dtype=np.float64)[chosen],np.nan)
+    return(ps.DataFrame(linked,copy=False))
+
+# create random points inside the extent of a surface, for benchmarking
+# INPUTS:
+#    inFile (string) - absolute filepath of a surface
+#    nPoints (int) - number of points
+#    seed (int) - random seed
+# OUTPUTS:
+#    pandas dataframe with lat, lon, and year fields
+def createRandomPoints(inFile,nPoints,seed=0):
+    rng = np.random.default_rng(seed)
+    with rasterio.open(inFile) as src:
+        bounds = src.bounds
+    return(ps.DataFrame({
+        LAT_FIELD:rng.uniform(bounds.bottom,bounds.top,nPoints),
+        LON_FIELD:rng.uniform(bounds.left,bounds.right,nPoints),
+        'year':rng.integers(min(YEARS) - 2,max(YEARS) + 3,nPoints)
+    }))
+
+# measure linkage throughput for random points inside the extent of the surfaces
+# INPUTS:
+#    surfaces (pandas dataframe) - surfaces created by getSurfaces
+#    nPoints (int) - number of random points
+#    nWorkers (int) - number of CPU workers
+#    seed (int) - random seed
+# OUTPUTS:
+#    dictionary of benchmark results
+def benchmarkLinkage(surfaces,nPoints,nWorkers=N_WORKERS,seed=0):
+    points = createRandomPoints(surfaces['path'].iloc[0],nPoints,seed)
+    startTime = time.time()
+    linked = linkPoints(points,surfaces,'year',FILL_YEARS,nWorkers)
+    seconds = time.time() - startTime
+    return({
+        'points':nPoints,
+        'surfaces':len(surfaces),
+        'workers':nWorkers,
+        'seconds':seconds,
+        'pointsPerSecond':nPoints/seconds,
+        'valuesPerSecond':nPoints*len(surfaces)/seconds,
+        'noDataFraction':float(np.isnan(linked[surfaces['surface'].unique()].values).mean()),
+        'peakRSSBytes':getPeakRSS()
+    })
+
+# link a table of points from the command line, e.g.
+#    python exposureLinkage.py addresses.csv linked.parquet --year-field year
+# or benchmark linkage throughput, e.g.
+#    python exposureLinkage.py --benchmark 1000000
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="link points to the national perception surfaces")
+    parser.add_argument('inFile',nargs='?',help="csv or parquet table of points")
+    parser.add_argument('outFile',nargs='?',help="csv or parquet table to write")
+    parser.add_argument('--raster-folder',default=RASTER_FOLDER)
+    parser.add_argument('--buffer-folder',default=BUFFER_FOLDER)
+    parser.add_argument('--lat-field',default=LAT_FIELD)
+    parser.add_argument('--lon-field',default=LON_FIELD)
+    parser.add_argument('--year-field',default=None,help="link the year nearest to each point's year, rather than every year")
+    parser.add_argument('--fill-years',action='store_true',help="take NoData values from the next nearest year with data")
+    parser.add_argument('--workers',type=int,default=N_WORKERS)
+    parser.add_argument('--benchmark',type=int,default=0,help="number of random points to benchmark with")
+    args = parser.parse_args()
+    surfaces = getSurfaces(args.raster_folder,args.buffer_folder)
+    if(len(surfaces)==0):
+        raise FileNotFoundError("no perception surfaces found in %s or %s" %(args.raster_folder,args.buffer_folder))
+    if(args.benchmark>0):
+        print(json.dumps(benchmarkLinkage(surfaces,args.benchmark,args.workers)))
+    else:
+        inFormat = 'parquet' if args.inFile.endswith('.parquet') else 'csv'
+        points = readTableFile(args.inFile,inFormat)
+        linked = linkPoints(points,surfaces,args.year_field,args.fill_years,args.workers,args.lat_field,args.lon_field)
+        outFormat = 'parquet' if args.outFile.endswith('.parquet') else 'csv'
+        writeTable(linked,os.path.splitext(args.outFile)[0],outFormat)
+        print("linked %i points to %i surfaces" %(len(linked),len(surfaces)))
@@ -0,0 +1,304 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: open source, out-of-core replacement for arcpy.ia.FocalStatistics with circular MEAN neighborhoods
+#          and ignore_nodata="DATA".  Rasters are processed in tiles with a halo as wide as the largest
+#          neighborhood, so memory is bounded by the tile size rather than the raster size.  Circles are split
+#          into one horizontal run of cells per row offset, and each run is summed from row-wise prefix sums,
+#          which gives exact circular sums in O(radius) operations per cell.  All neighborhood sizes are
+#          calculated from a single read of each tile, and tiles are streamed through a process pool.
+#          Rasters in a geographic coordinate system are processed on their native grid, with circles measured
+#          in meters.  The shape of each circle is calculated from the meters per degree at the latitude of each
+#          row, so rasters do not need to be projected and projected back again.  Means are quantized to uint16
+#          in the pool workers and outputs are stored as Cloud Optimized GeoTIFFs (see rasterStorage).
+
+# import dependencies
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import calculate_default_transform
+from rasterio.windows import Window
+from rasterStorage import QuantizedRaster, quantize, getGrid, getTileWindows, getSource, RASTER_DTYPE, RASTER_NODATA
+
+# define global constants
+TILE_SIZE = 1024 # width and height of the core of each tile, in cells.  Halo cells are added on every side
+TILE_CHUNKSIZE = 4 # number of tiles sent to a pool worker at once
+WGS84_SEMI_MAJOR = 6378137.0 # WGS 1984 semi-major axis, in meters
+WGS84_ECCENTRICITY_SQ = 0.00669437999014 # WGS 1984 first eccentricity squared
+
+# create a circular neighborhood, matching the "Circle <radius> MAP" neighborhood of FocalStatistics.  Cells
+# whose centers are within the radius of the center cell are part of the neighborhood
+# INPUTS:
+#    radius (float) - radius of the circle in map units
+#    cellSizeX, cellSizeY (float) - cell width and height in map units
+# OUTPUTS:
+#    halfWidths (int array) - number of cells to the left and right of the center column in each row of the
+#                             neighborhood, from the top row offset (-len//2) to the bottom row offset
+def createCircleKernel(radius,cellSizeX,cellSizeY):
+    nRows = int(np.floor(radius/cellSizeY))
+    rowOffsets = np.arange(-nRows,nRows + 1)
+    return(np.floor(np.sqrt(radius**2 - (rowOffsets*cellSizeY)**2)/cellSizeX).astype(np.int64))
+
+# calculate the length of one degree of latitude and one degree of longitude on the WGS 1984 ellipsoid
+# INPUTS:
+#    lat (float or float array) - latitude in decimal degrees
+# OUTPUTS:
+#    tuple of (meters per degree latitude, meters per degree longitude)
+def metersPerDegree(lat):
+    lat = np.radians(lat)
+    denominator = 1 - WGS84_ECCENTRICITY_SQ*np.sin(lat)**2
+    meridionalRadius = WGS84_SEMI_MAJOR*(1 - WGS84_ECCENTRICITY_SQ)/denominator**1.5
+    normalRadius = WGS84_SEMI_MAJOR/np.sqrt(denominator)
+    return((np.radians(meridionalRadius),np.radians(normalRadius*np.cos(lat))))
+
+# create a circular neighborhood on a geographic grid.  Distances north-south are measured at the latitude of
+# the center cell, and distances east-west at the latitude of each row of the neighborhood
+# INPUTS:
+#    radius (float) - radius of the circle in meters
+#    cellSizeX, cellSizeY (float) - cell width and height in decimal degrees
+#    lat (float) - latitude of the center cell
+# OUTPUTS:
+#    halfWidths (int array) - see createCircleKernel
+def createGeographicKernel(radius,cellSizeX,cellSizeY,lat):
+    latScale = metersPerDegree(lat)[0]
+    nRows = int(np.floor(radius/(cellSizeY*latScale)))
+    rowOffsets = np.arange(-nRows,nRows + 1)
+    # rows below the center cell are further south
+    lonScale = metersPerDegree(lat - rowOffsets*cellSizeY)[1]
+    return(np.floor(np.sqrt(radius**2 - (rowOffsets*cellSizeY*latScale)**2)/(cellSizeX*lonScale)).astype(np.int64))
+
+# create the neighborhoods of every row of a raster.  Rasters in a projected coordinate system use the same
+# neighborhood for every row.  Rasters in a geographic coordinate system use a neighborhood for each latitude
+# band, where a band is a run of consecutive rows with the same neighborhood shape
+# INPUTS:
+#    radius (float) - radius of the circle, in meters for geographic rasters and map units otherwise
+#    crs (rasterio CRS) - coordinate system of the raster
+#    transform (affine) - geotransform of the raster
+#    height (int) - number of rows in the raster
+# OUTPUTS:
+#    list of (first row, last row + 1, halfWidths) tuples
+def createKernelBands(radius,crs,transform,height):
+    if not(crs.is_geographic):
+        return([(0,height,createCircleKernel(radius,abs(transform.a),abs(transform.e)))])
+    bands = []
+    for row in range(height):
+        lat = transform.f + (row + 0.5)*transform.e
+        halfWidths = createGeographicKernel(radius,abs(transform.a),abs(transform.e),lat)
+        if(len(bands)>0 and np.array_equal(bands[-1][2],halfWidths)):
+            bands[-1] = (bands[-1][0],row + 1,halfWidths)
+        else:
+            bands.append((row,row + 1,halfWidths))
+    return(bands)
+
+# get the latitude bands that overlap the core of a tile
+# INPUTS:
+#    bands (list) - created by createKernelBands
+#    rowOff, height (int) - first row and number of rows of the tile core
+# OUTPUTS:
+#    list of (first row, last row + 1, halfWidths) tuples, with rows relative to the tile core
+def getTileBands(bands,rowOff,height):
+    return([
+        (max(row0,rowOff) - rowOff,min(row1,rowOff + height) - rowOff,halfWidths)
+        for row0,row1,halfWidths in bands if row0<rowOff + height and row1>rowOff
+    ])
+
+# sum values over a circular neighborhood of every cell in a set of rows of the core of a tile
+# INPUTS:
+#    prefix (2d float array) - row-wise prefix sums of the tile, with a leading column of zeros
+#    halfWidths (int array) - neighborhood created by createCircleKernel or createGeographicKernel
+#    haloRows, haloCols (int) - number of halo cells above/below and left/right of the core
+#    row0, row1 (int) - first and last + 1 rows of the core to sum
+#    coreWidth (int) - number of columns in the core
+# OUTPUTS:
+#    2d float array of neighborhood sums, shape (row1 - row0, coreWidth)
+def focalSum(prefix,halfWidths,haloRows,haloCols,row0,row1,coreWidth):
+    sums = np.zeros((row1 - row0,coreWidth))
+    nRows = len(halfWidths)//2
+    for rowOffset,halfWidth in zip(range(-nRows,nRows + 1),halfWidths.tolist()):
+        rows = slice(haloRows + row0 + rowOffset,haloRows + row1 + rowOffset)
+        sums += prefix[rows,haloCols + halfWidth + 1:haloCols + halfWidth + 1 + coreWidth]
+        sums -= prefix[rows,haloCols - halfWidth:haloCols - halfWidth + coreWidth]
+    return(sums)
+
+# calculate the mean of valid cells over circular neighborhoods of every cell in the core of a tile
+# INPUTS:
+#    data (2d float array) - tile values including the halo
+#    valid (2d bool array) - true for cells with data
+#    kernels (list) - one list of bands per neighborhood size, created by getTileBands
+#    haloRows, haloCols (int) - number of halo cells above/below and left/right of the core
+# OUTPUTS:
+#    list of 2d float arrays, one per neighborhood size, NaN where the neighborhood contains no data
+def focalMeanTile(data,valid,kernels,haloRows,haloCols):
+    coreHeight, coreWidth = data.shape[0] - 2*haloRows, data.shape[1] - 2*haloCols
+    valuePrefix = np.zeros((data.shape[0],data.shape[1] + 1))
+    np.cumsum(np.where(valid,data,0.0),axis=1,out=valuePrefix[:,1:])
+    countPrefix = np.zeros((data.shape[0],data.shape[1] + 1))
+    np.cumsum(valid,axis=1,out=countPrefix[:,1:])
+    means = []
+    for bands in kernels:
+        mean = np.full((coreHeight,coreWidth),np.nan)
+        for row0,row1,halfWidths in bands:
+            sums = focalSum(valuePrefix,halfWidths,haloRows,haloCols,row0,row1,coreWidth)
+            # counts are integers stored as floats, round to remove cancellation error before testing for zero
+            counts = np.rint(focalSum(countPrefix,halfWidths,haloRows,haloCols,row0,row1,coreWidth))
+            np.divide(sums,counts,out=mean[row0:row1],where=counts>0)
+        means.append(mean)
+    return(means)
+
+# read a window of a raster that may extend past the raster edges.  Cells outside the raster are NoData
+# INPUTS:
+#    src (rasterio dataset) - raster to read from
+#    rowOff, colOff (int) - top left cell of the window, may be negative
+#    height, width (int) - shape of the window
+# OUTPUTS:
+#    tuple of (2d float array of values, 2d bool array that is true for cells with data)
+def readPadded(src,rowOff,colOff,height,width):
+    data = np.zeros((height,width))
+    valid = np.zeros((height,width),dtype=bool)
+    row0, col0 = max(rowOff,0), max(colOff,0)
+    row1, col1 = min(rowOff + height,src.height), min(colOff + width,src.width)
+    if(row1<=row0 or col1<=col0):
+        return(data,valid)
+    values = src.read(1,window=Window(col0,row0,col1 - col0,row1 - row0)).astype(np.float64)
+    isValid = ~np.isnan(values)
+    if(src.nodata is not None):
+        isValid &= values!=src.nodata
+    target = (slice(row0 - rowOff,row1 - rowOff),slice(col0 - colOff,col1 - colOff))
+    data[target] = values
+    valid[target] = isValid
+    return(data,valid)
+
+# calculate the focal means of a single tile.  Called by pool workers
+# INPUTS:
+#    tileTuple (tuple) - contains data needed to process one tile
+#         inFile - absolute filepath of the input raster
+#         window - (colOff, rowOff, width, height) of the tile core
+#         kernels - one list of bands per neighborhood size, created by getTileBands
+#         haloRows, haloCols - number of halo cells above/below and left/right of the core
+# OUTPUTS:
+#    tuple of (window, list of quantized uint16 arrays with one array per kernel), or (window, None) if the tile
+#    and its halo contain no data
+def processTile(tileTuple):
+    inFile,window,kernels,haloRows,haloCols = tileTuple
+    colOff,rowOff,width,height = window
+    data,valid = readPadded(getSource(inFile),rowOff - haloRows,colOff - haloCols,height + 2*haloRows,width + 2*haloCols)
+    if not(valid.any()):
+        return((window,None))
+    # means are truncated toward zero, the same as arcpy.sa.Int
+    return((window,[quantize(mean) for mean in focalMeanTile(data,valid,kernels,haloRows,haloCols)]))
+
+# create focal mean rasters for several circular neighborhoods from one read of each tile of the input raster
+# INPUTS:
+#    inFile (string) - absolute filepath of the input raster
+#    outFiles (string array) - absolute filepaths of the quantized output rasters, one per radius
+#    radii (float array) - neighborhood radii in meters for geographic rasters, or the map units of the input
+#                          raster otherwise
+#    pool (multiprocessing pool) - optional, tiles are processed by the pool if provided
+#    tileSize (int) - width and height of the core of each tile
+#    cog (boolean) - if true, outputs are stored as COGs with internal overviews, otherwise as tiled GeoTIFFs
+def focalMeanRaster(inFile,outFiles,radii,pool=None,tileSize=TILE_SIZE,cog=True):
+    crs,transform,width,height = getGrid(inFile)
+    kernelBands = [createKernelBands(radius,crs,transform,height) for radius in radii]
+    allKernels = [halfWidths for bands in kernelBands for row0,row1,halfWidths in bands]
+    haloRows = max([len(halfWidths)//2 for halfWidths in allKernels])
+    haloCols = max([int(halfWidths.max()) for halfWidths in allKernels])
+    tileTuples = [
+        (inFile,window,[getTileBands(bands,window[1],window[3]) for bands in kernelBands],haloRows,haloCols)
+        for window in getTileWindows(width,height,tileSize)
+    ]
+    datasets = [QuantizedRaster(outFile,crs,transform,width,height,cog) for outFile in outFiles]
+    try:
+        results = map(processTile,tileTuples) if pool is None else pool.imap_unordered(processTile,tileTuples,TILE_CHUNKSIZE)
+        for window,outputs in results:
+            if(outputs is None):
+                continue
+            for dataset,output in zip(datasets,outputs):
+                dataset.writeQuantized(output,Window(*window))
+    except BaseException:
+        # incomplete rasters are not converted into COGs
+        for dataset in datasets:
+            dataset.discard()
+        raise
+    finally:
+        for dataset in datasets:
+            dataset.close()
+
+# get the grid of a raster projected into a new coordinate system
+# INPUTS:
+#    inFile (string) - absolute filepath of the input raster
+#    crs (string) - coordinate system of the projected raster, e.g. 'EPSG:3857'
+#    cellSize (float) - cell size of the projected raster in the units of crs
+# OUTPUTS:
+#    tuple of (transform, width, height)
+def getProjectedGrid(inFile,crs,cellSize):
+    with rasterio.open(inFile) as src:
+        return(calculate_default_transform(src.crs,crs,src.width,src.height,*src.bounds,resolution=cellSize))
+
+# project a raster onto a grid one tile at a time, so the projected raster never has to fit in memory
+# INPUTS:
+#    inFile (string) - absolute filepath of the input raster
+#    outFile (string) - absolute filepath of the quantized projected raster
+#    crs (string) - coordinate system of the projected raster
+#    transform (affine), width (int), height (int) - grid of the projected raster
+#    resampling (rasterio Resampling) - resampling method
+#    cog (boolean) - if true, the output is stored as a COG with internal overviews, otherwise as a tiled GeoTIFF
+def projectRaster(inFile,outFile,crs,transform,width,height,resampling=Resampling.bilinear,cog=True):
+    with rasterio.open(inFile) as src:
+        with WarpedVRT(src,crs=crs,transform=transform,width=width,height=height,resampling=resampling,nodata=RASTER_NODATA,dtype=RASTER_DTYPE) as vrt:
+            with QuantizedRaster(outFile,crs,transform,width,height,cog) as dst:
+                for colOff,rowOff,tileWidth,tileHeight in getTileWindows(width,height,TILE_SIZE):
+                    window = Window(colOff,rowOff,tileWidth,tileHeight)
+                    values = vrt.read(1,window=window)
+                    if((values!=RASTER_NODATA).any()):
+                        dst.writeQuantized(values,window)
+
+# compare two rasters on the same grid one tile at a time, e.g. to validate a new method against an existing one
+# INPUTS:
+#    referenceFile (string) - absolute filepath of the reference raster
+#    testFile (string) - absolute filepath of the raster to validate
+# OUTPUTS:
+#    dictionary of kv pairs statistic:value.  Differences are test - reference, over cells with data in both
+def compareRasters(referenceFile,testFile):
+    totals = {'n':0,'referenceOnly':0,'testOnly':0,'sumDiff':0.0,'sumAbsDiff':0.0,'sumSqDiff':0.0,'maxAbsDiff':0.0,
+              'sumRef':0.0,'sumTest':0.0,'sumRefSq':0.0,'sumTestSq':0.0,'sumRefTest':0.0,'within1':0,'within10':0}
+    with rasterio.open(referenceFile) as reference, rasterio.open(testFile) as test:
+        if((reference.transform,reference.width,reference.height)!=(test.transform,test.width,test.height)):
+            raise ValueError("%s and %s are not on the same grid" %(referenceFile,testFile))
+        for window in getTileWindows(reference.width,reference.height,TILE_SIZE):
+            referenceValues,referenceValid = readPadded(reference,window[1],window[0],window[3],window[2])
+            testValues,testValid = readPadded(test,window[1],window[0],window[3],window[2])
+            both = referenceValid & testValid
+            totals['referenceOnly'] += int((referenceValid & ~testValid).sum())
+            totals['testOnly'] += int((testValid & ~referenceValid).sum())
+            if not(both.any()):
+                continue
+            referenceValues, testValues = referenceValues[both], testValues[both]
+            diff = testValues - referenceValues
+            totals['n'] += len(diff)
+            totals['sumDiff'] += diff.sum()
+            totals['sumAbsDiff'] += np.abs(diff).sum()
+            totals['sumSqDiff'] += (diff**2).sum()
+            totals['maxAbsDiff'] = max(totals['maxAbsDiff'],float(np.abs(diff).max()))
+            totals['sumRef'] += referenceValues.sum()
+            totals['sumTest'] += testValues.sum()
+            totals['sumRefSq'] += (referenceValues**2).sum()
+            totals['sumTestSq'] += (testValues**2).sum()
+            totals['sumRefTest'] += (referenceValues*testValues).sum()
+            totals['within1'] += int((np.abs(diff)<=1).sum())
+            totals['within10'] += int((np.abs(diff)<=10).sum())
+    n = max(totals['n'],1)
+    covariance = totals['sumRefTest']/n - totals['sumRef']*totals['sumTest']/n**2
+    referenceVar = totals['sumRefSq']/n - (totals['sumRef']/n)**2
+    testVar = totals['sumTestSq']/n - (totals['sumTest']/n)**2
+    return({
+        'cellsCompared':totals['n'],
+        'referenceOnlyCells':totals['referenceOnly'],
+        'testOnlyCells':totals['testOnly'],
+        'meanDiff':totals['sumDiff']/n,
+        'meanAbsDiff':totals['sumAbsDiff']/n,
+        'rmse':np.sqrt(totals['sumSqDiff']/n),
+        'maxAbsDiff':totals['maxAbsDiff'],
+        'correlation':covariance/np.sqrt(referenceVar*testVar) if referenceVar>0 and testVar>0 else np.nan,
+        'fractionWithin1':totals['within1']/n,
+        'fractionWithin10':totals['within10']/n
+    })
@@ -0,0 +1,144 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: national GSV metadata (rasterLink.csv) stored once as an index sorted by panorama id.  Panorama ids
+#          are stored as a sorted fixed-width byte array, and metadata as a structured array in the same order,
+#          both in .npy sidecar files that every CPU worker memory-maps read-only instead of loading its own
+#          copy of the national table.  Integer panorama ids are positions in the sorted array.
+
+# import dependencies
+import numpy as np
+import pandas as ps
+from pipelineManifest import getTempPath, commitTempFile
+
+# define global constants
+PANID_FIELD = 'panId'
+DROP_FIELDS = ['gridId','GEOID','county','imgMonth','fileName','rasterDiff','t'] # metadata fields not needed for georeferencing
+PANID_SUFFIX = "_panIds.npy" # sidecar filename suffix of the sorted panorama ids
+RECORDS_SUFFIX = "_records.npy" # sidecar filename suffix of the metadata records
+CHUNK_SIZE = 1000000 # number of csv rows parsed at a time when building an index
+MISSING_CODE = -1 # code returned for panorama ids that are not in the index
+
+# custom class for looking up GSV metadata by panorama id
+class GeoLinkIndex:
+
+    # INPUTS:
+    #    panIds (byte string array) - sorted panorama ids.  Integer panorama id i corresponds to panIds[i]
+    #    records (structured array) - metadata of each panorama id, in the same order as panIds
+    def __init__(self,panIds,records):
+        self.panIds = panIds
+        self.records = records
+
+    def __len__(self):
+        return(len(self.panIds))
+
+    # convert panorama ids into integer panorama ids.  If a panorama id appears more than once in the metadata,
+    # the position of the first row is returned
+    # INPUTS:
+    #    panIds (string array) - panorama ids
+    # OUTPUTS:
+    #    int64 array of integer panorama ids, MISSING_CODE for panorama ids that are not in the index
+    def encode(self,panIds):
+        # only the unique panorama ids need to be searched
+        codes,uniques = ps.factorize(ps.Series(panIds).astype(str))
+        keys = np.asarray(uniques.astype(str),dtype='S')
+        if(len(self.panIds)==0 or len(keys)==0):
+            return(np.full(len(codes),MISSING_CODE,dtype=np.int64))
+        # panorama ids longer than the stored width cannot be in the index, and must not match after truncation
+        tooLong = np.char.str_len(keys)>self.panIds.dtype.itemsize
+        keys = keys.astype(self.panIds.dtype)
+        positions = np.minimum(np.searchsorted(self.panIds,keys),len(self.panIds)-1)
+        found = (self.panIds[positions]==keys) & ~tooLong
+        uniqueCodes = np.where(found,positions,MISSING_CODE).astype(np.int64)
+        return(uniqueCodes[codes])
+
+    # get the metadata rows of integer panorama ids, including every row of panorama ids that appear more than
+    # once in the metadata (the same rows an inner merge on panId would return)
+    # INPUTS:
+    #    codes (int array) - integer panorama ids created by encode, without MISSING_CODE
+    # OUTPUTS:
+    #    tuple of (position in codes of each row, metadata row of each row)
+    def lookup(self,codes):
+        codes = np.asarray(codes,dtype=np.int64)
+        ends = np.searchsorted(self.panIds,self.panIds[codes],side='right')
+        counts = ends - codes
+        codePositions = np.repeat(np.arange(len(codes)),counts)
+        firstRows = np.repeat(np.cumsum(counts) - counts,counts)
+        return((codePositions,np.repeat(codes,counts) + np.arange(len(codePositions)) - firstRows))
+
+# get the sidecar filepaths of a geo link index
+# INPUTS:
+#    basePath (string) - absolute filepath of the index, without suffix
+# OUTPUTS:
+#    list of absolute filepaths (panorama ids, records)
+def getGeoLinkIndexFiles(basePath):
+    return([basePath + PANID_SUFFIX,basePath + RECORDS_SUFFIX])
+
+# create a geo link index from the national GSV metadata csv.  The csv is parsed in chunks and the index is
+# sorted once
+# INPUTS:
+#    inFile (string) - absolute filepath to the metadata csv
+#    dropFields (string array) - metadata fields to leave out of the index
+#    chunkSize (int) - number of csv rows to parse at a time
+# OUTPUTS:
+#    GeoLinkIndex containing every row of the csv
+def buildGeoLinkIndex(inFile,dropFields=DROP_FIELDS,chunkSize=CHUNK_SIZE):
+    reader = ps.read_csv(inFile,usecols=lambda field: field not in dropFields,dtype={PANID_FIELD:str},chunksize=chunkSize)
+    geoLink = ps.concat([chunk for chunk in reader],ignore_index=True)
+    panIds = np.asarray(geoLink[PANID_FIELD].values,dtype='S')
+    order = np.argsort(panIds,kind='stable')
+    fields = [field for field in geoLink.columns if field!=PANID_FIELD]
+    records = np.empty(len(geoLink),dtype=[(field,getFieldDtype(geoLink[field])) for field in fields])
+    for field in fields:
+        records[field] = geoLink[field].values[order].astype(records.dtype[field])
+    return(GeoLinkIndex(panIds[order],records))
+
+# get a fixed-width numpy dtype for a metadata field, so records can be stored without pickling
+# INPUTS:
+#    values (pandas series) - values of the field
+# OUTPUTS:
+#    numpy dtype
+def getFieldDtype(values):
+    if(values.dtype==object):
+        return(np.asarray(values.astype(str).values).dtype)
+    return(values.dtype)
+
+# save a geo link index as .npy sidecar files.  Files are written to temporary paths and renamed once complete,
+# so a crash never leaves a truncated index in place
+# INPUTS:
+#    geoLinkIndex (GeoLinkIndex) - index to save
+#    basePath (string) - absolute filepath of the index, without suffix
+def saveGeoLinkIndex(geoLinkIndex,basePath):
+    for outFile,values in zip(getGeoLinkIndexFiles(basePath),[geoLinkIndex.panIds,geoLinkIndex.records]):
+        tempFile = getTempPath(outFile)
+        np.save(tempFile,np.asarray(values))
+        commitTempFile(tempFile,outFile)
+
+# load a geo link index from .npy sidecar files as read-only memory maps
+# INPUTS:
+#    basePath (string) - absolute filepath of the index, without suffix
+# OUTPUTS:
+#    GeoLinkIndex backed by the memory-mapped files
+def loadGeoLinkIndex(basePath):
+    panIdFile,recordsFile = getGeoLinkIndexFiles(basePath)
+    return(GeoLinkIndex(np.load(panIdFile,mmap_mode='r'),np.load(recordsFile,mmap_mode='r')))
+
+# calculate the mean of each column for each group, by sorting rows by group once.  NaN values are ignored,
+# the same as pandas groupby().mean()
+# INPUTS:
+#    groups (int array) - group of each row
+#    values (2d float array) - shape (n rows, n columns)
+# OUTPUTS:
+#    tuple of (sorted unique groups, 2d float64 array of group means with shape (n groups, n columns))
+def groupMeans(groups,values):
+    order = np.argsort(groups,kind='stable')
+    sortedGroups = np.asarray(groups)[order]
+    values = np.asarray(values,dtype=np.float64)[order]
+    if(len(sortedGroups)==0):
+        return(sortedGroups,np.empty((0,values.shape[1])))
+    starts = np.flatnonzero(np.r_[True,sortedGroups[1:]!=sortedGroups[:-1]])
+    valid = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(valid,values,0.0),starts,axis=0)
+    counts = np.add.reduceat(valid.astype(np.int64),starts,axis=0)
+    means = np.full(sums.shape,np.nan)
+    np.divide(sums,counts,out=means,where=counts>0)
+    return(sortedGroups[starts],means)
@@ -0,0 +1,107 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: maps street view image filenames to stable int32 codes, once per MSA.  The mapping is the sorted
+#          set of unique filenames stored as a fixed-width byte array in a .npy sidecar file, so it can be
+#          memory-mapped by every stage and codes are simply positions in the sorted array.
+
+# import dependencies
+import numpy as np
+import pandas as ps
+import os
+from pipelineManifest import getTempPath, commitTempFile
+
+# define global constants
+IMG_ID_LENGTH = len('04005_097627_08W.png') # image ids are interned without the prefix added during siamese network processing
+INDEX_DTYPE = 'S' + str(IMG_ID_LENGTH)
+INDEX_FILENAME = "image_index.npy" # sidecar filename within each MSA folder
+CHUNK_SIZE = 1000000 # number of csv rows parsed at a time when building an index
+MISSING_CODE = -1 # code returned for image ids that are not in the index
+
+# custom class for converting between image filenames and int32 codes
+class ImageIndex:
+
+    # INPUTS:
+    #    names (byte string array) - sorted, unique image filenames.  Code i corresponds to names[i]
+    def __init__(self,names):
+        self.names = names
+
+    def __len__(self):
+        return(len(self.names))
+
+    # convert image filenames into int32 codes
+    # INPUTS:
+    #    imgIds (string array) - image filenames, with or without the siamese network prefix
+    # OUTPUTS:
+    #    int32 array of codes, MISSING_CODE for filenames that are not in the index
+    def encode(self,imgIds):
+        # only the unique filenames need to be searched
+        categories = ps.Categorical(shortenImgIds(ps.Series(imgIds)))
+        keys = np.asarray(categories.categories.values,dtype=INDEX_DTYPE)
+        if(len(self.names)==0):
+            return(np.full(len(categories),MISSING_CODE,dtype=np.int32))
+        positions = np.minimum(np.searchsorted(self.names,keys),len(self.names)-1)
+        found = self.names[positions]==keys
+        categoryCodes = np.where(found,positions,MISSING_CODE).astype(np.int32)
+        return(categoryCodes[categories.codes])
+
+    # convert int32 codes back into image filenames.  Used at final export only
+    # INPUTS:
+    #    codes (int array) - codes to decode
+    # OUTPUTS:
+    #    string array of image filenames
+    def decode(self,codes):
+        return(np.char.decode(self.names[np.asarray(codes)],'ascii'))
+
+# remove the prefix added to image filenames during siamese network processing
+# INPUTS:
+#    imgIds (pandas series) - image filenames
+# OUTPUTS:
+#    pandas series of image filenames without the prefix
+def shortenImgIds(imgIds):
+    return(imgIds.astype(str).str[-IMG_ID_LENGTH:])
+
+# create an image index from the image filenames in one or more siamese network model prediction csvs
+# INPUTS:
+#    inputCSVs (string array) - absolute filepaths to csvs containing siamese perception model predictions
+#    chunkSize (int) - number of csv rows to parse at a time
+# OUTPUTS:
+#    ImageIndex containing every image that appears in any of the csvs
+def buildImageIndex(inputCSVs,chunkSize=CHUNK_SIZE):
+    uniqueImgs = set()
+    for inputCSV in inputCSVs:
+        reader = ps.read_csv(inputCSV,usecols=['l_img','r_img'],dtype='category',chunksize=chunkSize)
+        for chunk in reader:
+            uniqueImgs.update(chunk['l_img'].cat.categories)
+            uniqueImgs.update(chunk['r_img'].cat.categories)
+    shortImgs = ps.unique(shortenImgIds(ps.Series(list(uniqueImgs),dtype=object)))
+    return(ImageIndex(np.sort(np.asarray(shortImgs,dtype=INDEX_DTYPE))))
+
+# save an image index as a .npy sidecar file.  The file is written to a temporary path and renamed once complete,
+# so a crash never leaves a truncated index in place
+# INPUTS:
+#    imageIndex (ImageIndex) - index to save
+#    outFile (string) - absolute filepath of the sidecar file
+def saveImageIndex(imageIndex,outFile):
+    tempFile = getTempPath(outFile)
+    np.save(tempFile,np.asarray(imageIndex.names))
+    commitTempFile(tempFile,outFile)
+
+# load an image index from a .npy sidecar file as a read-only memory map
+# INPUTS:
+#    inFile (string) - absolute filepath of the sidecar file
+# OUTPUTS:
+#    ImageIndex backed by the memory-mapped file
+def loadImageIndex(inFile):
+    return(ImageIndex(np.load(inFile,mmap_mode='r')))
+
+# load the image index for a folder if it exists, otherwise build it from the csvs and save it in the folder
+# INPUTS:
+#    folder (string) - absolute folderpath where the sidecar file is stored
+#    inputCSVs (string array) - absolute filepaths to csvs containing siamese perception model predictions
+# OUTPUTS:
+#    ImageIndex for the folder
+def getImageIndex(folder,inputCSVs):
+    indexFile = folder + INDEX_FILENAME
+    if not(os.path.exists(indexFile)):
+        saveImageIndex(buildImageIndex(inputCSVs),indexFile)
+    return(loadImageIndex(indexFile))
@@ -0,0 +1,148 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: persistent multiprocessing scheduler for the national pipeline.  Runs a single queue of jobs across a
+#          fixed pool of CPU workers, largest jobs first, while keeping the estimated memory of running jobs under
+#          a limit.  Also partitions work across multiple workstations into balanced shards.
+
+# import dependencies
+from multiprocessing import Pool
+import queue
+import os
+from telemetry import timeStage
+
+# define global constants
+SAMPLE_BYTES = 1024*1024 # number of bytes read from the start of a csv to estimate the average row length
+
+# estimate the number of rows in a csv from the file size and the average length of the first rows
+# INPUTS:
+#    inFile (string) - absolute filepath to the csv
+# OUTPUTS:
+#    estimated number of rows, excluding the header
+def estimateRowCount(inFile):
+    fileSize = os.path.getsize(inFile)
+    with open(inFile,'rb') as f:
+        sample = f.read(SAMPLE_BYTES)
+    nLines = sample.count(b'\n')
+    if(nLines<=1):
+        return(nLines)
+    # the sample covers the whole file
+    if(len(sample)==fileSize):
+        return(nLines - 1)
+    return(int(fileSize/(len(sample)/nLines)) - 1)
+
+# partition work units across workstations so each workstation receives approximately the same total size.
+# Units are assigned largest first to the workstation with the smallest total (longest processing time rule),
+# so every workstation computes the same partition from the same inputs
+# INPUTS:
+#    unitSizes (dictionary) - kv pairs of work unit names:sizes (e.g. MSA:bytes of input data)
+#    nShards (int) - number of workstations
+# OUTPUTS:
+#    shards (list of lists) - work unit names assigned to each workstation
+def assignShards(unitSizes,nShards):
+    shards = [[] for shard in range(nShards)]
+    shardSizes = [0]*nShards
+    for unit in sorted(unitSizes.keys(),key=lambda unit: (-unitSizes[unit],str(unit))):
+        shard = shardSizes.index(min(shardSizes))
+        shards[shard].append(unit)
+        shardSizes[shard] += unitSizes[unit]
+    return(shards)
+
+# create a job for runJobs
+# INPUTS:
+#    name (string) - unique job name
+#    func (function) - top-level function to run in a CPU worker
+#    args (tuple) - arguments passed to func
+#    size (float) - job size used to order jobs, larger jobs run first
+#    memory (float) - estimated peak memory of the job, in bytes
+#    after (list of strings) - names of jobs that must complete before this job starts
+#    tag (any) - optional value stored with the job, e.g. the MSA the job belongs to
+# OUTPUTS:
+#    job (dictionary)
+def createJob(name,func,args,size=0,memory=0,after=None,tag=None):
+    return({
+        'tag':tag,
+        'name':name,
+        'func':func,
+        'args':args,
+        'size':size,
+        'memory':memory,
+        'after':set(after or [])
+    })
+
+# select the largest pending job that is ready to run and fits in the remaining memory budget.  If no jobs are
+# running, the largest ready job is selected even if it exceeds the budget, so oversized jobs run alone
+# INPUTS:
+#    pending (list of dictionaries) - jobs that have not started, sorted largest first
+#    finished (set) - names of completed jobs
+#    memoryFree (float) - remaining memory budget, in bytes
+#    nRunning (int) - number of jobs currently running
+# OUTPUTS:
+#    index of the selected job in pending, or None if no job can start
+def selectJob(pending,finished,memoryFree,nRunning):
+    for index,job in enumerate(pending):
+        if not(job['after'] <= finished):
+            continue
+        if(job['memory'] <= memoryFree or nRunning==0):
+            return(index)
+    return(None)
+
+# run a job in a CPU worker.  If telemetry is on, the job's duration and memory are recorded with its
+# estimated memory, so memory estimates can be checked against measured memory
+# INPUTS:
+#    name (string) - job name
+#    func (function) - top-level function to run
+#    args (tuple) - arguments passed to func
+#    memory (float) - estimated peak memory of the job, in bytes
+# OUTPUTS:
+#    value returned by func
+def runTimedJob(name,func,args,memory):
+    with timeStage('job',job=name,memoryEstimate=memory):
+        return(func(*args))
+
+# run jobs on a persistent pool of CPU workers.  Idle workers take the largest ready job from a single shared
+# queue, and jobs only start if their estimated memory fits under the memory limit
+# INPUTS:
+#    jobs (list of dictionaries) - jobs created by createJob
+#    nWorkers (int) - number of CPU workers
+#    memoryLimit (float) - maximum total estimated memory of running jobs, in bytes
+#    onComplete (function) - optional, called in the main process with (job, result) after each job completes
+def runJobs(jobs,nWorkers,memoryLimit,onComplete=None):
+    pending = sorted(jobs,key=lambda job: -job['size'])
+    finished = set()
+    completed = queue.Queue()
+    nRunning, memoryFree = 0, memoryLimit
+    pool = Pool(processes=nWorkers)
+    try:
+        while(len(pending)>0 or nRunning>0):
+
+            # start as many jobs as there are idle workers and memory
+            while(nRunning<nWorkers):
+                index = selectJob(pending,finished,memoryFree,nRunning)
+                if(index is None):
+                    break
+                job = pending.pop(index)
+                nRunning +=1
+                memoryFree -= job['memory']
+                pool.apply_async(
+                    runTimedJob,(job['name'],job['func'],job['args'],job['memory']),
+                    callback=lambda result,job=job: completed.put((job,result,None)),
+                    error_callback=lambda error,job=job: completed.put((job,None,error))
+                )
+            if(nRunning==0):
+                raise ValueError("jobs %s depend on jobs that do not exist" %([job['name'] for job in pending]))
+
+            # wait for the next job to finish
+            job,result,error = completed.get()
+            nRunning -=1
+            memoryFree += job['memory']
+            if(error is not None):
+                raise error
+            finished.add(job['name'])
+            print("completed job %s, %i jobs remaining" %(job['name'],len(pending)+nRunning))
+            if(onComplete is not None):
+                onComplete(job,result)
+    except BaseException:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
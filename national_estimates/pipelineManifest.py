@@ -0,0 +1,155 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: crash-safe progress tracking for the national pipeline.  Keeps one row per task (stage, MSA, label,
+#          comparison level, year) in a local SQLite manifest, with a fingerprint of the task inputs and a checksum
+#          of the task outputs.  A task is only treated as complete if its inputs are unchanged and its outputs
+#          are the files that were recorded, so restarts after crashes redo incomplete or stale tasks only.
+#          Outputs are written to a temporary path and atomically renamed once complete.
+
+# import dependencies
+import sqlite3
+import hashlib
+import json
+import time
+import os
+
+# define global constants
+MANIFEST_FILENAME = "pipeline_manifest.db" # manifest filename, stored in each script's PARENT_FOLDER
+DB_TIMEOUT = 300 # seconds to wait for another CPU worker to release a lock on the manifest
+CHECKSUM_BLOCK = 8*1024*1024 # bytes read at a time when calculating output checksums
+
+# open the manifest, creating the task table if needed
+# INPUTS:
+#    dbFile (string) - absolute filepath to the manifest
+# OUTPUTS:
+#    sqlite3 connection
+def openManifest(dbFile):
+    connection = sqlite3.connect(dbFile,timeout=DB_TIMEOUT)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("""CREATE TABLE IF NOT EXISTS tasks (
+        stage TEXT, msa TEXT, label TEXT, level TEXT, year TEXT,
+        input_fingerprint TEXT, output_fingerprint TEXT, output_checksum TEXT, completed REAL,
+        PRIMARY KEY (stage, msa, label, level, year))""")
+    return(connection)
+
+# create the key that identifies a single task.  Unused parts of the key are empty strings
+# INPUTS:
+#    stage (string) - pipeline stage (e.g. 'ts_scores')
+#    MSA, label, level, year - parts of the task that apply to the stage
+# OUTPUTS:
+#    tuple of strings (stage, MSA, label, level, year)
+def createTaskKey(stage,MSA='',label='',level='',year=''):
+    return((str(stage),str(MSA),str(label),str(level),str(year)))
+
+# fingerprint a set of files using their names, sizes and modification times.  Cheap enough for multi-GB inputs,
+# and changes whenever a file is rewritten
+# INPUTS:
+#    files (string array) - absolute filepaths.  Missing files are included in the fingerprint as missing
+# OUTPUTS:
+#    hex digest string
+def fingerprintFiles(files):
+    parts = []
+    for curFile in sorted(files):
+        if(os.path.exists(curFile)):
+            stats = os.stat(curFile)
+            parts.append([curFile,stats.st_size,stats.st_mtime_ns])
+        else:
+            parts.append([curFile,None,None])
+    return(hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest())
+
+# calculate a checksum of the contents of a set of files
+# INPUTS:
+#    files (string array) - absolute filepaths
+# OUTPUTS:
+#    hex digest string
+def checksumFiles(files):
+    checksum = hashlib.md5()
+    for curFile in sorted(files):
+        checksum.update(curFile.encode('utf-8'))
+        if(os.path.isdir(curFile)):
+            continue
+        with open(curFile,'rb') as f:
+            for block in iter(lambda: f.read(CHECKSUM_BLOCK),b''):
+                checksum.update(block)
+    return(checksum.hexdigest())
+
+# test if a task was completed with the current inputs, and its outputs have not changed since
+# INPUTS:
+#    dbFile (string) - absolute filepath to the manifest
+#    taskKey (tuple) - created by createTaskKey
+#    inputs (string array) - absolute filepaths to the task inputs
+#    outputs (string array) - absolute filepaths to the task outputs
+# OUTPUTS:
+#    true if the task is complete and up to date.  False otherwise
+def isTaskComplete(dbFile,taskKey,inputs,outputs):
+    connection = openManifest(dbFile)
+    try:
+        row = connection.execute(
+            "SELECT input_fingerprint, output_fingerprint FROM tasks WHERE stage=? AND msa=? AND label=? AND level=? AND year=?",
+            taskKey
+        ).fetchone()
+    finally:
+        connection.close()
+    if(row is None):
+        return(False)
+    for curFile in outputs:
+        if not(os.path.exists(curFile)):
+            return(False)
+    return(row[0]==fingerprintFiles(inputs) and row[1]==fingerprintFiles(outputs))
+
+# record a task as complete.  Call only after all outputs have been written and renamed into place
+# INPUTS:
+#    dbFile (string) - absolute filepath to the manifest
+#    taskKey (tuple) - created by createTaskKey
+#    inputs (string array) - absolute filepaths to the task inputs
+#    outputs (string array) - absolute filepaths to the task outputs
+def recordTaskComplete(dbFile,taskKey,inputs,outputs):
+    values = taskKey + (fingerprintFiles(inputs),fingerprintFiles(outputs),checksumFiles(outputs),time.time())
+    connection = openManifest(dbFile)
+    try:
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO tasks VALUES (?,?,?,?,?,?,?,?,?)",values)
+    finally:
+        connection.close()
+
+# remove a task from the manifest, so it will be redone
+# INPUTS:
+#    dbFile (string) - absolute filepath to the manifest
+#    taskKey (tuple) - created by createTaskKey
+def invalidateTask(dbFile,taskKey):
+    connection = openManifest(dbFile)
+    try:
+        with connection:
+            connection.execute("DELETE FROM tasks WHERE stage=? AND msa=? AND label=? AND level=? AND year=?",taskKey)
+    finally:
+        connection.close()
+
+# get a temporary filepath in the same folder as an output, so the finished output can be atomically renamed
+# INPUTS:
+#    outFile (string) - absolute filepath of the final output
+# OUTPUTS:
+#    absolute filepath of the temporary output, with the same file extension
+def getTempPath(outFile):
+    root,extension = os.path.splitext(outFile)
+    return(root + ".tmp" + str(os.getpid()) + extension)
+
+# atomically replace an output with a completed temporary file
+# INPUTS:
+#    tempFile (string) - absolute filepath of the completed temporary output
+#    outFile (string) - absolute filepath of the final output
+def commitTempFile(tempFile,outFile):
+    os.replace(tempFile,outFile)
+
+# write a pandas dataframe to csv through a temporary file, so a crash never leaves a truncated csv in place
+# INPUTS:
+#    df (pandas dataframe) - data to write
+#    outFile (string) - absolute filepath of the csv
+#    **kwargs - additional arguments passed to DataFrame.to_csv
+def writeCSVAtomic(df,outFile,**kwargs):
+    tempFile = getTempPath(outFile)
+    try:
+        df.to_csv(tempFile,**kwargs)
+        commitTempFile(tempFile,outFile)
+    finally:
+        if(os.path.exists(tempFile)):
+            os.remove(tempFile)
@@ -0,0 +1,158 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: open source replacement for arcpy.conversion.PointToRaster with MEAN cell assignment.  Reads the
+#          national georeferenced perception table once, calculates the raster cell of every point once, and
+#          builds the mean grids for all perceptions and comparison levels in a single pass with bincount sums
+#          and counts.  Only cells that contain points are stored in memory, and grids are written as tiled,
+#          compressed, sparse GeoTIFFs, so national grids at 0.0008333 degrees fit in memory on Linux nodes.
+#          Int grids are quantized to uint16 as they are written and stored as Cloud Optimized GeoTIFFs (see
+#          rasterStorage), so no float grid has to be written and converted afterwards.
+
+# import dependencies
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+from rasterStorage import QuantizedRaster
+
+# define global constants
+CELL_SIZE = 0.0008333 # raster cell size in decimal degrees, matches convertPerceptionPointsToRaster
+OUTCOMES = ['be_ci','be_ct','na_ci','na_ct','re_ci','re_ct','sw_ci','sw_ct','sc_ci','sc_ct'] # attribute fields to rasterize
+LON_FIELD = 'imgLon'
+LAT_FIELD = 'imgLat'
+CRS = 'EPSG:4326' # WGS 1984, same as the point geodatabase
+TILE_SIZE = 512 # GeoTIFF tile width and height, in cells
+FLOAT_NODATA = -9999.0 # NoData value of mean grids
+COMPRESSION = 'deflate'
+COMPRESSION_LEVEL = 1 # deflate level, sparse grids are mostly NoData and compress well at the fastest level
+
+# define a raster grid that covers a set of points, using the extent of the points like PointToRaster
+# INPUTS:
+#    lon, lat (float arrays) - point coordinates in decimal degrees
+#    cellSize (float) - cell size in decimal degrees
+# OUTPUTS:
+#    grid (dictionary) - xmin, ymax, cellSize, ncols, and nrows of the grid
+def createGrid(lon,lat,cellSize=CELL_SIZE):
+    xmin, xmax = float(np.min(lon)), float(np.max(lon))
+    ymin, ymax = float(np.min(lat)), float(np.max(lat))
+    return({
+        'xmin':xmin,
+        'ymax':ymax,
+        'cellSize':cellSize,
+        'ncols':max(int(np.ceil((xmax - xmin)/cellSize)),1),
+        'nrows':max(int(np.ceil((ymax - ymin)/cellSize)),1)
+    })
+
+# calculate the flat cell index (row * ncols + col) of each point.  Points on the right or bottom edge of the
+# grid are assigned to the last column or row
+# INPUTS:
+#    lon, lat (float arrays) - point coordinates in decimal degrees
+#    grid (dictionary) - created by createGrid
+# OUTPUTS:
+#    cellIndex (int64 array) - flat cell index of each point, -1 for points outside the grid
+def computeCellIndices(lon,lat,grid):
+    col = np.floor((np.asarray(lon) - grid['xmin'])/grid['cellSize']).astype(np.int64)
+    row = np.floor((grid['ymax'] - np.asarray(lat))/grid['cellSize']).astype(np.int64)
+    col[col==grid['ncols']] = grid['ncols'] - 1
+    row[row==grid['nrows']] = grid['nrows'] - 1
+    inside = (col>=0) & (col<grid['ncols']) & (row>=0) & (row<grid['nrows'])
+    return(np.where(inside,row*grid['ncols'] + col,-1))
+
+# calculate the mean value of each outcome in each cell that contains at least one point.  Points are grouped
+# by cell once, and each outcome is summed and counted with bincount over the occupied cells only
+# INPUTS:
+#    cellIndex (int64 array) - flat cell index of each point, -1 for points outside the grid
+#    values (2d float array) - shape (n points, n outcomes)
+# OUTPUTS:
+#    cells (int64 array) - sorted flat indices of occupied cells
+#    means (2d float64 array) - shape (n occupied cells, n outcomes), NaN where a cell has no values for an outcome
+def accumulateMeans(cellIndex,values):
+    inside = cellIndex>=0
+    cells, inverse = np.unique(cellIndex[inside],return_inverse=True)
+    values = np.asarray(values,dtype=np.float64)[inside]
+    means = np.full((len(cells),values.shape[1]),np.nan)
+    for outcome in range(values.shape[1]):
+        valid = ~np.isnan(values[:,outcome])
+        sums = np.bincount(inverse[valid],weights=values[valid,outcome],minlength=len(cells))
+        counts = np.bincount(inverse[valid],minlength=len(cells))
+        np.divide(sums,counts,out=means[:,outcome],where=counts>0)
+    return(cells,means)
+
+# open a tiled, compressed GeoTIFF for writing.  Tiles that are never written are left out of the file and
+# read as NoData
+# INPUTS:
+#    outFile (string) - absolute filepath of the GeoTIFF
+#    grid (dictionary) - created by createGrid
+#    dtype (string) - raster data type
+#    nodata (number) - NoData value
+# OUTPUTS:
+#    rasterio dataset opened for writing
+def openGrid(outFile,grid,dtype,nodata):
+    return(rasterio.open(
+        outFile,'w',driver='GTiff',
+        width=grid['ncols'],height=grid['nrows'],count=1,dtype=dtype,nodata=nodata,crs=CRS,
+        transform=from_origin(grid['xmin'],grid['ymax'],grid['cellSize'],grid['cellSize']),
+        tiled=True,blockxsize=TILE_SIZE,blockysize=TILE_SIZE,compress=COMPRESSION,sparse_ok=True,
+        BIGTIFF='IF_SAFER',ZLEVEL=COMPRESSION_LEVEL,NUM_THREADS='ALL_CPUS'
+    ))
+
+# write mean grids one tile at a time.  Only tiles that contain occupied cells are filled and written
+# INPUTS:
+#    cells (int64 array) - sorted flat indices of occupied cells
+#    means (2d float array) - shape (n occupied cells, n outcomes)
+#    grid (dictionary) - created by createGrid
+#    floatFiles (string array) - optional, absolute filepaths of the float32 mean grids, one per outcome
+#    intFiles (string array) - optional, absolute filepaths of the quantized uint16 COGs, one per outcome.  Means
+#                              are truncated toward zero, the same as arcpy.sa.Int
+def writeGrids(cells,means,grid,floatFiles=None,intFiles=None):
+    floatFiles, intFiles = floatFiles or [], intFiles or []
+    transform = from_origin(grid['xmin'],grid['ymax'],grid['cellSize'],grid['cellSize'])
+    datasets = [openGrid(outFile,grid,'float32',FLOAT_NODATA) for outFile in floatFiles]
+    datasets += [QuantizedRaster(outFile,CRS,transform,grid['ncols'],grid['nrows']) for outFile in intFiles]
+    try:
+        # group occupied cells by tile
+        rows, cols = cells // grid['ncols'], cells % grid['ncols']
+        nTileCols = -(-grid['ncols'] // TILE_SIZE)
+        tiles = (rows // TILE_SIZE)*nTileCols + cols // TILE_SIZE
+        order = np.argsort(tiles,kind='stable')
+        tileIds, starts = np.unique(tiles[order],return_index=True)
+        ends = np.append(starts[1:],len(order))
+        for tileId,start,end in zip(tileIds.tolist(),starts.tolist(),ends.tolist()):
+            members = order[start:end]
+            rowOff, colOff = (tileId // nTileCols)*TILE_SIZE, (tileId % nTileCols)*TILE_SIZE
+            window = Window(colOff,rowOff,min(TILE_SIZE,grid['ncols'] - colOff),min(TILE_SIZE,grid['nrows'] - rowOff))
+            tileRows, tileCols = rows[members] - rowOff, cols[members] - colOff
+            for outcome in range(len(floatFiles)):
+                tile = np.full((window.height,window.width),FLOAT_NODATA,dtype=np.float32)
+                values = means[members,outcome]
+                valid = ~np.isnan(values)
+                tile[tileRows[valid],tileCols[valid]] = values[valid]
+                datasets[outcome].write(tile,1,window=window)
+            for outcome in range(len(intFiles)):
+                tile = np.full((window.height,window.width),np.nan)
+                tile[tileRows,tileCols] = means[members,outcome]
+                datasets[len(floatFiles) + outcome].write(tile,window=window)
+    except BaseException:
+        # incomplete grids are not converted into COGs
+        for dataset in datasets[len(floatFiles):]:
+            dataset.discard()
+        raise
+    finally:
+        for dataset in datasets:
+            dataset.close()
+
+# create MEAN grids for all outcomes from a table of points in a single pass
+# INPUTS:
+#    pointData (pandas dataframe) - points with LON_FIELD, LAT_FIELD, and one column per outcome
+#    outcomes (string array) - outcome columns to rasterize
+#    floatFiles (string array) - optional, absolute filepaths of the float32 mean grids, one per outcome
+#    intFiles (string array) - optional, absolute filepaths of the quantized uint16 COGs, one per outcome
+#    cellSize (float) - cell size in decimal degrees
+# OUTPUTS:
+#    grid (dictionary) - grid the outcomes were rasterized to
+def rasterizePoints(pointData,outcomes=OUTCOMES,floatFiles=None,intFiles=None,cellSize=CELL_SIZE):
+    lon, lat = pointData[LON_FIELD].values, pointData[LAT_FIELD].values
+    grid = createGrid(lon,lat,cellSize)
+    cells, means = accumulateMeans(computeCellIndices(lon,lat,grid),pointData[outcomes].values)
+    writeGrids(cells,means,grid,floatFiles,intFiles)
+    return(grid)
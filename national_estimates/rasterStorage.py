@@ -0,0 +1,190 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: storage of the national perception rasters.  Values are quantized to uint16 on the 0 to 1000
+#          perception scale as tiles are written, with a reserved NoData value outside the scale, so no float
+#          raster has to be written and converted to int afterwards.  Completed rasters are stored as tiled,
+#          compressed Cloud Optimized GeoTIFFs (COGs) with internal overview pyramids, so map viewers and point
+#          samplers only read the tiles and zoom levels they need.  Also holds the grid, tile window, and open
+#          raster helpers shared by the scripts that read perception rasters one tile at a time.
+# Note: GDAL can only create COGs by copying a completed raster, so tiles are first written to a sparse working
+#       GeoTIFF next to the output.  The working raster is already quantized, so the copy moves compressed
+#       uint16 tiles rather than float values
+
+# import dependencies
+import numpy as np
+import collections
+import os
+try:
+    import rasterio
+    import rasterio.shutil
+except ImportError:
+    # arcpy workers only use the quantization constants
+    rasterio = None
+
+# define global constants
+RASTER_DTYPE = 'uint16' # data type of all perception rasters
+RASTER_NODATA = 65535 # reserved NoData value, outside of the perception scale
+SCALE_MIN = 0 # lowest perception value
+SCALE_MAX = 1000 # highest perception value.  TS scores (0 to 100) are multiplied by 10 in createPerceptionGeoDatabase
+BLOCK_SIZE = 512 # GeoTIFF tile width and height, in cells
+COMPRESSION = 'deflate'
+WORK_COMPRESSION_LEVEL = 1 # deflate level of working rasters, sparse rasters are mostly NoData and compress well at the fastest level
+COG_COMPRESSION_LEVEL = 6 # deflate level of COGs, which are written once and read many times
+COG_PREDICTOR = 'NO' # horizontal differencing ('YES') compresses smooth buffer rasters slightly better, but sparse point rasters are larger with it
+OVERVIEW_RESAMPLING = 'AVERAGE' # overview cells are the mean of the cells with data
+WORK_SUFFIX = ".work" # added to the filename of working rasters
+MAX_OPEN_SOURCES = 64 # rasters kept open by getSource in each process.  The least recently used raster is closed first
+openSources = collections.OrderedDict() # kv pairs of filepath:(modification time, rasterio dataset) opened by getSource
+
+# custom class for writing a quantized perception raster one tile at a time.  Tiles that are never written are
+# left out of the file and read as NoData.  When the raster is closed, the working raster is copied into a COG
+# with internal overviews at outFile, unless cog is false (e.g. for intermediate rasters)
+class QuantizedRaster:
+
+    # INPUTS:
+    #    outFile (string) - absolute filepath of the raster
+    #    crs (rasterio CRS or string) - coordinate system
+    #    transform (affine) - geotransform
+    #    width, height (int) - raster shape
+    #    cog (boolean) - if true, the raster is stored as a COG with internal overviews
+    def __init__(self,outFile,crs,transform,width,height,cog=True):
+        self.outFile = outFile
+        self.cog = cog
+        self.path = getWorkPath(outFile) if cog else outFile
+        self.dataset = rasterio.open(
+            self.path,'w',driver='GTiff',width=width,height=height,count=1,dtype=RASTER_DTYPE,nodata=RASTER_NODATA,
+            crs=crs,transform=transform,tiled=True,blockxsize=BLOCK_SIZE,blockysize=BLOCK_SIZE,
+            compress=COMPRESSION,ZLEVEL=WORK_COMPRESSION_LEVEL,sparse_ok=True,BIGTIFF='IF_SAFER'
+        )
+
+    def __enter__(self):
+        return(self)
+
+    # discard the working raster if writing failed
+    def __exit__(self,excType,excValue,traceback):
+        if(excType is None):
+            self.close()
+        else:
+            self.discard()
+        return(False)
+
+    # quantize and write a window of float values.  NaN values are NoData
+    # INPUTS:
+    #    values (2d float array) - values on the perception scale
+    #    window (rasterio Window) - location of the values in the raster
+    def write(self,values,window):
+        self.dataset.write(quantize(values),1,window=window)
+
+    # write a window of values that were already quantized
+    # INPUTS:
+    #    values (2d uint16 array) - created by quantize
+    #    window (rasterio Window) - location of the values in the raster
+    def writeQuantized(self,values,window):
+        self.dataset.write(values,1,window=window)
+
+    # close the raster and remove the file without creating a COG, e.g. after an error
+    def discard(self):
+        self.dataset.close()
+        if(os.path.exists(self.path)):
+            os.remove(self.path)
+
+    # close the raster, and store it as a COG if cog is true
+    def close(self):
+        if(self.dataset.closed):
+            return
+        self.dataset.close()
+        if(self.cog):
+            writeCOG(self.path,self.outFile)
+            os.remove(self.path)
+
+# quantize values on the perception scale to uint16.  Values are truncated toward zero, the same as
+# arcpy.sa.Int, and clipped to the perception scale
+# INPUTS:
+#    values (float array) - values on the perception scale, NaN for NoData
+# OUTPUTS:
+#    uint16 array, RASTER_NODATA where values are NaN
+def quantize(values):
+    values = np.asarray(values,dtype=np.float64)
+    output = np.full(values.shape,RASTER_NODATA,dtype=np.uint16)
+    hasData = ~np.isnan(values)
+    output[hasData] = np.clip(np.trunc(values[hasData]),SCALE_MIN,SCALE_MAX).astype(np.uint16)
+    return(output)
+
+# get the filepath of the working raster that tiles are written to before a COG is created
+# INPUTS:
+#    outFile (string) - absolute filepath of the COG
+# OUTPUTS:
+#    absolute filepath of the working raster
+def getWorkPath(outFile):
+    root,extension = os.path.splitext(outFile)
+    return(root + WORK_SUFFIX + extension)
+
+# copy a tiled GeoTIFF into a COG with internal overviews.  Overviews are added until the smallest overview
+# fits in a single tile, and empty tiles stay out of the file
+# INPUTS:
+#    inFile (string) - absolute filepath of the tiled GeoTIFF
+#    outFile (string) - absolute filepath of the COG
+def writeCOG(inFile,outFile):
+    rasterio.shutil.copy(
+        inFile,outFile,driver='COG',BLOCKSIZE=BLOCK_SIZE,COMPRESS=COMPRESSION.upper(),LEVEL=COG_COMPRESSION_LEVEL,
+        PREDICTOR=COG_PREDICTOR,OVERVIEWS='AUTO',OVERVIEW_RESAMPLING=OVERVIEW_RESAMPLING,SPARSE_OK='TRUE',
+        BIGTIFF='IF_SAFER',NUM_THREADS='ALL_CPUS'
+    )
+
+# get the grid of a raster.  Rasters on the same grid have equal grids
+# INPUTS:
+#    inFile (string) - absolute filepath of the raster
+# OUTPUTS:
+#    tuple of (crs, transform, width, height)
+def getGrid(inFile):
+    with rasterio.open(inFile) as src:
+        return((src.crs,src.transform,src.width,src.height))
+
+# get the grid of a raster, along with the shape of its internal GeoTIFF tiles.  Used to group reads of a raster
+# by the tiles that are decompressed
+# INPUTS:
+#    inFile (string) - absolute filepath of the raster
+# OUTPUTS:
+#    tuple of (crs, transform, width, height, tile height, tile width)
+def getTiledGrid(inFile):
+    with rasterio.open(inFile) as src:
+        tileHeight,tileWidth = src.block_shapes[0]
+        return((src.crs,src.transform,src.width,src.height,tileHeight,tileWidth))
+
+# split a grid into tile windows
+# INPUTS:
+#    width, height (int) - grid shape
+#    tileSize (int) - width and height of each tile
+# OUTPUTS:
+#    list of (colOff, rowOff, width, height) tuples
+def getTileWindows(width,height,tileSize):
+    return([
+        (colOff,rowOff,min(tileSize,width - colOff),min(tileSize,height - rowOff))
+        for rowOff in range(0,height,tileSize) for colOff in range(0,width,tileSize)
+    ])
+
+# get an open raster, reusing the dataset opened for earlier tiles.  Rasters are reopened if the file has
+# changed since they were opened, and at most MAX_OPEN_SOURCES rasters are kept open
+# INPUTS:
+#    inFile (string) - absolute filepath of the raster
+# OUTPUTS:
+#    rasterio dataset opened for reading
+def getSource(inFile):
+    modified = os.stat(inFile).st_mtime_ns
+    if(inFile in openSources):
+        openedModified,dataset = openSources.pop(inFile)
+        if(openedModified==modified):
+            openSources[inFile] = (openedModified,dataset)
+            return(dataset)
+        dataset.close()
+    while(len(openSources) >= MAX_OPEN_SOURCES):
+        openSources.popitem(last=False)[1][1].close()
+    openSources[inFile] = (modified,rasterio.open(inFile))
+    return(openSources[inFile][1])
+
+# close the rasters opened by getSource in the current process.  Open datasets must not be inherited by CPU
+# workers forked later, since they would share file handles
+def closeSources():
+    for modified,dataset in openSources.values():
+        dataset.close()
+    openSources.clear()
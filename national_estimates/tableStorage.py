@@ -0,0 +1,367 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: storage layer for tables passed between stages of the national pipeline.  Tables are stored as typed,
+#          compressed Parquet files if pyarrow is installed, or as csv files otherwise.  Tables can be stored as
+#          a dataset partitioned into folders (e.g. rasterYear=2008/MSA=10420/), and read with column projection
+#          and predicate pushdown, so later stages only parse the rows and columns they need.
+
+# import dependencies
+import pandas as ps
+import itertools
+import os
+from pipelineManifest import getTempPath, commitTempFile
+from telemetry import timeStage
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.csv as pcsv
+    PARQUET_AVAILABLE = True
+except ImportError:
+    # without pyarrow all tables are stored as csv files
+    PARQUET_AVAILABLE = False
+
+# define global constants
+DEFAULT_FORMAT = 'parquet' if PARQUET_AVAILABLE else 'csv' # 'parquet' or 'csv'
+FILE_EXTENSIONS = {'parquet':'.parquet','csv':'.csv'}
+COMPRESSION = 'zstd' # Parquet compression codec
+PARTITION_FILENAME = "part" # filename (without extension) of the table stored in each partition folder
+ROW_GROUP_ROWS = 1000000 # number of rows buffered before a chunked table appends a Parquet row group
+
+# get the filepath of a table
+# INPUTS:
+#    basePath (string) - absolute filepath of the table, without file extension
+#    storageFormat (string) - 'parquet' or 'csv'
+# OUTPUTS:
+#    absolute filepath including the file extension
+def getTablePath(basePath,storageFormat=DEFAULT_FORMAT):
+    if(storageFormat not in FILE_EXTENSIONS):
+        raise ValueError("unknown storage format %s" %(storageFormat))
+    if(storageFormat=='parquet' and not PARQUET_AVAILABLE):
+        raise ImportError("pyarrow is required to store tables as Parquet")
+    return(basePath + FILE_EXTENSIONS[storageFormat])
+
+# write a table through a temporary file, so a crash never leaves a partial table in place
+# INPUTS:
+#    df (pandas dataframe) - table to write
+#    basePath (string) - absolute filepath of the table, without file extension
+#    storageFormat (string) - 'parquet' or 'csv'
+# OUTPUTS:
+#    absolute filepath of the written table
+def writeTable(df,basePath,storageFormat=DEFAULT_FORMAT):
+    outFile = getTablePath(basePath,storageFormat)
+    tempFile = getTempPath(outFile)
+    try:
+        with timeStage('write',table=outFile) as timer:
+            if(storageFormat=='parquet'):
+                df.to_parquet(tempFile,index=False,compression=COMPRESSION)
+            else:
+                df.to_csv(tempFile,index=False)
+            commitTempFile(tempFile,outFile)
+            timer.count(rows=len(df))
+    finally:
+        if(os.path.exists(tempFile)):
+            os.remove(tempFile)
+    return(outFile)
+
+# write a table from a sequence of chunks, without holding the whole table in memory.  Chunks are buffered
+# until they reach rowGroupRows rows, then appended as a Parquet row group or as csv rows to every requested
+# format in a single pass over the chunks.  Tables are written through temporary files, so a crash never leaves
+# a partial table in place
+# INPUTS:
+#    chunks (iterable of pandas dataframes) - chunks of the table, with the same columns.  Parquet row groups
+#                                             are cast to the types of the first row group
+#    basePath (string) - absolute filepath of the table, without file extension
+#    storageFormats (string array) - formats to write, 'parquet' and/or 'csv'
+#    rowGroupRows (int) - number of rows buffered before they are written
+# OUTPUTS:
+#    list of absolute filepaths of the written tables
+def writeTableChunks(chunks,basePath,storageFormats=[DEFAULT_FORMAT],rowGroupRows=ROW_GROUP_ROWS):
+    outFiles = [getTablePath(basePath,storageFormat) for storageFormat in storageFormats]
+    tempFiles = [getTempPath(outFile) for outFile in outFiles]
+    writers = [None]*len(storageFormats)
+    buffer, nBuffered, nWritten = [], 0, 0
+    # only time spent writing is recorded, not time spent creating the chunks
+    timer = timeStage('write',table=outFiles[0])
+    try:
+        # a final None flushes the rows remaining in the buffer
+        for chunk in itertools.chain(chunks,[None]):
+            if(chunk is not None and len(chunk)>0):
+                buffer.append(chunk)
+                nBuffered += len(chunk)
+            if(nBuffered==0 or (chunk is not None and nBuffered<rowGroupRows)):
+                continue
+            with timer.lap():
+                rowGroup = ps.concat(buffer,ignore_index=True) if len(buffer)>1 else buffer[0]
+                for index,storageFormat in enumerate(storageFormats):
+                    if(storageFormat=='parquet'):
+                        if(writers[index] is None):
+                            table = pa.Table.from_pandas(rowGroup,preserve_index=False)
+                            writers[index] = pq.ParquetWriter(tempFiles[index],table.schema,compression=COMPRESSION)
+                        else:
+                            table = pa.Table.from_pandas(rowGroup,schema=writers[index].schema,preserve_index=False)
+                        writers[index].write_table(table)
+                    else:
+                        rowGroup.to_csv(tempFiles[index],index=False,header=nWritten==0,mode='w' if nWritten==0 else 'a')
+            timer.count(rows=nBuffered)
+            nWritten += nBuffered
+            buffer, nBuffered = [], 0
+        for writer in writers:
+            if(writer is not None):
+                writer.close()
+        writers = [None]*len(storageFormats)
+        # tables without rows are written as empty tables
+        if(nWritten==0):
+            for storageFormat in storageFormats:
+                writeTable(ps.DataFrame(),basePath,storageFormat)
+            return(outFiles)
+        for tempFile,outFile in zip(tempFiles,outFiles):
+            commitTempFile(tempFile,outFile)
+    finally:
+        for writer in writers:
+            if(writer is not None):
+                writer.close()
+        for tempFile in tempFiles:
+            if(os.path.exists(tempFile)):
+                os.remove(tempFile)
+    return(outFiles)
+
+# concatenate table files with the same columns into a single table, e.g. the partitions of a partitioned
+# dataset.  Parquet files are copied as Arrow record batches into every requested format, without converting
+# rows to pandas dataframes.  Batches are buffered until they reach rowGroupRows rows, and cast to the types of
+# the first non-empty file.  Csv files are read one file at a time and written with writeTableChunks
+# INPUTS:
+#    inFiles (string array) - absolute filepaths of the table files to concatenate
+#    basePath (string) - absolute filepath of the table, without file extension
+#    storageFormats (string array) - formats to write, 'parquet' and/or 'csv'
+#    inFormat (string) - format of the table files, 'parquet' or 'csv'
+#    rowGroupRows (int) - number of rows buffered before they are written
+# OUTPUTS:
+#    list of absolute filepaths of the written tables
+def concatTableFiles(inFiles,basePath,storageFormats=[DEFAULT_FORMAT],inFormat=DEFAULT_FORMAT,rowGroupRows=ROW_GROUP_ROWS):
+    if(inFormat!='parquet'):
+        return(writeTableChunks((readTableFile(inFile,inFormat) for inFile in inFiles),basePath,storageFormats,rowGroupRows))
+    outFiles = [getTablePath(basePath,storageFormat) for storageFormat in storageFormats]
+    tempFiles = [getTempPath(outFile) for outFile in outFiles]
+    writers = [None]*len(storageFormats)
+    schema, buffer, nBuffered, nWritten = None, [], 0, 0
+    timer = timeStage('write',table=outFiles[0])
+    try:
+        # a final None flushes the rows remaining in the buffer.  Empty files are skipped, since partitions
+        # without rows may not store column types
+        for inFile in itertools.chain(inFiles,[None]):
+            if(inFile is not None):
+                parquetFile = pq.ParquetFile(inFile)
+                if(parquetFile.metadata.num_rows==0):
+                    continue
+                if(schema is None):
+                    schema = parquetFile.schema_arrow.remove_metadata()
+                for batch in parquetFile.iter_batches():
+                    buffer.append(batch)
+                    nBuffered += batch.num_rows
+            if(nBuffered==0 or (inFile is not None and nBuffered<rowGroupRows)):
+                continue
+            with timer.lap():
+                rowGroup = pa.Table.from_batches(buffer).select(schema.names).cast(schema)
+                for index,storageFormat in enumerate(storageFormats):
+                    if(writers[index] is None and storageFormat=='parquet'):
+                        writers[index] = pq.ParquetWriter(tempFiles[index],schema,compression=COMPRESSION)
+                    elif(writers[index] is None):
+                        writers[index] = pcsv.CSVWriter(tempFiles[index],schema)
+                    writers[index].write_table(rowGroup)
+            timer.count(rows=nBuffered)
+            nWritten += nBuffered
+            buffer, nBuffered = [], 0
+        for writer in writers:
+            if(writer is not None):
+                writer.close()
+        writers = [None]*len(storageFormats)
+        # tables without rows are written as empty tables
+        if(nWritten==0):
+            for storageFormat in storageFormats:
+                writeTable(ps.DataFrame(),basePath,storageFormat)
+            return(outFiles)
+        for tempFile,outFile in zip(tempFiles,outFiles):
+            commitTempFile(tempFile,outFile)
+    finally:
+        for writer in writers:
+            if(writer is not None):
+                writer.close()
+        for tempFile in tempFiles:
+            if(os.path.exists(tempFile)):
+                os.remove(tempFile)
+    return(outFiles)
+
+# apply filters to a pandas dataframe
+# INPUTS:
+#    df (pandas dataframe) - table to filter
+#    filters (list of tuples) - (column, operator, value) tuples that must all be true.  Operators are
+#                               '=', '==', '!=', '<', '<=', '>', '>=', and 'in'
+# OUTPUTS:
+#    filtered pandas dataframe
+def applyFilters(df,filters):
+    for column,operator,value in filters:
+        if(operator in ['=','==']):
+            df = df[df[column]==value]
+        elif(operator=='!='):
+            df = df[df[column]!=value]
+        elif(operator=='<'):
+            df = df[df[column]<value]
+        elif(operator=='<='):
+            df = df[df[column]<=value]
+        elif(operator=='>'):
+            df = df[df[column]>value]
+        elif(operator=='>='):
+            df = df[df[column]>=value]
+        elif(operator=='in'):
+            df = df[df[column].isin(value)]
+        else:
+            raise ValueError("unknown filter operator %s" %(operator))
+    return(df)
+
+# read a table.  Csv files are filtered after parsing, while Parquet files skip row groups that cannot match
+# INPUTS:
+#    basePath (string) - absolute filepath of the table, without file extension
+#    storageFormat (string) - 'parquet' or 'csv'
+#    columns (string array) - optional, columns to read.  All columns are read by default
+#    filters (list of tuples) - optional, (column, operator, value) tuples that rows must match
+#    dtype (dictionary) - optional, column dtypes for csv files.  Parquet files store dtypes
+# OUTPUTS:
+#    pandas dataframe
+def readTable(basePath,storageFormat=DEFAULT_FORMAT,columns=None,filters=None,dtype=None):
+    inFile = getTablePath(basePath,storageFormat)
+    return(readTableFile(inFile,storageFormat,columns,filters,dtype))
+
+# read a single table file.  See readTable
+def readTableFile(inFile,storageFormat,columns=None,filters=None,dtype=None):
+    with timeStage('read',table=inFile) as timer:
+        if(storageFormat=='parquet'):
+            df = pq.read_table(inFile,columns=columns,filters=filters or None).to_pandas()
+        else:
+            df = ps.read_csv(inFile,usecols=columns,dtype=dtype)
+            if(filters):
+                df = applyFilters(df,filters)
+        timer.count(rows=len(df))
+    return(df)
+
+# get the folder of a single partition of a partitioned dataset
+# INPUTS:
+#    folder (string) - absolute folderpath of the dataset
+#    partitions (list of tuples) - (column, value) pairs that identify the partition, outermost folder first
+# OUTPUTS:
+#    absolute folderpath of the partition
+def getPartitionFolder(folder,partitions):
+    return(folder + "".join([str(column) + "=" + str(value) + "/" for column,value in partitions]))
+
+# write a single partition of a partitioned dataset.  Partition columns are stored in the folder names only
+# INPUTS:
+#    df (pandas dataframe) - rows of the partition
+#    folder (string) - absolute folderpath of the dataset
+#    partitions (list of tuples) - (column, value) pairs that identify the partition, outermost folder first
+#    storageFormat (string) - 'parquet' or 'csv'
+# OUTPUTS:
+#    absolute filepath of the written partition
+def writePartition(df,folder,partitions,storageFormat=DEFAULT_FORMAT):
+    partitionFolder = getPartitionFolder(folder,partitions)
+    os.makedirs(partitionFolder,exist_ok=True)
+    partitionColumns = [column for column,value in partitions if column in df.columns]
+    return(writeTable(df.drop(partitionColumns,axis=1),partitionFolder + PARTITION_FILENAME,storageFormat))
+
+# parse the partition values of a partition folder
+# INPUTS:
+#    relativeFolder (string) - partition folderpath relative to the dataset folder (e.g. 'rasterYear=2008/MSA=10420')
+# OUTPUTS:
+#    dictionary of kv pairs partition column:value (string)
+def parsePartitionFolder(relativeFolder):
+    values = {}
+    for part in relativeFolder.replace("\\","/").split("/"):
+        if("=" in part):
+            column,value = part.split("=",1)
+            values[column] = value
+    return(values)
+
+# convert a partition value parsed from a folder name into an int if possible, matching the type of integer
+# partition columns (e.g. rasterYear) before they were written
+# INPUTS:
+#    value (string) - partition value
+# OUTPUTS:
+#    int or string
+def convertPartitionValue(value):
+    if(value.lstrip('-').isdigit()):
+        return(int(value))
+    return(value)
+
+# test if partition values can match a set of filters.  Filters on columns that are not partition columns
+# always match, and are applied when rows are read
+# INPUTS:
+#    values (dictionary) - kv pairs partition column:value (string)
+#    filters (list of tuples) - (column, operator, value) tuples
+# OUTPUTS:
+#    true if rows in the partition may match the filters
+def matchPartition(values,filters):
+    for column,operator,value in filters or []:
+        if(column not in values):
+            continue
+        if(operator in ['=','=='] and values[column]!=str(value)):
+            return(False)
+        if(operator=='!=' and values[column]==str(value)):
+            return(False)
+        if(operator=='in' and values[column] not in [str(curValue) for curValue in value]):
+            return(False)
+    return(True)
+
+# list the partition files in a partitioned dataset, skipping partitions that cannot match the filters
+# INPUTS:
+#    folder (string) - absolute folderpath of the dataset
+#    storageFormat (string) - 'parquet' or 'csv'
+#    filters (list of tuples) - optional, (column, operator, value) tuples
+# OUTPUTS:
+#    list of (absolute filepath, partition values) tuples, sorted by filepath
+def listPartitions(folder,storageFormat=DEFAULT_FORMAT,filters=None):
+    filename = getTablePath(PARTITION_FILENAME,storageFormat)
+    partitions = []
+    for curFolder,subFolders,files in os.walk(folder):
+        # prune partition folders that cannot match the filters before walking into them
+        subFolders[:] = sorted([
+            subFolder for subFolder in subFolders
+            if matchPartition(parsePartitionFolder(os.path.relpath(os.path.join(curFolder,subFolder),folder)),filters)
+        ])
+        if(filename in files and curFolder!=os.path.normpath(folder)):
+            values = parsePartitionFolder(os.path.relpath(curFolder,folder))
+            if(len(values)>0 and matchPartition(values,filters)):
+                partitions.append((os.path.join(curFolder,filename),values))
+    return(sorted(partitions))
+
+# read rows from a partitioned dataset.  Partitions that cannot match the filters are not opened, and only the
+# requested columns are parsed.  Partition columns are added back to the rows
+# INPUTS:
+#    folder (string) - absolute folderpath of the dataset
+#    storageFormat (string) - 'parquet' or 'csv'
+#    columns (string array) - optional, columns to read, may include partition columns
+#    filters (list of tuples) - optional, (column, operator, value) tuples that rows must match
+#    dtype (dictionary) - optional, column dtypes for csv files
+# OUTPUTS:
+#    pandas dataframe, or None if no partitions match
+def readPartitions(folder,storageFormat=DEFAULT_FORMAT,columns=None,filters=None,dtype=None):
+    dataFrames = []
+    for inFile,values in listPartitions(folder,storageFormat,filters):
+        fileColumns = None if columns is None else [column for column in columns if column not in values]
+        fileFilters = [curFilter for curFilter in filters or [] if curFilter[0] not in values]
+        df = readTableFile(inFile,storageFormat,fileColumns,fileFilters,dtype)
+        for column,value in values.items():
+            if(columns is None or column in columns):
+                df[column] = convertPartitionValue(value)
+        dataFrames.append(df)
+    if(len(dataFrames)==0):
+        return(None)
+    return(ps.concat(dataFrames,ignore_index=True))
+
+# export a table to csv, e.g. as the final step of the pipeline.  Csv tables are left in place
+# INPUTS:
+#    basePath (string) - absolute filepath of the table, without file extension
+#    storageFormat (string) - format the table is stored in
+# OUTPUTS:
+#    absolute filepath of the csv
+def exportTableToCSV(basePath,storageFormat=DEFAULT_FORMAT):
+    if(storageFormat=='csv'):
+        return(getTablePath(basePath,'csv'))
+    return(writeTable(readTable(basePath,storageFormat),basePath,'csv'))
@@ -0,0 +1,254 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: stage timers, counters, and memory sampling for long national runs.  Each completed stage (e.g.
+#          parse, shuffle, rating update, conversion to a dataframe, merge, write) is appended to a telemetry file
+#          as one JSON line with its duration, counts, throughput, and the memory of the process that ran it.
+#          Every process also samples its memory in the background.  The telemetry file can be summarized into a
+#          Prometheus-style text file while a run is in progress.  Telemetry is off unless a telemetry file is set,
+#          and when off every timer is a shared no-op object.
+
+# import dependencies
+import pandas as ps
+import threading
+import socket
+import json
+import time
+import sys
+import os
+from pipelineManifest import getTempPath, commitTempFile
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# define global constants
+TELEMETRY_ENV = 'NSV_TELEMETRY_FILE' # environment variable with the telemetry file, inherited by CPU workers
+RSS_INTERVAL = 30 # seconds between background memory samples in each process
+PROMETHEUS_SUFFIX = ".prom" # suffix of the Prometheus-style summary written next to the telemetry file
+METRIC_PREFIX = "nsv_" # prefix of Prometheus metric names
+processState = {'pid':None,'sampler':None} # per-process state, reset in CPU workers after a fork
+
+# custom class for timing one stage of the pipeline.  A timer can be used once as a context manager, or
+# accumulate time over several laps (e.g. one lap per chunk) before its record is written
+class StageTimer:
+
+    # INPUTS:
+    #    stage (string) - name of the stage (e.g. 'parse')
+    #    labels (dictionary) - kv pairs identifying the work done in the stage (e.g. MSA, input file)
+    def __init__(self,stage,labels):
+        self.stage = stage
+        self.labels = labels
+        self.counts = {}
+        self.seconds = 0.0
+        self.lapStart = None
+
+    def __enter__(self):
+        self.lapStart = time.perf_counter()
+        return(self)
+
+    def __exit__(self,errorType,error,trace):
+        self.seconds += time.perf_counter() - self.lapStart
+        if(errorType is None):
+            self.record()
+
+    # time one lap of the stage without writing a record
+    def lap(self):
+        return(StageLap(self))
+
+    # add to the counters of the stage
+    # INPUTS:
+    #    counts (kv pairs) - counter names and increments (e.g. rows=1000000)
+    def count(self,**counts):
+        for name,value in counts.items():
+            self.counts[name] = self.counts.get(name,0) + int(value)
+
+    # write the record of the stage to the telemetry file
+    def record(self):
+        rates = {}
+        for name,value in self.counts.items():
+            if(self.seconds>0):
+                rates[name + "_per_second"] = value/self.seconds
+        writeRecord({
+            'stage':self.stage,
+            'seconds':self.seconds,
+            'counts':self.counts,
+            'rates':rates,
+            'labels':self.labels
+        })
+
+# context manager for one lap of a StageTimer
+class StageLap:
+
+    def __init__(self,timer):
+        self.timer = timer
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return(self.timer)
+
+    def __exit__(self,errorType,error,trace):
+        self.timer.seconds += time.perf_counter() - self.start
+
+# timer used when telemetry is off.  Every method returns immediately
+class NullTimer:
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self,errorType,error,trace):
+        return(None)
+
+    def lap(self):
+        return(self)
+
+    def count(self,**counts):
+        return(None)
+
+    def record(self):
+        return(None)
+
+NULL_TIMER = NullTimer()
+
+# turn telemetry on for the current process and every CPU worker it starts.  If outFile is None, telemetry stays
+# on only if the NSV_TELEMETRY_FILE environment variable is already set
+# INPUTS:
+#    outFile (string) - absolute filepath of the JSON lines telemetry file
+def configureTelemetry(outFile):
+    if(outFile is not None):
+        os.environ[TELEMETRY_ENV] = outFile
+
+# get the telemetry file of the current process
+# OUTPUTS:
+#    absolute filepath of the telemetry file, or None if telemetry is off
+def getTelemetryFile():
+    return(os.environ.get(TELEMETRY_ENV))
+
+# create a timer for one stage of the pipeline
+# INPUTS:
+#    stage (string) - name of the stage
+#    labels (kv pairs) - values identifying the work done in the stage (e.g. MSA='Portland')
+# OUTPUTS:
+#    StageTimer, or NULL_TIMER if telemetry is off
+def timeStage(stage,**labels):
+    if(TELEMETRY_ENV not in os.environ):
+        return(NULL_TIMER)
+    return(StageTimer(stage,labels))
+
+# get the current resident memory of this process
+# OUTPUTS:
+#    resident set size in bytes, or None if it cannot be measured on this platform
+def getRSS():
+    if(psutil is not None):
+        return(psutil.Process().memory_info().rss)
+    if(os.path.exists('/proc/self/statm')):
+        with open('/proc/self/statm') as f:
+            return(int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE'))
+    return(None)
+
+# get the peak memory of the current process
+# OUTPUTS:
+#    peak resident set size in bytes, or None if it cannot be measured on this platform
+def getPeakRSS():
+    if(resource is not None):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return(peak if sys.platform=='darwin' else peak*1024)
+    if(psutil is not None):
+        memory = psutil.Process().memory_info()
+        return(getattr(memory,'peak_wset',memory.rss))
+    return(None)
+
+# append one record to the telemetry file, adding the time, process, and memory.  Each record is written with a
+# single append, so records from concurrent CPU workers are not interleaved
+# INPUTS:
+#    record (dictionary) - values to write
+def writeRecord(record):
+    outFile = getTelemetryFile()
+    if(outFile is None):
+        return
+    startSampler()
+    record.update({'time':time.time(),'host':socket.gethostname(),'pid':os.getpid(),'rss':getRSS(),'peakRss':getPeakRSS()})
+    handle = os.open(outFile,os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+    try:
+        os.write(handle,(json.dumps(record) + "\n").encode('utf-8'))
+    finally:
+        os.close(handle)
+
+# start the background memory sampler of the current process, once per process
+def startSampler():
+    if(processState['pid']==os.getpid()):
+        return
+    processState['pid'] = os.getpid()
+    processState['sampler'] = threading.Thread(target=sampleMemory,daemon=True)
+    processState['sampler'].start()
+
+# write a memory sample for the current process every RSS_INTERVAL seconds, until the process exits
+def sampleMemory():
+    while(True):
+        time.sleep(RSS_INTERVAL)
+        writeRecord({'stage':'rss_sample','seconds':0.0,'counts':{},'rates':{},'labels':{}})
+
+# summarize a telemetry file by stage
+# INPUTS:
+#    inFile (string) - absolute filepath of the JSON lines telemetry file
+# OUTPUTS:
+#    pandas dataframe with one row per stage: number of records, total and mean seconds, peak memory, totals
+#    of each counter, and overall throughput of each counter
+def summarizeTelemetry(inFile):
+    records = []
+    with open(inFile) as f:
+        for line in f:
+            # the last line may be partially written while a run is in progress
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    rows = {}
+    for record in records:
+        row = rows.setdefault(record['stage'],{'stage':record['stage'],'calls':0,'seconds':0.0,'peakRss':0,'processes':set()})
+        row['calls'] +=1
+        row['seconds'] += record['seconds']
+        row['peakRss'] = max(row['peakRss'],record['rss'] or 0)
+        row['processes'].add((record['host'],record['pid']))
+        for name,value in record['counts'].items():
+            row[name] = row.get(name,0) + value
+    if(len(rows)==0):
+        return(ps.DataFrame(columns=['stage','calls','seconds','peakRss','processes','meanSeconds']))
+    summary = ps.DataFrame(list(rows.values()))
+    summary['processes'] = summary['processes'].apply(len)
+    summary['meanSeconds'] = summary['seconds']/summary['calls']
+    for name in [field for field in summary.columns if field not in ['stage','calls','seconds','peakRss','processes','meanSeconds']]:
+        summary[name + "_per_second"] = summary[name]/summary['seconds'].where(summary['seconds']>0)
+    return(summary)
+
+# write a Prometheus-style text file summarizing a telemetry file, one metric per stage and counter
+# INPUTS:
+#    inFile (string) - absolute filepath of the JSON lines telemetry file
+#    outFile (string) - absolute filepath of the text file.  If None, PROMETHEUS_SUFFIX is added to inFile
+def writePrometheusFile(inFile,outFile=None):
+    if(outFile is None):
+        outFile = inFile + PROMETHEUS_SUFFIX
+    summary = summarizeTelemetry(inFile)
+    lines = []
+    for field in summary.columns:
+        if(field=='stage'):
+            continue
+        metric = METRIC_PREFIX + "stage_" + field.lower()
+        lines.append("# TYPE %s gauge" %(metric))
+        for stage,value in zip(summary['stage'],summary[field]):
+            if(ps.notna(value)):
+                lines.append('%s{stage="%s"} %s' %(metric,stage,repr(float(value))))
+    tempFile = getTempPath(outFile)
+    with open(tempFile,'w') as f:
+        f.write("\n".join(lines) + "\n")
+    commitTempFile(tempFile,outFile)
+
+# summarize a telemetry file from the command line, e.g. python telemetry.py telemetry.jsonl
+if __name__ == '__main__':
+    telemetryFile = sys.argv[1]
+    with ps.option_context('display.max_columns',None,'display.width',200):
+        print(summarizeTelemetry(telemetryFile))
+    writePrometheusFile(telemetryFile)
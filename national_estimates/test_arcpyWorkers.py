@@ -0,0 +1,110 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: tests the parallel arcpy layer in arcpyWorkers with the stub backend, so it runs on machines without
+#          ArcPro.  Checks that lock errors are retried, that each CPU worker has its own scratch geodatabase, that
+#          worker outputs are merged into the destination, and that other errors are raised without retrying.
+#          Run with pytest from this folder
+
+# import dependencies
+import json
+import os
+import random
+import pytest
+import arcpyWorkers
+
+# define global constants
+N_TASKS = 8 # number of tasks run in parallel
+N_WORKERS = 3 # number of CPU workers
+LOCK_RATE = 0.2 # probability that a stub geoprocessing tool fails with a lock error
+
+# use the stub backend with random lock errors in this process and in the CPU workers, which are forked from it
+@pytest.fixture
+def stubBackend(monkeypatch):
+    monkeypatch.setenv('ARCPY_BACKEND','stub')
+    monkeypatch.setenv('ARCPY_STUB_LOCK_RATE',str(LOCK_RATE))
+    monkeypatch.setattr(arcpyWorkers,'BACKEND_NAME','stub')
+    monkeypatch.setattr(arcpyWorkers,'loadedBackend',{})
+    monkeypatch.setattr(arcpyWorkers,'RETRY_WAIT',0)
+    # random lock errors never outlast the retries
+    monkeypatch.setattr(arcpyWorkers,'MAX_RETRIES',20)
+    random.seed(0)
+    return(arcpyWorkers.loadArcpy())
+
+# record an attempt to run a task
+# INPUTS:
+#    attemptFolder (string) - absolute folderpath where attempts are recorded
+#    name (string) - name of the task
+# OUTPUTS:
+#    number of earlier attempts
+def recordAttempt(attemptFolder,name):
+    attemptFile = os.path.join(attemptFolder,name + ".txt")
+    nAttempts = 0
+    if(os.path.exists(attemptFile)):
+        nAttempts = len(open(attemptFile).read().splitlines())
+    with open(attemptFile,'a') as f:
+        f.write(str(os.getpid()) + "\n")
+    return(nAttempts)
+
+# task that writes one output to the scratch geodatabase of the current CPU worker.  The first attempt always
+# fails with a lock error, and the stub tool fails randomly with lock errors at LOCK_RATE
+# INPUTS:
+#    name (string) - name of the output
+#    attemptFolder (string) - absolute folderpath where attempts are recorded
+# OUTPUTS:
+#    tuple of (temporary output path, worker process id, worker geodatabase, true if the geodatabase exists)
+def createOutput(name,attemptFolder):
+    arcpy = arcpyWorkers.loadArcpy()
+    if(recordAttempt(attemptFolder,name)==0):
+        raise RuntimeError("ERROR 000464: Cannot get exclusive schema lock (test %s)" %(name))
+    workerGDB = arcpyWorkers.getWorkerGDB()
+    tempPath = os.path.join(workerGDB,name + "_tmp")
+    arcpy.management.XYTableToPoint(name + ".csv",tempPath,"imgLon","imgLat")
+    return((tempPath,os.getpid(),workerGDB,arcpy.Exists(workerGDB)))
+
+# task that fails with an error that is not caused by a lock
+# INPUTS:
+#    name (string) - name of the task
+#    attemptFolder (string) - absolute folderpath where attempts are recorded
+def failOutput(name,attemptFolder):
+    recordAttempt(attemptFolder,name)
+    raise RuntimeError("ERROR 999999: Something unexpected caused the tool to fail")
+
+def test_run_parallel(stubBackend,tmp_path,capfd):
+    scratchFolder,destFolder,attemptFolder = [str(tmp_path / name) for name in ['scratch','dest','attempts']]
+    for folder in [destFolder,attemptFolder]:
+        os.makedirs(folder)
+    names = ["task_%i" %(index) for index in range(N_TASKS)]
+    merged = []
+    def onResult(args,result):
+        arcpyWorkers.mergeOutput(result[0],os.path.join(destFolder,args[0]))
+        merged.append(args[0])
+    results = arcpyWorkers.runParallel(createOutput,[(name,attemptFolder) for name in names],N_WORKERS,scratchFolder,onResult)
+
+    # every task failed on a lock at least once and was retried
+    assert capfd.readouterr().out.count("lock error in worker") >= N_TASKS
+    for name in names:
+        assert len(open(os.path.join(attemptFolder,name + ".txt")).read().splitlines()) >= 2
+
+    # each worker wrote to its own scratch geodatabase
+    workerGDBs = {}
+    for tempPath,pid,workerGDB,gdbExists in results:
+        assert gdbExists
+        assert workerGDB == os.path.join(scratchFolder,"worker_" + str(pid),arcpyWorkers.SCRATCH_GDB_NAME)
+        assert os.path.dirname(tempPath) == workerGDB
+        workerGDBs.setdefault(pid,set()).add(workerGDB)
+    assert all([len(gdbs)==1 for gdbs in workerGDBs.values()])
+
+    # every output was merged into the destination, and worker folders were removed
+    assert merged == names
+    assert sorted(os.listdir(destFolder)) == names
+    for name in names:
+        output = json.load(open(os.path.join(destFolder,name)))
+        assert output['tool'] == 'XYTableToPoint' and output['input'] == name + ".csv"
+    assert [folder for folder in os.listdir(scratchFolder) if folder.startswith("worker_")] == []
+
+def test_run_parallel_raises(stubBackend,tmp_path):
+    attemptFolder = str(tmp_path / 'attempts')
+    os.makedirs(attemptFolder)
+    with pytest.raises(RuntimeError,match="ERROR 999999"):
+        arcpyWorkers.runParallel(failOutput,[("fail",attemptFolder)],1,str(tmp_path / 'scratch'))
+    assert len(open(os.path.join(attemptFolder,"fail.txt")).read().splitlines()) == 1
@@ -0,0 +1,40 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: tests that the vectorized rounds in tsArrayPackage.performTSGames agree with the tsPackage.performTSGame
+#          loop within TS_TOLERANCE for the same seeded game order.  Run with pytest from this folder
+
+# import dependencies
+import numpy as np
+import pandas as ps
+import tsPackage
+import tsArrayPackage
+
+# define global constants
+N_IMAGES = 150 # number of images in the synthetic prediction csv
+N_GAMES = 3000 # number of siamese network model predictions in the synthetic prediction csv
+SEED = 11 # seed for the synthetic predictions and the game order
+
+# write a synthetic csv of siamese network model predictions
+# INPUTS:
+#    outFile (string) - absolute filepath of the csv
+def writeSyntheticCSV(outFile):
+    rng = np.random.default_rng(SEED)
+    imgIds = np.array(["img_%04i.jpg" %(index) for index in range(N_IMAGES)])
+    left = rng.integers(0,N_IMAGES,N_GAMES)
+    right = (left + rng.integers(1,N_IMAGES,N_GAMES)) % N_IMAGES
+    pred = np.round(rng.uniform(0,100,N_GAMES),1)
+    ps.DataFrame({'pred':pred,'l_img':imgIds[left],'r_img':imgIds[right]}).to_csv(outFile,index=False)
+
+def test_vectorized_rounds(tmp_path):
+    inputCSV = str(tmp_path / "predictions.csv")
+    writeSyntheticCSV(inputCSV)
+    objectDict = tsPackage.createGameDict(inputCSV,seed=SEED)
+    tsArray = tsArrayPackage.createGameDict(inputCSV,seed=SEED)
+    assert not tsArray.ratingArgs
+    rows = tsArray.lookup(list(objectDict.keys()))
+    for levelIndex,level in enumerate(tsArrayPackage.LEVELS):
+        mu = np.array([getattr(ts,level).mu for ts in objectDict.values()])
+        sigma = np.array([getattr(ts,level).sigma for ts in objectDict.values()])
+        assert np.max(np.abs(tsArray.mu[rows,levelIndex] - mu)) <= tsArrayPackage.TS_TOLERANCE, level
+        assert np.max(np.abs(tsArray.sigma[rows,levelIndex] - sigma)) <= tsArrayPackage.TS_TOLERANCE, level
+    assert np.array_equal(tsArray.n[rows],np.array([ts.n for ts in objectDict.values()]))
@@ -0,0 +1,71 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: tests that the compiled sequential TrueSkill kernel in tsKernel gives bit-for-bit the same multinomial
+#          TS scores as the tsPackage.performTSGame loop for the same seed, with numba and with the plain python
+#          fallback used when numba is not installed.  Run with pytest from this folder
+
+# import dependencies
+import subprocess
+import sys
+import os
+import numpy as np
+import pandas as ps
+import tsPackage
+import tsArrayPackage
+import tsKernel
+
+# define global constants
+N_IMAGES = 150 # number of images in the synthetic prediction csv
+N_GAMES = 3000 # number of siamese network model predictions in the synthetic prediction csv
+SEED = 7 # seed for the synthetic predictions and the game order
+
+# write a synthetic csv of siamese network model predictions.  Predictions include the vote thresholds
+# INPUTS:
+#    outFile (string) - absolute filepath of the csv
+def writeSyntheticCSV(outFile):
+    rng = np.random.default_rng(SEED)
+    imgIds = np.array(["img_%04i.jpg" %(index) for index in range(N_IMAGES)])
+    left = rng.integers(0,N_IMAGES,N_GAMES)
+    right = (left + rng.integers(1,N_IMAGES,N_GAMES)) % N_IMAGES
+    pred = np.round(rng.uniform(0,100,N_GAMES),1)
+    pred[::50] = rng.choice(tsPackage.VOTE_THRESHOLDS,len(pred[::50]))
+    ps.DataFrame({'pred':pred,'l_img':imgIds[left],'r_img':imgIds[right]}).to_csv(outFile,index=False)
+
+# check that the sequential kernel gives exactly the same mu, sigma, and number of games as the object engine.
+# The kernel stores the arguments used to construct trueskill.Rating objects, so mu and sigma are compared as
+# reported by Rating objects
+# INPUTS:
+#    inputCSV (string) - absolute filepath of the synthetic prediction csv
+def checkSequentialEngine(inputCSV):
+    objectDict = tsPackage.createGameDict(inputCSV,seed=SEED)
+    tsArray = tsArrayPackage.createGameDict(inputCSV,seed=SEED,sequential=True)
+    assert sorted(objectDict.keys()) == sorted(tsArray.keys())
+    rows = tsArray.lookup(list(objectDict.keys()))
+    assert tsArray.ratingArgs
+    arrayMu,arraySigma = tsKernel.ratingMoments(tsArray.mu[rows],tsArray.sigma[rows])
+    for levelIndex,level in enumerate(tsArrayPackage.LEVELS):
+        mu = np.array([getattr(ts,level).mu for ts in objectDict.values()])
+        sigma = np.array([getattr(ts,level).sigma for ts in objectDict.values()])
+        assert np.array_equal(arrayMu[:,levelIndex],mu), level
+        assert np.array_equal(arraySigma[:,levelIndex],sigma), level
+    assert np.array_equal(tsArray.n[rows],np.array([ts.n for ts in objectDict.values()]))
+
+def test_sequential_kernel(tmp_path):
+    inputCSV = str(tmp_path / "predictions.csv")
+    writeSyntheticCSV(inputCSV)
+    checkSequentialEngine(inputCSV)
+
+# numba is hidden from a fresh python process, so tsKernel falls back to plain python
+def test_sequential_kernel_without_numba(tmp_path):
+    inputCSV = str(tmp_path / "predictions.csv")
+    writeSyntheticCSV(inputCSV)
+    script = (
+        "import sys, math\n"
+        "sys.modules['numba'] = None\n"
+        "import tsKernel, test_tsKernel\n"
+        "assert tsKernel.power is math.pow\n"
+        "test_tsKernel.checkSequentialEngine(sys.argv[1])\n"
+    )
+    result = subprocess.run([sys.executable,"-c",script,inputCSV],cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,29 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: tests that the vote lookup table in tsPackage converts siamese perception model predictions into the
+#          same multinomial outcomes as convertVoteToOutcome.  Run with pytest from this folder
+
+# import dependencies
+import pytest
+from tsPackage import createVoteTable, convertVoteToOutcome, levelOutcomes, OUTCOME_CODES, VOTE_THRESHOLDS
+
+# compare a vote table against convertVoteToOutcome for every vote from 0 to 100
+# INPUTS:
+#    voteTable (int8 array) - lookup table created by createVoteTable
+#    thresholds (int array) - vote thresholds used to create the lookup table
+def checkVoteTable(voteTable,thresholds):
+    for vote in range(101):
+        expected = [OUTCOME_CODES[outcome] for outcome in convertVoteToOutcome(vote,thresholds)]
+        observed = [levelOutcomes(voteTable[vote:vote+1],level)[0] for level in range(3)]
+        assert observed == expected, "vote %i" %(vote)
+
+def test_default_thresholds():
+    checkVoteTable(createVoteTable(),VOTE_THRESHOLDS)
+
+def test_custom_thresholds():
+    thresholds = [10,30,45,70,95]
+    checkVoteTable(createVoteTable(thresholds),thresholds)
+
+def test_unsorted_thresholds():
+    with pytest.raises(ValueError):
+        createVoteTable([16,50,33,67,84])
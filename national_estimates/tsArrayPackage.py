@@ -0,0 +1,885 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: array-backed multinomial TrueSkill engine.  Stores mu, sigma, and game counts for all images
+#          in NumPy arrays and applies siamese neural network model predictions in vectorized batches.
+#          Drop-in replacement for the per-image TS objects in tsPackage.
+# Note: games are grouped into rounds in which no image appears more than once, and rounds are applied in
+#       game order.  Each image therefore sees its games in exactly the same sequence as the sequential
+#       tsPackage loop, and the vectorized closed-form updates agree with trueskill.rate_1vs1 within
+#       TS_TOLERANCE (maximum absolute difference in mu and sigma after a single game; observed differences
+#       are below 1e-12).
+
+# import dependencies
+from trueskill import global_env, calc_draw_margin
+from tsPackage import VOTE_TABLE, OUTCOME_CODES, convertVotesToOutcomes, levelOutcomes, min_max_scaling
+import numpy as np
+import pandas as ps
+from multiprocessing import Pool
+import tempfile
+import shutil
+import json
+import os
+import tsKernel
+from pipelineManifest import getTempPath, commitTempFile
+from telemetry import timeStage
+
+# define global constants
+INIT_MU = 25 # prior mean for each level, matches tsPackage.TS
+INIT_SIGMA = 6.8 # prior standard deviation for each level, matches tsPackage.TS
+LEVELS = ['slight','mod','strong'] # column order of the mu and sigma arrays
+TS_ENV = global_env() # trueskill environment used by rate_1vs1 in tsPackage
+BETA = TS_ENV.beta
+TAU = TS_ENV.tau
+DRAW_MARGIN = calc_draw_margin(TS_ENV.draw_probability,2,TS_ENV)
+TS_TOLERANCE = 1e-9 # documented agreement with trueskill.rate_1vs1
+CHUNK_SIZE = 1000000 # number of csv rows parsed at a time when streaming siamese network model predictions
+BUCKET_CSV_BYTES = 2*1024**3 # approximate csv bytes per on-disk shuffle bucket, keeps each bucket small enough to load at once
+GAME_RECORD = np.dtype([('l','<i4'),('r','<i4'),('outcome','i1')]) # compact binary record for one game in a shuffle bucket
+STATE_RECORD = np.dtype([('mu','<f8',(len(LEVELS),)),('sigma','<f8',(len(LEVELS),)),('n','<i8')]) # multinomial TS state of one image
+
+# custom class for storing multinomial trueskill states for a set of images in arrays, one row per image
+# and one column per level in the multinomial model
+class TSArray:
+
+    # initialize multinomial trueskill states for a set of image ids
+    # INPUTS:
+    #    imgIds (array) - unique image ids, row i of each array stores the state for imgIds[i].  Either image
+    #                     filenames or int32 codes from an imageIndex.ImageIndex
+    #    index (dictionary) - optional, precomputed kv pairs of image ids:row indices
+    #    states (structured array) - optional, initialized STATE_RECORD array with one record per image.  If
+    #                                provided, mu, sigma, and n are views into states (see MultiTSArray)
+    def __init__(self,imgIds,index=None,states=None):
+        if(np.asarray(imgIds).dtype.kind in 'iu'):
+            self.imgIds = np.asarray(imgIds,dtype=np.int32)
+        else:
+            self.imgIds = np.asarray(imgIds,dtype=object)
+        self._index = index
+        if(states is None):
+            self.mu = np.full((len(self.imgIds),len(LEVELS)),INIT_MU,dtype=np.float64)
+            self.sigma = np.full((len(self.imgIds),len(LEVELS)),INIT_SIGMA,dtype=np.float64)
+            self.n = np.zeros(len(self.imgIds),dtype=np.int64)
+        else:
+            self.mu, self.sigma, self.n = states['mu'], states['sigma'], states['n']
+        self.ratingArgs = False # true if mu and sigma store trueskill.Rating constructor arguments (see tsKernel)
+
+    # kv pairs of image ids:row indices, only built when needed
+    @property
+    def index(self):
+        if(self._index is None):
+            self._index = {imgId:rowIndex for rowIndex,imgId in enumerate(self.imgIds.tolist())}
+        return(self._index)
+
+    def __len__(self):
+        return(len(self.imgIds))
+
+    # dictionary-style access so TSArray can be passed to functions written for dictionaries of TS objects
+    def keys(self):
+        return(self.index.keys())
+
+    def __getitem__(self,imgId):
+        return(TSView(self,self.index[imgId]))
+
+    # convert image ids into row indices
+    # INPUTS:
+    #    imgIds (string array) - image ids to look up
+    # OUTPUTS:
+    #    int32 array of row indices
+    def lookup(self,imgIds):
+        return(np.fromiter((self.index[imgId] for imgId in imgIds),dtype=np.int32,count=len(imgIds)))
+
+    # export the states as columns, one value per image, for tsPackage.convertDictToDF.  Image ids and game
+    # counts are views of the stored arrays, and the mean mu and sigma across the 3 levels are vectorized
+    # OUTPUTS:
+    #    tuple of (image ids, mean mu, mean sigma, number of games)
+    def exportColumns(self):
+        avgMu,avgSigma = calcAvgMoments(self)
+        return((self.imgIds,avgMu,avgSigma,self.n))
+
+# custom class for storing multinomial trueskill states for several perceptions and comparison levels of the
+# same images in one structured array, with one record per image and one STATE_RECORD field per perception and
+# comparison level.  Every field is indexed by the same int32 image codes, so an MSA needs a single image index
+class MultiTSArray:
+
+    # INPUTS:
+    #    imgIds (int array) - int32 image codes from an imageIndex.ImageIndex, row i stores the states for imgIds[i]
+    #    names (string array) - one name for each perception and comparison level (e.g. 'beauty_city')
+    def __init__(self,imgIds,names):
+        self.imgIds = np.asarray(imgIds,dtype=np.int32)
+        self.names = list(names)
+        self.states = np.empty(len(self.imgIds),dtype=[(name,STATE_RECORD) for name in self.names])
+        self.tsArrays = {}
+        for name in self.names:
+            self.tsArrays[name] = TSArray(self.imgIds,states=self.states[name])
+            self.reset(name)
+
+    # reset the states of a single perception and comparison level to the TS priors
+    # INPUTS:
+    #    name (string) - perception and comparison level to reset
+    def reset(self,name):
+        self.states[name]['mu'] = INIT_MU
+        self.states[name]['sigma'] = INIT_SIGMA
+        self.states[name]['n'] = 0
+        self.tsArrays[name].ratingArgs = False
+
+    def __len__(self):
+        return(len(self.imgIds))
+
+    # TSArray whose mu, sigma, and n are views into the field for a single perception and comparison level
+    def __getitem__(self,name):
+        return(self.tsArrays[name])
+
+# custom class for the average TS mu of each image in several independent, seeded orderings of the same games
+class TSEnsemble:
+
+    # INPUTS:
+    #    imgIds (int array) - int32 image codes from an imageIndex.ImageIndex
+    #    n (int array) - number of games played by each image, the same in every ordering
+    #    avgMu (2d float array) - shape (n orderings, n images), mean mu across the 3 levels in each ordering
+    #    seed (int) - ensemble seed.  Ordering k is replayed from child seed k of the ensemble seed
+    def __init__(self,imgIds,n,avgMu,seed):
+        self.imgIds = np.asarray(imgIds,dtype=np.int32)
+        self.n = n
+        self.avgMu = avgMu
+        self.seed = seed
+
+    def __len__(self):
+        return(len(self.imgIds))
+
+    # mean of the average mu of each image across orderings
+    def meanMu(self):
+        return(self.avgMu.mean(axis=0))
+
+    # standard deviation of the average mu of each image across orderings
+    def spreadMu(self):
+        return(self.avgMu.std(axis=0))
+
+# read-only view of a single row of a TSArray, with the same interface as tsPackage.TS
+class TSView:
+
+    def __init__(self,tsArray,row):
+        self.tsArray = tsArray
+        self.row = row
+
+    @property
+    def n(self):
+        return(int(self.tsArray.n[self.row]))
+
+    # mu and sigma for all 3 levels, as reported by trueskill.Rating objects
+    def moments(self):
+        mu,sigma = self.tsArray.mu[self.row],self.tsArray.sigma[self.row]
+        if(self.tsArray.ratingArgs):
+            return(tsKernel.ratingMoments(mu,sigma))
+        return(mu,sigma)
+
+    # calculate the mean mu across all 3 levels
+    def calcAvgTSMean(self):
+        mu = self.moments()[0]
+        return(float((mu[0] + mu[1] + mu[2])/3.0))
+
+    # calculate the mean sigma across all 3 levels
+    def calcAvgTSSigma(self):
+        sigma = self.moments()[1]
+        return(float((sigma[0] + sigma[1] + sigma[2])/3.0))
+
+# complementary error function, vectorized version of the approximation used by the trueskill package
+# INPUTS:
+#    x (float array) - values to evaluate
+# OUTPUTS:
+#    float array of erfc values
+def erfc(x):
+    z = np.abs(x)
+    t = 1. / (1. + z / 2.)
+    r = t * np.exp(-z * z - 1.26551223 + t * (1.00002368 + t * (
+        0.37409196 + t * (0.09678418 + t * (-0.18628806 + t * (
+            0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (
+                -0.82215223 + t * 0.17087277
+            )))
+        )))
+    )))
+    return(np.where(x < 0, 2. - r, r))
+
+# standard normal cumulative distribution function
+def cdf(x):
+    return(0.5 * erfc(-x / np.sqrt(2)))
+
+# standard normal probability density function
+def pdf(x):
+    return(1 / np.sqrt(2 * np.pi) * np.exp(-(x ** 2 / 2)))
+
+# mean and variance update factors for a win
+# INPUTS:
+#    t (float array) - difference in means divided by the standard deviation of the performance difference
+#    eps (float array) - draw margin divided by the standard deviation of the performance difference
+# OUTPUTS:
+#    v (float array) - mean update factor
+#    w (float array) - variance update factor
+def vwWin(t,eps):
+    x = t - eps
+    denom = cdf(x)
+    safeDenom = np.where(denom==0,1.0,denom)
+    v = np.where(denom==0,-x,pdf(x)/safeDenom)
+    w = v * (v + x)
+    return(v,w)
+
+# mean and variance update factors for a tie
+# INPUTS:
+#    t (float array) - difference in means divided by the standard deviation of the performance difference
+#    eps (float array) - draw margin divided by the standard deviation of the performance difference
+# OUTPUTS:
+#    v (float array) - mean update factor
+#    w (float array) - variance update factor
+def vwDraw(t,eps):
+    absT = np.abs(t)
+    a, b = eps - absT, -eps - absT
+    denom = cdf(a) - cdf(b)
+    safeDenom = np.where(denom==0,1.0,denom)
+    vAbs = np.where(denom==0,a,(pdf(b) - pdf(a))/safeDenom)
+    w = vAbs ** 2 + (a * pdf(a) - b * pdf(b))/safeDenom
+    return(np.where(t < 0,-vAbs,vAbs),w)
+
+# vectorized 1 vs 1 trueskill update.  Equivalent to trueskill.rate_1vs1 applied element-wise
+# INPUTS:
+#    mu1, sigma1 (float arrays) - ratings for the first player (the winner unless drawn)
+#    mu2, sigma2 (float arrays) - ratings for the second player
+#    drawn (bool array) - true for games that ended in a tie
+# OUTPUTS:
+#    updated mu1, sigma1, mu2, sigma2
+def rate1vs1(mu1,sigma1,mu2,sigma2,drawn):
+    var1 = sigma1 ** 2 + TAU ** 2
+    var2 = sigma2 ** 2 + TAU ** 2
+    c2 = 2 * BETA ** 2 + var1 + var2
+    c = np.sqrt(c2)
+    t = (mu1 - mu2)/c
+    eps = DRAW_MARGIN/c
+    vWin,wWin = vwWin(t,eps)
+    vDraw,wDraw = vwDraw(t,eps)
+    v = np.where(drawn,vDraw,vWin)
+    w = np.where(drawn,wDraw,wWin)
+    newMu1 = mu1 + var1/c * v
+    newMu2 = mu2 - var2/c * v
+    newSigma1 = np.sqrt(var1 * (1 - var1/c2 * w))
+    newSigma2 = np.sqrt(var2 * (1 - var2/c2 * w))
+    return(newMu1,newSigma1,newMu2,newSigma2)
+
+# apply one round of games to a TSArray.  No image can appear more than once in the round
+# INPUTS:
+#    tsArray (TSArray) - multinomial TS states for all images
+#    leftIdx (int array) - row index of the left image for each game
+#    rightIdx (int array) - row index of the right image for each game
+#    outcomes (int8 array) - multinomial outcome codes (see tsPackage.createVoteTable)
+#    pruning (tsPackage.GamePruning) - optional.  If provided, games that add little information are skipped
+#                                      and counted in pruning
+def applyRound(tsArray,leftIdx,rightIdx,outcomes,pruning=None):
+    if(pruning is not None):
+        leftIdx,rightIdx,outcomes,updateLeft,updateRight = pruneRound(tsArray,leftIdx,rightIdx,outcomes,pruning)
+    for level in range(len(LEVELS)):
+        # orient each game so the first player is the winner, or the left image for a tie
+        curOutcomes = levelOutcomes(outcomes,level)
+        leftLoses = curOutcomes==OUTCOME_CODES['lose']
+        first = np.where(leftLoses,rightIdx,leftIdx)
+        second = np.where(leftLoses,leftIdx,rightIdx)
+        mu1,sigma1,mu2,sigma2 = rate1vs1(
+            tsArray.mu[first,level],tsArray.sigma[first,level],
+            tsArray.mu[second,level],tsArray.sigma[second,level],
+            curOutcomes==OUTCOME_CODES['tie']
+        )
+        if(pruning is None):
+            tsArray.mu[first,level],tsArray.sigma[first,level] = mu1,sigma1
+            tsArray.mu[second,level],tsArray.sigma[second,level] = mu2,sigma2
+            continue
+        # converged images keep their current scores
+        updateFirst = np.where(leftLoses,updateRight,updateLeft)
+        updateSecond = np.where(leftLoses,updateLeft,updateRight)
+        tsArray.mu[first[updateFirst],level],tsArray.sigma[first[updateFirst],level] = mu1[updateFirst],sigma1[updateFirst]
+        tsArray.mu[second[updateSecond],level],tsArray.sigma[second[updateSecond],level] = mu2[updateSecond],sigma2[updateSecond]
+    if(pruning is None):
+        tsArray.n[leftIdx] +=1
+        tsArray.n[rightIdx] +=1
+    else:
+        tsArray.n[leftIdx[updateLeft]] +=1
+        tsArray.n[rightIdx[updateRight]] +=1
+
+# mean trueskill match quality (trueskill.quality_1vs1) across the three levels, element-wise
+# INPUTS:
+#    mu1, sigma1 (float arrays) - shape (n games, 3), ratings of the left images
+#    mu2, sigma2 (float arrays) - shape (n games, 3), ratings of the right images
+# OUTPUTS:
+#    float array of match qualities, one for each game
+def calcMatchQuality(mu1,sigma1,mu2,sigma2):
+    denom = 2 * BETA ** 2 + sigma1 ** 2 + sigma2 ** 2
+    quality = np.exp(-0.5 * (mu1 - mu2) ** 2 / denom) * np.sqrt(2 * BETA ** 2 / denom)
+    return(quality.sum(axis=1)/3.0)
+
+# remove games that add little information from a round and flag the images that are still updated
+# (see tsPackage.GamePruning)
+# INPUTS:
+#    tsArray (TSArray) - multinomial TS states for all images
+#    leftIdx, rightIdx, outcomes (arrays) - games in the round
+#    pruning (tsPackage.GamePruning) - pruning thresholds, updated with the number of skipped games
+# OUTPUTS:
+#    leftIdx, rightIdx, outcomes - games that are applied
+#    updateLeft, updateRight (bool arrays) - true where the left or right image is updated
+def pruneRound(tsArray,leftIdx,rightIdx,outcomes,pruning):
+    minSigma,minQuality = pruning.thresholds()
+    leftSigma,rightSigma = tsArray.sigma[leftIdx],tsArray.sigma[rightIdx]
+    updateLeft = leftSigma.sum(axis=1)/3.0 >= minSigma
+    updateRight = rightSigma.sum(axis=1)/3.0 >= minSigma
+    converged = ~(updateLeft | updateRight)
+    lowQuality = ~converged & (calcMatchQuality(tsArray.mu[leftIdx],leftSigma,tsArray.mu[rightIdx],rightSigma) < minQuality)
+    keep = ~(converged | lowQuality)
+    pruning.addCounts(len(leftIdx),converged.sum(),lowQuality.sum(),(keep & ~(updateLeft & updateRight)).sum())
+    return(leftIdx[keep],rightIdx[keep],outcomes[keep],updateLeft[keep],updateRight[keep])
+
+# update a TSArray with a sequence of siamese network model predictions, in game order
+# INPUTS:
+#    tsArray (TSArray) - multinomial TS states for all images
+#    leftIdx (int array) - row index of the left image for each game
+#    rightIdx (int array) - row index of the right image for each game
+#    outcomes (int8 array) - multinomial outcome codes (see tsPackage.createVoteTable)
+#    pruning (tsPackage.GamePruning) - optional.  If provided, games that add little information are skipped
+#                                      and counted in pruning
+# OUTPUTS:
+#    tsArray, after updating with all games
+def performTSGames(tsArray,leftIdx,rightIdx,outcomes,pruning=None):
+    leftIdx = np.asarray(leftIdx)
+    rightIdx = np.asarray(rightIdx)
+    outcomes = np.asarray(outcomes)
+    rounds = tsKernel.assignRounds(leftIdx,rightIdx,len(tsArray))
+    order = np.argsort(rounds,kind='stable')
+    bounds = np.searchsorted(rounds[order],np.arange(rounds.max(initial=-1)+2))
+    for roundIndex in range(len(bounds)-1):
+        games = order[bounds[roundIndex]:bounds[roundIndex+1]]
+        applyRound(tsArray,leftIdx[games],rightIdx[games],outcomes[games],pruning)
+    return(tsArray)
+
+# update a TSArray with a sequence of siamese network model predictions, either one game at a time with the
+# compiled kernel in tsKernel or in vectorized rounds
+# INPUTS:
+#    tsArray (TSArray) - multinomial TS states for all images
+#    leftIdx (int array) - row index of the left image for each game
+#    rightIdx (int array) - row index of the right image for each game
+#    outcomes (int8 array) - multinomial outcome codes (see tsPackage.createVoteTable)
+#    sequential (boolean) - if true, use the compiled sequential kernel
+#    pruning (tsPackage.GamePruning) - optional.  If provided, games that add little information are skipped
+#                                      and counted in pruning
+# OUTPUTS:
+#    tsArray, after updating with all games
+def applyGames(tsArray,leftIdx,rightIdx,outcomes,sequential,pruning=None):
+    if(sequential):
+        return(tsKernel.performTSGames(tsArray,leftIdx,rightIdx,outcomes,pruning))
+    return(performTSGames(tsArray,leftIdx,rightIdx,outcomes,pruning))
+
+# given a csv of siamese perception model predictions, create a TSArray with one row for each image id
+# and calculate multinomial TS scores using the siamese model predictions.  Same interface as
+# tsPackage.createGameDict, and the result can be passed to tsPackage.convertDictToDF
+# INPUTS:
+#    inputCSV (string) - absolute filepath to csv containing siamese perception model predictions
+#    imageIndex (ImageIndex) - optional.  If provided, TSArray rows are the int32 image codes from the index
+#    seed (int) - seed for the random game order.  If None, the order is not reproducible
+#    sequential (boolean) - if true, apply games one at a time with the compiled kernel in tsKernel, which gives
+#                           bit-for-bit the same scores as tsPackage.createGameDict for the same seed
+#    voteTable (int8 array) - lookup table for converting predictions into outcome codes (see tsPackage.createVoteTable)
+#    tsArray (TSArray) - optional, TSArray with one row per image code to update.  Requires imageIndex
+#    pruning (tsPackage.GamePruning) - optional.  If provided, games that add little information are skipped
+#                                      and counted in pruning
+# OUTPUTS:
+#    TSArray of multinomial TS scores based on the siamese model predictions
+def createGameDict(inputCSV,imageIndex=None,seed=None,sequential=False,voteTable=VOTE_TABLE,tsArray=None,pruning=None):
+
+    # load dataset into memory and randomize the record order.  TS is a state-dependent model, so
+    # randomization is important to avoid unforseen biases in record order
+    inputName = os.path.basename(inputCSV)
+    with timeStage('parse',file=inputName) as timer:
+        testPerceptions = ps.read_csv(inputCSV,usecols=['pred','l_img','r_img'])
+        timer.count(rows=len(testPerceptions))
+    with timeStage('shuffle',file=inputName) as timer:
+        testPerceptions = testPerceptions.sample(frac=1,random_state=seed).reset_index(drop=True)
+        timer.count(rows=len(testPerceptions))
+
+    # create one row for each unique image, and convert image ids to row indices
+    with timeStage('encode',file=inputName) as timer:
+        if(imageIndex is not None):
+            if(tsArray is None):
+                tsArray = createCodedTSArray(imageIndex)
+            leftIdx = encodeImgIds(imageIndex,testPerceptions['l_img'])
+            rightIdx = encodeImgIds(imageIndex,testPerceptions['r_img'])
+        else:
+            uniqueImgs = ps.unique(ps.concat([testPerceptions['l_img'],testPerceptions['r_img']]))
+            tsArray = TSArray(uniqueImgs)
+            leftIdx = tsArray.lookup(testPerceptions['l_img'])
+            rightIdx = tsArray.lookup(testPerceptions['r_img'])
+        outcomes = convertVotesToOutcomes(testPerceptions['pred'].values,voteTable)
+        timer.count(rows=len(testPerceptions))
+    print("completed creating unique list")
+    with timeStage('rating_update',file=inputName,sequential=sequential) as timer:
+        applyGames(tsArray,leftIdx,rightIdx,outcomes,sequential,pruning)
+        timer.count(games=len(outcomes))
+    return(tsArray)
+
+# create a TSArray with one row for each image in an image index, where the row index is the image code
+# INPUTS:
+#    imageIndex (ImageIndex) - image index for the current MSA
+# OUTPUTS:
+#    TSArray with int32 image codes as image ids
+def createCodedTSArray(imageIndex):
+    return(TSArray(np.arange(len(imageIndex),dtype=np.int32)))
+
+# convert image filenames into int32 image codes, raising an error for images missing from the index
+# INPUTS:
+#    imageIndex (ImageIndex) - image index for the current MSA
+#    imgIds (pandas series) - image filenames
+# OUTPUTS:
+#    int32 array of image codes
+def encodeImgIds(imageIndex,imgIds):
+    codes = imageIndex.encode(imgIds)
+    if((codes<0).any()):
+        raise ValueError("%i image ids are missing from the image index" %((codes<0).sum()))
+    return(codes)
+
+# convert image ids in one chunk of siamese network model predictions into row indices, adding
+# previously unseen image ids to the end of the index
+# INPUTS:
+#    imgIds (pandas series) - image ids for one side of the siamese network comparisons
+#    index (dictionary) - kv pairs of image ids:row indices, updated in place
+#    uniqueImgs (string array) - image ids in row order, updated in place
+# OUTPUTS:
+#    int32 array of row indices
+def internChunk(imgIds,index,uniqueImgs):
+    categories = ps.Categorical(imgIds)
+    categoryRows = np.empty(len(categories.categories),dtype=np.int32)
+    for catIndex,imgId in enumerate(categories.categories):
+        if(imgId not in index):
+            index[imgId] = len(uniqueImgs)
+            uniqueImgs.append(imgId)
+        categoryRows[catIndex] = index[imgId]
+    return(categoryRows[categories.codes])
+
+# read siamese network model predictions in bounded-size chunks and scatter the games into on-disk buckets
+# at random.  Concatenating the buckets after shuffling each one in memory gives a uniformly random game order
+# INPUTS:
+#    inputCSV (string) - absolute filepath to csv containing siamese perception model predictions
+#    bucketFolder (string) - folder where bucket files are written
+#    nBuckets (int) - number of buckets
+#    rng (numpy Generator) - random number generator used to assign games to buckets
+#    chunkSize (int) - number of csv rows to parse at a time
+#    imageIndex (ImageIndex) - optional.  If provided, games store int32 image codes from the index
+#    voteTable (int8 array) - lookup table for converting predictions into outcome codes (see tsPackage.createVoteTable)
+# OUTPUTS:
+#    uniqueImgs (string array) - image ids in row order, empty if imageIndex is provided
+#    index (dictionary) - kv pairs of image ids:row indices, empty if imageIndex is provided
+#    bucketFiles (string array) - absolute filepaths to the bucket files
+def scatterGamesToBuckets(inputCSV,bucketFolder,nBuckets,rng,chunkSize=CHUNK_SIZE,imageIndex=None,voteTable=VOTE_TABLE):
+    index,uniqueImgs = {},[]
+    bucketFiles = [bucketFolder + "bucket_" + str(bucket) + ".bin" for bucket in range(nBuckets)]
+    bucketHandles = [open(bucketFile,'wb') for bucketFile in bucketFiles]
+    reader = ps.read_csv(
+        inputCSV,
+        usecols=['pred','l_img','r_img'],
+        dtype={'pred':np.float64,'l_img':'category','r_img':'category'},
+        chunksize=chunkSize
+    )
+    nRows = 0
+    try:
+        for chunk in reader:
+            records = np.empty(len(chunk),dtype=GAME_RECORD)
+            if(imageIndex is not None):
+                records['l'] = encodeImgIds(imageIndex,chunk['l_img'])
+                records['r'] = encodeImgIds(imageIndex,chunk['r_img'])
+            else:
+                records['l'] = internChunk(chunk['l_img'],index,uniqueImgs)
+                records['r'] = internChunk(chunk['r_img'],index,uniqueImgs)
+            records['outcome'] = convertVotesToOutcomes(chunk['pred'].values,voteTable)
+            buckets = rng.integers(0,nBuckets,len(records))
+            order = np.argsort(buckets,kind='stable')
+            bounds = np.searchsorted(buckets[order],np.arange(nBuckets+1))
+            for bucket in range(nBuckets):
+                records[order[bounds[bucket]:bounds[bucket+1]]].tofile(bucketHandles[bucket])
+            nRows += len(records)
+            print("scattered %i rows" %(nRows))
+    finally:
+        for handle in bucketHandles:
+            handle.close()
+    return(uniqueImgs,index,bucketFiles)
+
+# streaming version of createGameDict.  Reads only the pred, l_img and r_img columns in bounded-size chunks,
+# randomizes the game order with a seeded external shuffle over on-disk buckets, and updates TS scores one
+# bucket at a time.  Memory grows with the number of unique images but not with the number of games.
+# INPUTS:
+#    inputCSV (string) - absolute filepath to csv containing siamese perception model predictions
+#    scratchFolder (string) - folder where temporary bucket files are written
+#    seed (int) - seed for the random game order.  If None, the order is not reproducible
+#    chunkSize (int) - number of csv rows to parse at a time
+#    nBuckets (int) - number of shuffle buckets.  If None, determined from the size of the input csv
+#    imageIndex (ImageIndex) - optional.  If provided, TSArray rows are the int32 image codes from the index
+#    sequential (boolean) - if true, apply games one at a time with the compiled kernel in tsKernel
+#    voteTable (int8 array) - lookup table for converting predictions into outcome codes (see tsPackage.createVoteTable)
+#    tsArray (TSArray) - optional, TSArray with one row per image code to update.  Requires imageIndex
+#    pruning (tsPackage.GamePruning) - optional.  If provided, games that add little information are skipped
+#                                      and counted in pruning
+# OUTPUTS:
+#    TSArray of multinomial TS scores based on the siamese model predictions
+def createGameDictStreaming(inputCSV,scratchFolder,seed=None,chunkSize=CHUNK_SIZE,nBuckets=None,imageIndex=None,sequential=False,voteTable=VOTE_TABLE,tsArray=None,pruning=None):
+    rng = np.random.default_rng(seed)
+    if(nBuckets is None):
+        nBuckets = int(os.path.getsize(inputCSV)//BUCKET_CSV_BYTES) + 1
+    os.makedirs(scratchFolder,exist_ok=True)
+    bucketFolder = tempfile.mkdtemp(dir=scratchFolder) + "/"
+    inputName = os.path.basename(inputCSV)
+    try:
+        # parsing includes scattering games into the on-disk buckets
+        with timeStage('parse',file=inputName) as timer:
+            uniqueImgs,index,bucketFiles = scatterGamesToBuckets(inputCSV,bucketFolder,nBuckets,rng,chunkSize,imageIndex,voteTable)
+            timer.count(rows=sum([os.path.getsize(bucketFile) for bucketFile in bucketFiles])//GAME_RECORD.itemsize)
+        if(imageIndex is not None):
+            if(tsArray is None):
+                tsArray = createCodedTSArray(imageIndex)
+        else:
+            tsArray = TSArray(uniqueImgs,index)
+        print("completed creating unique list")
+
+        # load one bucket at a time, shuffle the bucket in memory, and update TS scores
+        shuffleTimer = timeStage('shuffle',file=inputName)
+        updateTimer = timeStage('rating_update',file=inputName,sequential=sequential)
+        for bucketFile in bucketFiles:
+            with shuffleTimer.lap():
+                records = np.fromfile(bucketFile,dtype=GAME_RECORD)
+                records = records[rng.permutation(len(records))]
+            with updateTimer.lap():
+                applyGames(tsArray,records['l'],records['r'],records['outcome'],sequential,pruning)
+            shuffleTimer.count(rows=len(records))
+            updateTimer.count(games=len(records))
+            os.remove(bucketFile)
+        shuffleTimer.record()
+        updateTimer.record()
+    finally:
+        shutil.rmtree(bucketFolder,ignore_errors=True)
+    return(tsArray)
+
+# calculate the mean mu across the 3 levels for every image in a TSArray
+# INPUTS:
+#    tsArray (TSArray) - multinomial TS states for all images
+# OUTPUTS:
+#    float64 array with one value per image
+def calcAvgMu(tsArray):
+    mu = tsArray.mu
+    if(tsArray.ratingArgs):
+        mu = tsKernel.ratingMoments(tsArray.mu,tsArray.sigma)[0]
+    return((mu[:,0] + mu[:,1] + mu[:,2])/3.0)
+
+# calculate the mean mu and mean sigma across the 3 levels for every image in a TSArray.  Levels are added in
+# the same order as tsPackage.TS, so values are identical to calcAvgTSMean and calcAvgTSSigma
+# INPUTS:
+#    tsArray (TSArray) - multinomial TS states for all images
+# OUTPUTS:
+#    tuple of float64 arrays (mean mu, mean sigma), one value per image
+def calcAvgMoments(tsArray):
+    mu,sigma = tsArray.mu,tsArray.sigma
+    if(tsArray.ratingArgs):
+        mu,sigma = tsKernel.ratingMoments(tsArray.mu,tsArray.sigma)
+    return(((mu[:,0] + mu[:,1] + mu[:,2])/3.0,(sigma[:,0] + sigma[:,1] + sigma[:,2])/3.0))
+
+# compare the mean mu of a run with game pruning against a full run over the same games, to measure how much
+# accuracy is traded for throughput (see tsPackage.GamePruning).  Only images compared in the full run are used
+# INPUTS:
+#    fullArray (TSArray) - multinomial TS states after applying every game
+#    prunedArray (TSArray) - multinomial TS states for the same images after applying games with pruning
+# OUTPUTS:
+#    dictionary with the number of compared images, the spearman rank correlation of the mean mu, and the mean
+#    and maximum absolute change in percentile rank
+def calcRankAgreement(fullArray,prunedArray):
+    compared = fullArray.n>0
+    fullRanks = ps.Series(calcAvgMu(fullArray)[compared]).rank(pct=True).values
+    prunedRanks = ps.Series(calcAvgMu(prunedArray)[compared]).rank(pct=True).values
+    shift = np.abs(fullRanks - prunedRanks)
+    return({
+        'images':int(compared.sum()),
+        'spearman':float(np.corrcoef(fullRanks,prunedRanks)[0,1]) if compared.sum()>1 else None,
+        'meanPercentileShift':float(shift.mean()) if len(shift)>0 else None,
+        'maxPercentileShift':float(shift.max()) if len(shift)>0 else None
+    })
+
+# get the game order of one ordering in an ensemble.  Each ordering uses an independent child seed of the ensemble
+# seed, so orderings can be replayed in any order or in separate CPU workers and give the same scores
+# INPUTS:
+#    nGames (int) - number of games
+#    seed (int) - ensemble seed
+#    ordering (int) - index of the ordering
+# OUTPUTS:
+#    int64 array of game indices, in replay order
+def getOrdering(nGames,seed,ordering):
+    childSeed = np.random.SeedSequence(seed).spawn(ordering + 1)[ordering]
+    return(np.random.default_rng(childSeed).permutation(nGames))
+
+# load the games written by writeGameFiles
+# INPUTS:
+#    gameFiles (string array) - absolute filepaths of binary GAME_RECORD files
+# OUTPUTS:
+#    GAME_RECORD array of all games, in file order
+def loadGames(gameFiles):
+    return(np.concatenate([np.fromfile(gameFile,dtype=GAME_RECORD) for gameFile in gameFiles]))
+
+# parse siamese network model prediction csvs once into binary game files, so every ordering of an ensemble
+# replays the same games without re-reading the csvs
+# INPUTS:
+#    inputCSVs (string array) - absolute filepaths to csvs containing siamese perception model predictions
+#    gameFolder (string) - folder where game files are written
+#    imageIndex (ImageIndex) - image index shared by all csvs
+#    voteTable (int8 array) - lookup table for converting predictions into outcome codes (see tsPackage.createVoteTable)
+# OUTPUTS:
+#    list of absolute filepaths of the game files, one per csv
+def writeGameFiles(inputCSVs,gameFolder,imageIndex,voteTable=VOTE_TABLE):
+    gameFiles = []
+    for position,inputCSV in enumerate(inputCSVs):
+        csvFolder = gameFolder + str(position) + "/"
+        os.makedirs(csvFolder,exist_ok=True)
+        with timeStage('parse',file=os.path.basename(inputCSV)) as timer:
+            gameFiles += scatterGamesToBuckets(inputCSV,csvFolder,1,np.random.default_rng(0),imageIndex=imageIndex,voteTable=voteTable)[2]
+            timer.count(rows=os.path.getsize(gameFiles[-1])//GAME_RECORD.itemsize)
+    return(gameFiles)
+
+# replay all games in one ordering of an ensemble.  Used as the function mapped over CPU workers
+# INPUTS:
+#    orderTuple (tuple) - contains
+#           gameFiles (string array) - absolute filepaths of the game files created by writeGameFiles
+#           nImages (int) - number of images in the image index
+#           seed (int) - ensemble seed
+#           ordering (int) - index of the ordering
+#           sequential (boolean) - if true, apply games one at a time with the compiled kernel in tsKernel
+# OUTPUTS:
+#    float64 array, the mean mu across the 3 levels of each image
+def replayOrdering(orderTuple):
+    gameFiles,nImages,seed,ordering,sequential = orderTuple
+    with timeStage('shuffle',ordering=ordering) as timer:
+        records = loadGames(gameFiles)
+        records = records[getOrdering(len(records),seed,ordering)]
+        timer.count(rows=len(records))
+    tsArray = TSArray(np.arange(nImages,dtype=np.int32))
+    with timeStage('rating_update',ordering=ordering,sequential=sequential) as timer:
+        applyGames(tsArray,records['l'],records['r'],records['outcome'],sequential)
+        timer.count(games=len(records))
+    return(calcAvgMu(tsArray))
+
+# replay several orderings of an ensemble in one vectorized pass.  The states of all orderings are stored in a
+# single TSArray with shape (n orderings x n images, 3 levels), and the games of ordering k refer to rows
+# k x n images onwards, so each vectorized round updates every ordering at once
+# INPUTS:
+#    gameFiles (string array) - absolute filepaths of the game files created by writeGameFiles
+#    nImages (int) - number of images in the image index
+#    seed (int) - ensemble seed
+#    orderings (int array) - indices of the orderings
+# OUTPUTS:
+#    2d float64 array with shape (n orderings, n images), the mean mu across the 3 levels in each ordering
+def replayOrderingsVectorized(gameFiles,nImages,seed,orderings):
+    records = loadGames(gameFiles)
+    orders = [getOrdering(len(records),seed,ordering) for ordering in orderings]
+    offsets = [np.int64(position*nImages) for position in range(len(orderings))]
+    leftIdx = np.concatenate([records['l'][order] + offset for order,offset in zip(orders,offsets)])
+    rightIdx = np.concatenate([records['r'][order] + offset for order,offset in zip(orders,offsets)])
+    outcomes = np.concatenate([records['outcome'][order] for order in orders])
+    tsArray = TSArray(np.arange(len(orderings)*nImages,dtype=np.int64))
+    with timeStage('rating_update',orderings=len(orderings),sequential=False) as timer:
+        performTSGames(tsArray,leftIdx,rightIdx,outcomes)
+        timer.count(games=len(outcomes))
+    return(calcAvgMu(tsArray).reshape(len(orderings),nImages))
+
+# calculate multinomial TS scores for the same siamese network model predictions in several independent,
+# seeded game orderings.  The csvs are parsed once into binary game files, and orderings are either replayed
+# with the compiled sequential kernel, spread across CPU workers, or replayed together in one vectorized pass.
+# The mean of each image across orderings is robust to the game order, and the spread measures how much the
+# game order changes the image's score
+# INPUTS:
+#    inputCSVs (string array) - absolute filepaths to csvs containing siamese perception model predictions for a
+#                               single perception and comparison level
+#    imageIndex (ImageIndex) - image index shared by all csvs
+#    scratchFolder (string) - folder where temporary game files are written
+#    nOrderings (int) - number of game orderings
+#    seed (int) - ensemble seed.  If None, a seed is drawn and stored in the result, so the ensemble can be reproduced
+#    sequential (boolean) - if true, replay each ordering with the compiled kernel in tsKernel, otherwise replay
+#                           all orderings in one vectorized pass
+#    nWorkers (int) - number of CPU workers for sequential replays.  Must be 1 inside a multiprocessing pool worker
+#    voteTable (int8 array) - lookup table for converting predictions into outcome codes (see tsPackage.createVoteTable)
+# OUTPUTS:
+#    TSEnsemble with the average mu of each image in each ordering
+def createEnsembleGameDict(inputCSVs,imageIndex,scratchFolder,nOrderings,seed=None,sequential=False,nWorkers=1,voteTable=VOTE_TABLE):
+    if(seed is None):
+        seed = np.random.SeedSequence().entropy
+    os.makedirs(scratchFolder,exist_ok=True)
+    gameFolder = tempfile.mkdtemp(dir=scratchFolder) + "/"
+    try:
+        gameFiles = writeGameFiles(inputCSVs,gameFolder,imageIndex,voteTable)
+        records = loadGames(gameFiles)
+        n = np.bincount(records['l'],minlength=len(imageIndex)) + np.bincount(records['r'],minlength=len(imageIndex))
+        del records
+        if not(sequential):
+            avgMu = replayOrderingsVectorized(gameFiles,len(imageIndex),seed,range(nOrderings))
+        else:
+            orderTuples = [(gameFiles,len(imageIndex),seed,ordering,True) for ordering in range(nOrderings)]
+            if(nWorkers>1):
+                pool = Pool(processes=min(nWorkers,nOrderings))
+                avgMu = np.stack(pool.map(replayOrdering,orderTuples))
+                pool.close()
+                pool.join()
+            else:
+                avgMu = np.stack([replayOrdering(orderTuple) for orderTuple in orderTuples])
+    finally:
+        shutil.rmtree(gameFolder,ignore_errors=True)
+    print("completed %i orderings with ensemble seed %s" %(nOrderings,str(seed)))
+    return(TSEnsemble(np.arange(len(imageIndex),dtype=np.int32),n.astype(np.int64),avgMu,seed))
+
+# calculate multinomial TS scores for several perceptions and comparison levels of the same MSA in a single
+# pass.  Every csv is scored against one shared image index and one MultiTSArray, instead of building a
+# separate set of image ids and TS states for each csv
+# INPUTS:
+#    inputCSVs (dictionary) - kv pairs of perception and comparison level names:absolute filepath, or list of
+#                             filepaths applied in order, of csvs containing siamese perception model predictions
+#    imageIndex (ImageIndex) - image index shared by all csvs
+#    scratchFolder (string) - optional.  If provided, predictions are streamed through an on-disk shuffle in
+#                             this folder (see createGameDictStreaming), otherwise each csv is loaded at once
+#    seed (int) - seed for the random game order.  Csv j of the perception and comparison level at position i
+#                 uses seed + j x number of perceptions and comparison levels + i.  If None, the order is not
+#                 reproducible
+#    sequential (boolean) - if true, apply games one at a time with the compiled kernel in tsKernel
+#    voteTable (int8 array) - lookup table for converting predictions into outcome codes (see tsPackage.createVoteTable)
+#    multiArray (MultiTSArray) - optional, states to update (e.g. loaded with loadTSState).  Perceptions and
+#                                comparison levels missing from inputCSVs are left unchanged
+#    skipCSVs (string array) - optional, csvs that were already applied to multiArray.  Skipped csvs keep their
+#                              position, so the remaining csvs use the same seeds as a run over all csvs
+#    pruning (dictionary) - optional, kv pairs of perception and comparison level names:tsPackage.GamePruning.
+#                           Games that add little information are skipped and counted separately for each name
+# OUTPUTS:
+#    MultiTSArray with one field for each perception and comparison level
+def createMultiGameDict(inputCSVs,imageIndex,scratchFolder=None,seed=None,sequential=False,voteTable=VOTE_TABLE,multiArray=None,skipCSVs=(),pruning=None):
+    if(multiArray is None):
+        multiArray = MultiTSArray(np.arange(len(imageIndex),dtype=np.int32),inputCSVs.keys())
+    for fieldPosition,name in enumerate(multiArray.names):
+        curCSVs = inputCSVs.get(name,[])
+        if(isinstance(curCSVs,str)):
+            curCSVs = [curCSVs]
+        nApplied = 0
+        for csvPosition,inputCSV in enumerate(curCSVs):
+            if(inputCSV in skipCSVs):
+                continue
+            curSeed = None if seed is None else seed + csvPosition*len(multiArray.names) + fieldPosition
+            curPruning = None if pruning is None else pruning[name]
+            if(scratchFolder is not None):
+                createGameDictStreaming(
+                    inputCSV,scratchFolder,seed=curSeed,imageIndex=imageIndex,
+                    sequential=sequential,voteTable=voteTable,tsArray=multiArray[name],pruning=curPruning
+                )
+            else:
+                createGameDict(inputCSV,imageIndex,curSeed,sequential,voteTable,multiArray[name],curPruning)
+            nApplied += 1
+        if(nApplied>0):
+            print("completed TS scores for %s" %(name))
+    return(multiArray)
+
+# save the multinomial TS states of a MultiTSArray as a binary snapshot (.npz), so later batches of predictions
+# can be applied without replaying earlier games.  Images are stored by filename rather than code, so a
+# snapshot can be resumed after the image index changes.  The file is written to a temporary path and renamed
+# once complete
+# INPUTS:
+#    multiArray (MultiTSArray) - multinomial TS states for all perceptions and comparison levels
+#    imageIndex (ImageIndex) - image index the image codes of multiArray refer to
+#    outFile (string) - absolute filepath of the snapshot
+#    appliedFiles (dictionary) - kv pairs of perception and comparison level names:dictionary of the
+#                                prediction csvs applied to the states and their fingerprints
+def saveTSState(multiArray,imageIndex,outFile,appliedFiles):
+    meta = {
+        'appliedFiles':appliedFiles,
+        'ratingArgs':{name:multiArray[name].ratingArgs for name in multiArray.names}
+    }
+    tempFile = getTempPath(outFile)
+    with open(tempFile,'wb') as f:
+        np.savez(f,names=np.asarray(imageIndex.names)[multiArray.imgIds],states=multiArray.states,meta=np.asarray(json.dumps(meta)))
+    commitTempFile(tempFile,outFile)
+
+# load a snapshot created by saveTSState into a MultiTSArray for the current image index.  Images added to the
+# index since the snapshot start from the TS priors, as do perceptions and comparison levels missing from
+# the snapshot
+# INPUTS:
+#    inFile (string) - absolute filepath of the snapshot.  If the file does not exist, all states are priors
+#    imageIndex (ImageIndex) - current image index for the MSA
+#    names (string array) - one name for each perception and comparison level
+#    sequential (boolean) - if false, states stored by the compiled kernel are converted to the mu and sigma
+#                           used by the vectorized engine
+# OUTPUTS:
+#    multiArray (MultiTSArray) - multinomial TS states for all perceptions and comparison levels
+#    appliedFiles (dictionary) - kv pairs of names:dictionary of prediction csvs applied to the states and
+#                                their fingerprints, see saveTSState
+def loadTSState(inFile,imageIndex,names,sequential=False):
+    multiArray = MultiTSArray(np.arange(len(imageIndex),dtype=np.int32),names)
+    if not(os.path.exists(inFile)):
+        return((multiArray,{}))
+    with np.load(inFile) as snapshot:
+        meta = json.loads(str(snapshot['meta']))
+        states = snapshot['states']
+        codes = imageIndex.encode(np.char.decode(snapshot['names'],'ascii'))
+    kept = codes>=0
+    appliedFiles = {}
+    for name in multiArray.names:
+        if(name not in states.dtype.names):
+            continue
+        multiArray.states[name][codes[kept]] = states[name][kept]
+        tsArray = multiArray[name]
+        tsArray.ratingArgs = meta['ratingArgs'][name]
+        if(tsArray.ratingArgs and not sequential):
+            tsArray.mu[:],tsArray.sigma[:] = tsKernel.ratingMoments(tsArray.mu,tsArray.sigma)
+            tsArray.ratingArgs = False
+        appliedFiles[name] = meta['appliedFiles'][name]
+    return((multiArray,appliedFiles))
+
+# convert the ensembles of several perceptions and comparison levels into a wide table of normalized TS scores,
+# in the same format as convertMultiToDF, and a table of the mean and spread of mu across orderings.  Scores are
+# the mean mu across orderings, scaled from 0 to 100 among the images compared in each csv.  Only images
+# compared in every csv are kept
+# INPUTS:
+#    ensembles (dictionary) - kv pairs of perception and comparison level names:TSEnsemble
+# OUTPUTS:
+#    scores (pandas dataframe) - img_id column and one normalized score column per perception and comparison level
+#    stability (pandas dataframe) - img_id column and <name>_mu_mean and <name>_mu_sd columns for each perception
+#                                   and comparison level
+def convertEnsemblesToDF(ensembles):
+    imgIds = next(iter(ensembles.values())).imgIds
+    scores = ps.DataFrame({'img_id':imgIds})
+    stability = ps.DataFrame({'img_id':imgIds})
+    compared = np.ones(len(imgIds),dtype=bool)
+    for name,ensemble in ensembles.items():
+        curCompared = ensemble.n>0
+        meanMu = ensemble.meanMu()
+        curScores = np.full(len(imgIds),np.nan)
+        curScores[curCompared] = min_max_scaling(meanMu[curCompared])*100
+        scores[name] = curScores
+        stability[name + "_mu_mean"] = meanMu
+        stability[name + "_mu_sd"] = ensemble.spreadMu()
+        compared &= curCompared
+    return((scores[compared].reset_index(drop=True),stability[compared].reset_index(drop=True)))
+
+# read the image filenames and applied prediction csvs of a snapshot created by saveTSState, without loading
+# the TS states
+# INPUTS:
+#    inFile (string) - absolute filepath of the snapshot
+# OUTPUTS:
+#    names (byte string array) - image filenames of the snapshot rows
+#    appliedFiles (dictionary) - kv pairs of names:dictionary of prediction csvs and their fingerprints
+def readTSStateFiles(inFile):
+    with np.load(inFile) as snapshot:
+        return((snapshot['names'],json.loads(str(snapshot['meta']))['appliedFiles']))
+
+# convert a MultiTSArray into a wide table with one normalized TS score column for each perception and
+# comparison level.  Scores are scaled from 0 to 100 among the images compared in each csv, and only images
+# compared in every csv are kept, the same as joining the single perception tables on image id
+# INPUTS:
+#    multiArray (MultiTSArray) - multinomial TS states for all perceptions and comparison levels
+# OUTPUTS:
+#    pandas dataframe with an img_id column and one column per perception and comparison level
+def convertMultiToDF(multiArray):
+    df = ps.DataFrame({'img_id':multiArray.imgIds})
+    compared = np.ones(len(multiArray),dtype=bool)
+    for name in multiArray.names:
+        tsArray = multiArray[name]
+        curCompared = tsArray.n>0
+        scores = np.full(len(multiArray),np.nan)
+        scores[curCompared] = min_max_scaling(calcAvgMu(tsArray)[curCompared])*100
+        df[name] = scores
+        compared &= curCompared
+    return(df[compared].reset_index(drop=True))
@@ -0,0 +1,461 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: compiled sequential multinomial TrueSkill kernel.  Applies siamese neural network model predictions
+#          one game at a time, in game order, with no per-game Python objects.  Each 1 vs 1 update repeats the
+#          floating point operations of the trueskill factor graph (rate_1vs1) in the same order, so results are
+#          bit-for-bit identical to the tsPackage.performTSGame loop for the same game order.
+# Note: ratings are stored as the mu and sigma arguments used to construct trueskill.Rating objects.  Rating
+#       objects store precision (pi) and precision adjusted mean (tau), so mu and sigma are converted the same
+#       way before each game and when scores are exported (see ratingMoments).
+
+# import dependencies
+from trueskill import global_env, calc_draw_margin
+from trueskill import DELTA
+import numpy as np
+import math
+import ctypes
+import ctypes.util
+
+POW_SYMBOL = "tskernel_libm_pow" # name of the C library pow in compiled code (see power)
+try:
+    from numba import njit
+    from numba.extending import intrinsic
+    from numba.core import cgutils, types
+    from llvmlite import ir
+    import llvmlite.binding as llvm
+    # LLVM rewrites pow(x,2.0) as x*x, which is not always identical to the C library pow called by python's
+    # ** operator.  The C library pow is registered under a name LLVM does not recognize, so it is not rewritten.
+    # Compiled functions refer to the symbol by name rather than by address, so they can be cached on disk
+    LIBM = ctypes.CDLL(ctypes.util.find_library('m') or ctypes.util.find_library('c'))
+    llvm.add_symbol(POW_SYMBOL,ctypes.cast(LIBM.pow,ctypes.c_void_p).value)
+
+    # call the C library pow from compiled functions
+    @intrinsic
+    def power(typingctx,x,y):
+        def codegen(context,builder,signature,args):
+            double = ir.DoubleType()
+            func = cgutils.get_or_insert_function(builder.module,ir.FunctionType(double,[double,double]),POW_SYMBOL)
+            x,y = [context.cast(builder,arg,argType,types.float64) for arg,argType in zip(args,signature.args)]
+            return(builder.call(func,[x,y]))
+        return(types.float64(x,y),codegen)
+except ImportError:
+    # without numba the kernel runs as plain python, with identical results but without the speedup
+    def njit(*args,**kwargs):
+        if(len(args)==1 and callable(args[0])):
+            return(args[0])
+        return(lambda func: func)
+    power = math.pow
+
+# define global constants
+TS_ENV = global_env() # trueskill environment used by rate_1vs1 in tsPackage
+BETA_SQUARED = TS_ENV.beta ** 2
+DYNAMIC = TS_ENV.tau
+DRAW_MARGIN = calc_draw_margin(TS_ENV.draw_probability,2,TS_ENV)
+MIN_DELTA = DELTA
+MAX_ITERATIONS = 10 # maximum number of message passing iterations in the trueskill factor graph
+PDF_SCALE = 1 / math.sqrt(2 * math.pi)
+SQRT2 = math.sqrt(2)
+
+# complementary error function, same approximation as the trueskill package
+@njit(cache=True)
+def erfc(x):
+    z = abs(x)
+    t = 1. / (1. + z / 2.)
+    r = t * math.exp(-z * z - 1.26551223 + t * (1.00002368 + t * (
+        0.37409196 + t * (0.09678418 + t * (-0.18628806 + t * (
+            0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (
+                -0.82215223 + t * 0.17087277
+            )))
+        )))
+    )))
+    if(x < 0):
+        return(2. - r)
+    return(r)
+
+# standard normal cumulative distribution function
+@njit(cache=True)
+def cdf(x):
+    return(0.5 * erfc(-x / SQRT2))
+
+# standard normal probability density function
+@njit(cache=True)
+def pdf(x):
+    return(PDF_SCALE * math.exp(-(power(x,2.0) / 2)))
+
+# mean update factor for a win
+@njit(cache=True)
+def vWin(diff,drawMargin):
+    x = diff - drawMargin
+    denom = cdf(x)
+    if(denom != 0):
+        return(pdf(x) / denom)
+    return(-x)
+
+# variance update factor for a win
+@njit(cache=True)
+def wWin(diff,drawMargin):
+    x = diff - drawMargin
+    v = vWin(diff,drawMargin)
+    w = v * (v + x)
+    if(0 < w and w < 1):
+        return(w)
+    raise FloatingPointError('Cannot calculate correctly, set backend to "mpmath"')
+
+# mean update factor for a tie
+@njit(cache=True)
+def vDraw(diff,drawMargin):
+    absDiff = abs(diff)
+    a, b = drawMargin - absDiff, -drawMargin - absDiff
+    denom = cdf(a) - cdf(b)
+    numer = pdf(b) - pdf(a)
+    v = a
+    if(denom != 0):
+        v = numer / denom
+    if(diff < 0):
+        return(-v)
+    return(v)
+
+# variance update factor for a tie
+@njit(cache=True)
+def wDraw(diff,drawMargin):
+    absDiff = abs(diff)
+    a, b = drawMargin - absDiff, -drawMargin - absDiff
+    denom = cdf(a) - cdf(b)
+    if(denom == 0):
+        raise FloatingPointError('Cannot calculate correctly, set backend to "mpmath"')
+    v = vDraw(absDiff,drawMargin)
+    return(power(v,2.0) + (a * pdf(a) - b * pdf(b)) / denom)
+
+# mean of a gaussian in precision form
+@njit(cache=True)
+def gaussMu(pi,tau):
+    if(pi == 0):
+        return(0.0)
+    return(tau / pi)
+
+# sum factor message for a single term with coefficient 1, given the precision and precision adjusted mean
+# of the term after removing the message it received from the sum factor
+@njit(cache=True)
+def singleMessage(pi,tau):
+    mu = 0.0 + gaussMu(pi,tau)
+    if(pi == 0):
+        piInv = math.inf
+    else:
+        piInv = 1.0 / pi
+    pi = 1. / piInv
+    return(pi,pi * mu)
+
+# sum factor message for two terms, given the precision and precision adjusted mean of each term after removing
+# the message it received from the sum factor
+@njit(cache=True)
+def pairMessage(pi1,tau1,coeff1,pi2,tau2,coeff2):
+    mu = 0.0 + coeff1 * gaussMu(pi1,tau1)
+    if(pi1 == 0):
+        piInv = math.inf
+    else:
+        piInv = coeff1 * coeff1 / pi1
+    mu += coeff2 * gaussMu(pi2,tau2)
+    if(piInv != math.inf):
+        if(pi2 == 0):
+            piInv = math.inf
+        else:
+            piInv += coeff2 * coeff2 / pi2
+    pi = 1. / piInv
+    return(pi,pi * mu)
+
+# convert the mu and sigma used to construct a trueskill.Rating into precision form, and pass messages down
+# through the prior, likelihood and team performance factors of the trueskill factor graph
+# OUTPUTS:
+#    piPrior, tauPrior - rating variable after the prior factor
+#    piPerf, tauPerf - performance variable after the likelihood factor
+#    piTeam, tauTeam - team performance variable after the sum factor
+@njit(cache=True)
+def downRating(mu,sigma,betaSquared,dynamic):
+    pi = power(sigma,-2.0)
+    tau = pi * mu
+    priorSigma = math.sqrt(power(math.sqrt(1 / pi),2.0) + power(dynamic,2.0))
+    piPrior = power(priorSigma,-2.0)
+    tauPrior = piPrior * gaussMu(pi,tau)
+    a = 1. / (1. + betaSquared * piPrior)
+    piPerf,tauPerf = a * piPrior,a * tauPrior
+    piTeam,tauTeam = singleMessage(piPerf,tauPerf)
+    return(piPrior,tauPrior,piPerf,tauPerf,piTeam,tauTeam)
+
+# pass messages from a team performance variable back up through the sum, likelihood and prior factors
+# INPUTS:
+#    piTeamDown, tauTeamDown - message the team performance variable received on the way down
+#    piTeam, tauTeam - team performance variable after the team difference layer
+# OUTPUTS:
+#    mu, sigma used to construct the updated trueskill.Rating
+@njit(cache=True)
+def upRating(piPrior,tauPrior,piPerf,tauPerf,piTeamDown,tauTeamDown,piTeam,tauTeam,betaSquared):
+    piUp,tauUp = singleMessage(piTeam - piTeamDown,tauTeam - tauTeamDown)
+    piPerfUp,tauPerfUp = piPerf + piUp,tauPerf + tauUp
+    piMsg,tauMsg = piPerfUp - piPerf,tauPerfUp - tauPerf
+    a = 1. / (1. + betaSquared * piMsg)
+    piRating,tauRating = piPrior + a * piMsg,tauPrior + a * tauMsg
+    if(piRating == 0):
+        return(0.0,math.inf)
+    return(tauRating / piRating,math.sqrt(1 / piRating))
+
+# 1 vs 1 trueskill update, bit-for-bit equivalent to trueskill.rate_1vs1 with the default backend
+# INPUTS:
+#    mu1, sigma1 (float) - rating of the first player (the winner unless drawn)
+#    mu2, sigma2 (float) - rating of the second player
+#    drawn (bool) - true if the game ended in a tie
+#    betaSquared, dynamic, drawMargin, minDelta (float) - trueskill environment parameters
+# OUTPUTS:
+#    updated mu1, sigma1, mu2, sigma2
+@njit(cache=True)
+def rate1vs1(mu1,sigma1,mu2,sigma2,drawn,betaSquared,dynamic,drawMargin,minDelta):
+
+    # rating, performance, and team performance layers
+    piPrior1,tauPrior1,piPerf1,tauPerf1,piTeamDown1,tauTeamDown1 = downRating(mu1,sigma1,betaSquared,dynamic)
+    piPrior2,tauPrior2,piPerf2,tauPerf2,piTeamDown2,tauTeamDown2 = downRating(mu2,sigma2,betaSquared,dynamic)
+
+    # team difference and truncate layers, iterate until messages converge
+    piDiff,tauDiff = 0.0,0.0
+    piSumMsg,tauSumMsg = 0.0,0.0
+    piTruncMsg,tauTruncMsg = 0.0,0.0
+    for iteration in range(MAX_ITERATIONS):
+        piNew,tauNew = pairMessage(piTeamDown1,tauTeamDown1,1.0,piTeamDown2,tauTeamDown2,-1.0)
+        piDiff = (piDiff - piSumMsg) + piNew
+        tauDiff = (tauDiff - tauSumMsg) + tauNew
+        piSumMsg,tauSumMsg = piNew,tauNew
+
+        piDiv = piDiff - piTruncMsg
+        tauDiv = tauDiff - tauTruncMsg
+        sqrtPi = math.sqrt(piDiv)
+        diff = tauDiv / sqrtPi
+        margin = drawMargin * sqrtPi
+        if(drawn):
+            v = vDraw(diff,margin)
+            w = wDraw(diff,margin)
+        else:
+            v = vWin(diff,margin)
+            w = wWin(diff,margin)
+        denom = (1. - w)
+        piNew = piDiv / denom
+        tauNew = (tauDiv + sqrtPi * v) / denom
+        piTruncMsg = (piNew + piTruncMsg) - piDiff
+        tauTruncMsg = (tauNew + tauTruncMsg) - tauDiff
+        piDelta = abs(piDiff - piNew)
+        if(piDelta == math.inf):
+            delta = 0.0
+        else:
+            delta = max(abs(tauDiff - tauNew),math.sqrt(piDelta))
+        piDiff,tauDiff = piNew,tauNew
+        if(delta <= minDelta):
+            break
+
+    # pass messages from the team difference variable up to both team performance variables
+    piUp1,tauUp1 = pairMessage(piDiff - piSumMsg,tauDiff - tauSumMsg,1.0,piTeamDown2,tauTeamDown2,1.0)
+    piTeam1,tauTeam1 = piTeamDown1 + piUp1,tauTeamDown1 + tauUp1
+    piUp2,tauUp2 = pairMessage(piTeam1 - piUp1,tauTeam1 - tauUp1,1.0,piDiff - piSumMsg,tauDiff - tauSumMsg,-1.0)
+    piTeam2,tauTeam2 = piTeamDown2 + piUp2,tauTeamDown2 + tauUp2
+
+    # pass messages from the team performance variables up to the rating variables
+    muNew1,sigmaNew1 = upRating(piPrior1,tauPrior1,piPerf1,tauPerf1,piTeamDown1,tauTeamDown1,piTeam1,tauTeam1,betaSquared)
+    muNew2,sigmaNew2 = upRating(piPrior2,tauPrior2,piPerf2,tauPerf2,piTeamDown2,tauTeamDown2,piTeam2,tauTeam2,betaSquared)
+    return(muNew1,sigmaNew1,muNew2,sigmaNew2)
+
+# convert a multinomial outcome code into the outcome for one level of the multinomial TS model
+# (see tsPackage.createVoteTable)
+# OUTPUTS:
+#    1 if the left image wins, -1 if the right image wins, 0 for a tie
+@njit(cache=True)
+def levelOutcome(outcome,level):
+    if(outcome > level):
+        return(1)
+    if(outcome < -level):
+        return(-1)
+    return(0)
+
+# apply a sequence of siamese network model predictions to multinomial TS ratings, one game at a time
+# INPUTS:
+#    leftIdx (int32 array) - row index of the left image for each game
+#    rightIdx (int32 array) - row index of the right image for each game
+#    outcomes (int8 array) - multinomial outcome codes (see tsPackage.createVoteTable)
+#    mu, sigma (float64 arrays) - shape (n images, 3), updated in place
+#    n (int64 array) - number of games played by each image, updated in place
+#    betaSquared, dynamic, drawMargin, minDelta (float) - trueskill environment parameters
+@njit(cache=True)
+def playGames(leftIdx,rightIdx,outcomes,mu,sigma,n,betaSquared,dynamic,drawMargin,minDelta):
+    for game in range(len(leftIdx)):
+        left = leftIdx[game]
+        right = rightIdx[game]
+        for level in range(3):
+            outcome = levelOutcome(outcomes[game],level)
+            if(outcome == -1):
+                mu[right,level],sigma[right,level],mu[left,level],sigma[left,level] = rate1vs1(
+                    mu[right,level],sigma[right,level],mu[left,level],sigma[left,level],
+                    False,betaSquared,dynamic,drawMargin,minDelta
+                )
+            else:
+                mu[left,level],sigma[left,level],mu[right,level],sigma[right,level] = rate1vs1(
+                    mu[left,level],sigma[left,level],mu[right,level],sigma[right,level],
+                    outcome == 0,betaSquared,dynamic,drawMargin,minDelta
+                )
+        n[left] += 1
+        n[right] += 1
+
+# convert the mu and sigma used to construct a trueskill.Rating into Rating.mu and Rating.sigma
+@njit(cache=True)
+def ratingMoment(mu,sigma):
+    pi = power(sigma,-2.0)
+    return(gaussMu(pi,pi * mu),math.sqrt(1 / pi))
+
+# mean sigma and mean trueskill match quality (trueskill.quality_1vs1) across the three levels of a game
+# INPUTS:
+#    mu, sigma (float64 arrays) - shape (n images, 3), mu and sigma used to construct the Rating objects
+#    left, right (int) - row index of the left and right image
+#    betaSquared (float) - trueskill environment parameter
+# OUTPUTS:
+#    leftSigma, rightSigma (float) - mean Rating.sigma of the left and right image
+#    quality (float) - mean match quality
+@njit(cache=True)
+def gameMoments(mu,sigma,left,right,betaSquared):
+    leftSigma = 0.0
+    rightSigma = 0.0
+    quality = 0.0
+    for level in range(3):
+        mu1,sigma1 = ratingMoment(mu[left,level],sigma[left,level])
+        mu2,sigma2 = ratingMoment(mu[right,level],sigma[right,level])
+        leftSigma += sigma1
+        rightSigma += sigma2
+        denom = 2 * betaSquared + power(sigma1,2.0) + power(sigma2,2.0)
+        quality += math.exp(-0.5 * power(mu1 - mu2,2.0) / denom) * math.sqrt(2 * betaSquared / denom)
+    return(leftSigma / 3.0,rightSigma / 3.0,quality / 3.0)
+
+# apply a sequence of siamese network model predictions to multinomial TS ratings, one game at a time, skipping
+# games that add little information (see tsPackage.GamePruning)
+# INPUTS:
+#    leftIdx, rightIdx, outcomes, mu, sigma, n - same as playGames.  n only counts games that updated the image
+#    minSigma (float) - images with a mean sigma below this value are no longer updated
+#    minQuality (float) - games with a mean match quality below this value are skipped
+#    skipped (int64 array) - length 3, incremented in place with the number of games skipped because both images
+#                            had converged, games skipped for low match quality, and image updates skipped because
+#                            one of the two images had converged
+#    betaSquared, dynamic, drawMargin, minDelta (float) - trueskill environment parameters
+@njit(cache=True)
+def playGamesPruned(leftIdx,rightIdx,outcomes,mu,sigma,n,minSigma,minQuality,skipped,betaSquared,dynamic,drawMargin,minDelta):
+    for game in range(len(leftIdx)):
+        left = leftIdx[game]
+        right = rightIdx[game]
+        leftSigma,rightSigma,quality = gameMoments(mu,sigma,left,right,betaSquared)
+        updateLeft = leftSigma >= minSigma
+        updateRight = rightSigma >= minSigma
+        if(not(updateLeft or updateRight)):
+            skipped[0] += 1
+            continue
+        if(quality < minQuality):
+            skipped[1] += 1
+            continue
+        if(not(updateLeft and updateRight)):
+            skipped[2] += 1
+        for level in range(3):
+            outcome = levelOutcome(outcomes[game],level)
+            if(outcome == -1):
+                muRight,sigmaRight,muLeft,sigmaLeft = rate1vs1(
+                    mu[right,level],sigma[right,level],mu[left,level],sigma[left,level],
+                    False,betaSquared,dynamic,drawMargin,minDelta
+                )
+            else:
+                muLeft,sigmaLeft,muRight,sigmaRight = rate1vs1(
+                    mu[left,level],sigma[left,level],mu[right,level],sigma[right,level],
+                    outcome == 0,betaSquared,dynamic,drawMargin,minDelta
+                )
+            if(updateLeft):
+                mu[left,level],sigma[left,level] = muLeft,sigmaLeft
+            if(updateRight):
+                mu[right,level],sigma[right,level] = muRight,sigmaRight
+        if(updateLeft):
+            n[left] += 1
+        if(updateRight):
+            n[right] += 1
+
+# assign each game to a round such that no image appears more than once per round and every image
+# plays its games in the original game order.  Used by the vectorized engine in tsArrayPackage
+# INPUTS:
+#    leftIdx (int array) - row index of the left image for each game
+#    rightIdx (int array) - row index of the right image for each game
+#    nImages (int) - number of images in the TSArray
+# OUTPUTS:
+#    rounds (int array) - round number for each game
+def assignRounds(leftIdx,rightIdx,nImages):
+    rounds = np.empty(len(leftIdx),dtype=np.int64)
+    lastRound = np.full(nImages,-1,dtype=np.int64)
+    fillRounds(np.ascontiguousarray(leftIdx,dtype=np.int64),np.ascontiguousarray(rightIdx,dtype=np.int64),lastRound,rounds)
+    return(rounds)
+
+# game loop used by assignRounds, written to the output array
+@njit(cache=True)
+def fillRounds(leftIdx,rightIdx,lastRound,rounds):
+    for gameIndex in range(len(leftIdx)):
+        left,right = leftIdx[gameIndex],rightIdx[gameIndex]
+        curRound = max(lastRound[left],lastRound[right]) + 1
+        lastRound[left] = curRound
+        lastRound[right] = curRound
+        rounds[gameIndex] = curRound
+
+# convert stored rating arguments into the mu and sigma reported by trueskill.Rating objects
+# INPUTS:
+#    mu, sigma (float arrays) - mu and sigma used to construct the Rating objects
+# OUTPUTS:
+#    mu, sigma (float arrays) - Rating.mu and Rating.sigma
+def ratingMoments(mu,sigma):
+    ratingMu = np.empty(np.shape(mu),dtype=np.float64)
+    ratingSigma = np.empty(np.shape(sigma),dtype=np.float64)
+    convertRatingArgs(np.ravel(mu),np.ravel(sigma),ratingMu.reshape(-1),ratingSigma.reshape(-1))
+    return(ratingMu,ratingSigma)
+
+# element-wise conversion used by ratingMoments, written to the output arrays
+@njit(cache=True)
+def convertRatingArgs(mu,sigma,ratingMu,ratingSigma):
+    for index in range(len(mu)):
+        pi = power(sigma[index],-2.0)
+        ratingMu[index] = gaussMu(pi,pi * mu[index])
+        ratingSigma[index] = math.sqrt(1 / pi)
+
+# update a TSArray with a sequence of siamese network model predictions, one game at a time and in game order
+# INPUTS:
+#    tsArray (TSArray) - multinomial TS states for all images
+#    leftIdx (int array) - row index of the left image for each game
+#    rightIdx (int array) - row index of the right image for each game
+#    outcomes (int8 array) - multinomial outcome codes (see tsPackage.createVoteTable)
+#    pruning (tsPackage.GamePruning) - optional.  If provided, games that add little information are skipped
+#                                      and counted in pruning
+# OUTPUTS:
+#    tsArray, after updating with all games
+def performTSGames(tsArray,leftIdx,rightIdx,outcomes,pruning=None):
+    leftIdx = np.ascontiguousarray(leftIdx,dtype=np.int32)
+    rightIdx = np.ascontiguousarray(rightIdx,dtype=np.int32)
+    outcomes = np.ascontiguousarray(outcomes,dtype=np.int8)
+    if(pruning is None):
+        playGames(leftIdx,rightIdx,outcomes,tsArray.mu,tsArray.sigma,tsArray.n,BETA_SQUARED,DYNAMIC,DRAW_MARGIN,MIN_DELTA)
+    else:
+        skipped = np.zeros(3,dtype=np.int64)
+        minSigma,minQuality = pruning.thresholds()
+        playGamesPruned(
+            leftIdx,rightIdx,outcomes,tsArray.mu,tsArray.sigma,tsArray.n,minSigma,minQuality,skipped,
+            BETA_SQUARED,DYNAMIC,DRAW_MARGIN,MIN_DELTA
+        )
+        pruning.addCounts(len(leftIdx),*skipped.tolist())
+    tsArray.ratingArgs = True
+    return(tsArray)
+
+# compile every kernel function for the arrays of a TSArray, or load them from the on-disk cache, by playing a
+# single game.  Lets benchmarks time compilation separately from the games
+def warmUp():
+    leftIdx,rightIdx = np.zeros(1,dtype=np.int32),np.ones(1,dtype=np.int32)
+    outcomes = np.ones(1,dtype=np.int8)
+    mu = np.full((2,3),TS_ENV.mu,dtype=np.float64)
+    sigma = np.full((2,3),TS_ENV.sigma,dtype=np.float64)
+    n = np.zeros(2,dtype=np.int64)
+    playGames(leftIdx,rightIdx,outcomes,mu,sigma,n,BETA_SQUARED,DYNAMIC,DRAW_MARGIN,MIN_DELTA)
+    playGamesPruned(
+        leftIdx,rightIdx,outcomes,mu,sigma,n,0.0,0.0,np.zeros(3,dtype=np.int64),
+        BETA_SQUARED,DYNAMIC,DRAW_MARGIN,MIN_DELTA
+    )
+    ratingMoments(mu,sigma)
+    assignRounds(leftIdx,rightIdx,2)
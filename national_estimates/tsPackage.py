@@ -7,6 +7,14 @@
 from trueskill import Rating, quality_1vs1, rate_1vs1
 import numpy as np
 import pandas as ps
+import os
+from telemetry import timeStage
+
+# define global constants
+# vote thresholds, in order: right image strongly wins below the first value, moderately wins below the second, slightly wins
+# below the third, tie at the third, left image slightly wins above the third, moderately wins above the fourth, strongly wins above the fifth
+VOTE_THRESHOLDS = [16,33,50,67,84]
+OUTCOME_CODES = {'lose':-1,'tie':0,'win':1} # integer codes for the outcome of a single level, from the perspective of the left image
 
 # Custom class for updating true skill image scores by processing a single siamese neural network model prediction.
 # Note: this is a multinomial trueskill algorithm which differs from the original trueskill agorithm (https://www.nature.com/articles/s41370-022-00489-8).
@@ -28,6 +36,83 @@ class TS:
         return((self.slight.sigma + self.mod.sigma + self.strong.sigma)/3.0)
     
 
+# Custom class for convergence-aware game pruning.  Games are no longer applied to images whose mean sigma across
+# the 3 levels has dropped below minSigma, and games whose mean match quality (trueskill.quality_1vs1) across the
+# 3 levels is below minQuality are skipped, since the outcome of a lopsided game is already predicted by the
+# current scores.  Counts skipped games so accuracy can be traded for throughput on purpose (see
+# tsArrayPackage.calcRankAgreement)
+class GamePruning:
+
+    # initialize pruning thresholds and counters
+    # INPUTS:
+    #    minSigma (float) - images with a mean sigma below this value are converged.  If None, images never converge
+    #    minQuality (float) - games with a mean match quality below this value are skipped.  If None, games are never
+    #                         skipped for low match quality
+    def __init__(self,minSigma=None,minQuality=None):
+        self.minSigma = minSigma
+        self.minQuality = minQuality
+        self.games = 0 # games offered to the TS engine
+        self.skippedConverged = 0 # games skipped because both images had converged
+        self.skippedQuality = 0 # games skipped for low match quality
+        self.frozenUpdates = 0 # games that only updated one image, because the other image had converged
+
+    # thresholds as floats, where None is replaced with a value that never prunes
+    def thresholds(self):
+        minSigma = -1.0 if self.minSigma is None else float(self.minSigma)
+        minQuality = -1.0 if self.minQuality is None else float(self.minQuality)
+        return(minSigma,minQuality)
+
+    # add counts from a batch of games
+    def addCounts(self,games,skippedConverged,skippedQuality,frozenUpdates):
+        self.games += int(games)
+        self.skippedConverged += int(skippedConverged)
+        self.skippedQuality += int(skippedQuality)
+        self.frozenUpdates += int(frozenUpdates)
+
+    # decide how to apply a game between two multinomial TS objects, and count the decision
+    # OUTPUTS:
+    #    updateLeft, updateRight (boolean) - true if the left or right image should be updated
+    def checkGame(self,ts1,ts2):
+        minSigma,minQuality = self.thresholds()
+        self.games +=1
+        updateLeft = ts1.calcAvgTSSigma() >= minSigma
+        updateRight = ts2.calcAvgTSSigma() >= minSigma
+        if(not(updateLeft or updateRight)):
+            self.skippedConverged +=1
+            return(False,False)
+        if(calcMatchQuality(ts1,ts2) < minQuality):
+            self.skippedQuality +=1
+            return(False,False)
+        if(not(updateLeft and updateRight)):
+            self.frozenUpdates +=1
+        return(updateLeft,updateRight)
+
+    # total number of skipped games
+    def skippedGames(self):
+        return(self.skippedConverged + self.skippedQuality)
+
+    # summary of the pruning thresholds and counts
+    def summarize(self):
+        return({
+            'minSigma':self.minSigma,
+            'minQuality':self.minQuality,
+            'games':self.games,
+            'skippedGames':self.skippedGames(),
+            'skippedConverged':self.skippedConverged,
+            'skippedQuality':self.skippedQuality,
+            'frozenUpdates':self.frozenUpdates,
+            'skippedFraction':self.skippedGames()/self.games if self.games>0 else 0.0
+        })
+
+# calculate the mean trueskill match quality across the 3 levels of a multinomial TS comparison
+# INPUTS:
+#    ts1 (TS object) - multinomial TS object for left image
+#    ts2 (TS object) - multinomial TS object for right image
+# OUTPUTS:
+#    match quality, between 0 and 1.  Low values indicate the outcome is already predicted by the current scores
+def calcMatchQuality(ts1,ts2):
+    return((quality_1vs1(ts1.slight,ts2.slight) + quality_1vs1(ts1.mod,ts2.mod) + quality_1vs1(ts1.strong,ts2.strong))/3.0)
+
 # using the set of images listed in an input dataset, create a dictionary for storing and updating 
 # image trueskill perception scores
 # INPUTS:
@@ -50,29 +135,36 @@ def createPerceptionDict(dataset):
 
 # given a dictionary with TS objects, transform the dictionary and TS contents into a dataframe format
 # INPUTS:
-#    tsDict (dictionary) - contains kv pairs of image ids:TS objects
+#    tsDict (dictionary) - contains kv pairs of image ids:TS objects, or a tsArrayPackage.TSArray
+#    scoreName (string) - optional, name of a column of mu normalized from 0 to 100 (e.g. 'beauty_city')
+#    comparedOnly (boolean) - if true, only images with at least one game are kept
 # OUTPUTS:
 #    df (pandas dataframe) - contents of the input dictionary transformed into a pandas dataframe format
-def convertDictToDF(tsDict):
+def convertDictToDF(tsDict,scoreName=None,comparedOnly=False):
 
+    # array-backed states export their columns directly.  TS objects are read one at a time into preallocated
     # arrays, one array for each column in the output data frame
-    imgId,mu,sigma,n = [],[],[],[]
-
-    # for each TS class object, extract the contents of  the object and store in the temporary arrays
-    for key in list(tsDict.keys()):
-        curTS = tsDict[key]
-        mu.append(curTS.calcAvgTSMean())
-        sigma.append(curTS.calcAvgTSSigma())
-        imgId.append(key)
-        n.append(curTS.n)
+    if(hasattr(tsDict,'exportColumns')):
+        imgId,mu,sigma,n = tsDict.exportColumns()
+    else:
+        curTS = list(tsDict.values())
+        imgId = np.array(list(tsDict.keys()),dtype=object)
+        mu = np.fromiter((ts.calcAvgTSMean() for ts in curTS),dtype=np.float64,count=len(curTS))
+        sigma = np.fromiter((ts.calcAvgTSSigma() for ts in curTS),dtype=np.float64,count=len(curTS))
+        n = np.fromiter((ts.n for ts in curTS),dtype=np.int64,count=len(curTS))
+    if(comparedOnly):
+        compared = n>0
+        imgId,mu,sigma,n = imgId[compared],mu[compared],sigma[compared],n[compared]
 
-    # create the dataframe using the temporary arrays
+    # create the dataframe using the column arrays
     df = ps.DataFrame({
         'mu':mu,
         'sigma':sigma,
         'img_id':imgId,
         'n':n
-    })
+    },copy=False)
+    if(scoreName is not None):
+        df[scoreName] = min_max_scaling(mu)*100
     return(df)
 
 # given a result from an image comparison, update TS scores for a single level in the multinomial TS model
@@ -119,22 +211,23 @@ def updateScores(ts1,ts2,outcomes):
 # given a siamese perception model prediction, convert into a multinomial outcome to update the multinomial TS scores
 # INPUTS:
 #    vote (int) - value between 0 to 100, indicating which image won and the extent to which the image won
+#    thresholds (int array) - vote thresholds separating strong, moderate, and slight wins (see VOTE_THRESHOLDS)
 # OUTPUTS:
 #    string array, with one outcome for each level in the multinomial TS model
-def convertVoteToOutcome(vote):
+def convertVoteToOutcome(vote,thresholds=VOTE_THRESHOLDS):
     vote = int(vote)
 
     # tie
-    if(vote==50):
+    if(vote==thresholds[2]):
         return(['tie','tie','tie'])
     
     # right image wins
-    if(vote<50):
+    if(vote<thresholds[2]):
         # right image strongly wins
-        if(vote<16):
+        if(vote<thresholds[0]):
             return(['lose','lose','lose'])
         # right image moderately wins
-        if(vote<33):
+        if(vote<thresholds[1]):
             return(['lose','lose','tie'])
         # right image slightly wins
         return(['lose','tie','tie'])
@@ -142,25 +235,77 @@ def convertVoteToOutcome(vote):
     # left image wins
     else:
         # left image strongly wins
-        if(vote>84):
+        if(vote>thresholds[4]):
             return(['win','win','win'])
         # left image moderately wins
-        if(vote>67):
+        if(vote>thresholds[3]):
             return(['win','win','tie'])
         # left image slightly wins
         return(['win','tie','tie'])
 
+# create a lookup table that converts every possible siamese perception model prediction (0 to 100) into a
+# multinomial outcome code.  The code is the number of levels won by the left image (1 to 3), or minus the number
+# of levels won by the right image (-1 to -3), and 0 for a tie.  A level is won if the absolute value of the code
+# is greater than the level index (0: slight, 1: moderate, 2: strong), otherwise the level is a tie
+# INPUTS:
+#    thresholds (int array) - vote thresholds separating strong, moderate, and slight wins (see VOTE_THRESHOLDS)
+# OUTPUTS:
+#    voteTable (int8 array) - 101 outcome codes, indexed by vote
+def createVoteTable(thresholds=VOTE_THRESHOLDS):
+    if(list(thresholds) != sorted(thresholds)):
+        raise ValueError("vote thresholds must be in increasing order")
+    votes = np.arange(101)
+    voteTable = np.zeros(101,dtype=np.int8)
+    for threshold in thresholds[0:3]:
+        voteTable[votes<threshold] -=1
+    for threshold in thresholds[2:5]:
+        voteTable[votes>threshold] +=1
+    return(voteTable)
+
+VOTE_TABLE = createVoteTable()
+
+# convert a column of siamese perception model predictions into multinomial outcome codes using a vote table
+# INPUTS:
+#    votes (int array) - values between 0 to 100, indicating which image won and the extent to which the image won
+#    voteTable (int8 array) - lookup table created by createVoteTable
+# OUTPUTS:
+#    int8 array of outcome codes, one for each vote
+def convertVotesToOutcomes(votes,voteTable=VOTE_TABLE):
+    votes = np.clip(np.asarray(votes).astype(np.int64),0,100)
+    return(voteTable[votes])
+
+# convert multinomial outcome codes into OUTCOME_CODES for a single level of the multinomial model
+# INPUTS:
+#    outcomes (int8 array) - multinomial outcome codes created by convertVotesToOutcomes
+#    level (int) - level index (0: slight, 1: moderate, 2: strong)
+# OUTPUTS:
+#    int8 array, -1 if the left image loses, 0 for a tie, and 1 if the left image wins
+def levelOutcomes(outcomes,level):
+    return(np.where(np.abs(outcomes)>level,np.sign(outcomes),0).astype(np.int8))
+
 # given a single record from the dataset of siamese perception model predictions, upate TS scores for the two images used as model inputs
 # INPUTS:
 #    TS_Dict (dictionary) - contains multinomial TS objects for all images in the image dataset
 #    id1 (string) - image id for the left image in the siamese network
 #    id2 (string) - image id for the right image in the siamese network
 #    score (int) - siamese model prediction for which image won, and by how much
+#    pruning (GamePruning) - optional.  If provided, games that add little information are skipped and counted in pruning
 # OUTPUTS:
 #    TS_Dict, after updating the TS objects for the two image in the siamese network comparison
-def performTSGame(TS_Dict,id1,id2,score):
+def performTSGame(TS_Dict,id1,id2,score,pruning=None):
     outcome = convertVoteToOutcome(score)
-    ts1,ts2 = updateScores(TS_Dict[id1],TS_Dict[id2],outcome)
+    if(pruning is None):
+        ts1,ts2 = updateScores(TS_Dict[id1],TS_Dict[id2],outcome)
+    else:
+        updateLeft,updateRight = pruning.checkGame(TS_Dict[id1],TS_Dict[id2])
+        if(not(updateLeft or updateRight)):
+            return(TS_Dict)
+        # ratings are immutable, so the state of a converged image can be restored after the update
+        frozen = TS_Dict[id2] if updateLeft else TS_Dict[id1]
+        frozenState = (frozen.slight,frozen.mod,frozen.strong,frozen.n)
+        ts1,ts2 = updateScores(TS_Dict[id1],TS_Dict[id2],outcome)
+        if(not(updateLeft and updateRight)):
+            frozen.slight,frozen.mod,frozen.strong,frozen.n = frozenState
     TS_Dict[id1] = ts1
     TS_Dict[id2] = ts2
     return(TS_Dict)
@@ -178,14 +323,21 @@ def min_max_scaling(series):
 # for each image using the siamese model predictions.
 # INPUTS:
 #    inputCSV (string) - absolute filepath to csv containing siamese perception model predictions
+#    seed (int) - seed for the random record order.  If None, the order is not reproducible
+#    pruning (GamePruning) - optional.  If provided, games that add little information are skipped and counted in pruning
 # OUTPUTS:
 #    dictionary of multinomial TS scores based on the siamese model predictions
-def createGameDict(inputCSV):
+def createGameDict(inputCSV,seed=None,pruning=None):
 
     # load dataset into memory and randomize the record order.  TS is a state-dependent model, so
     # randomization is important to avoid unforseen biases in record order
-    testPerceptions = ps.read_csv(inputCSV)
-    testPerceptions = testPerceptions.sample(frac=1).reset_index(drop=True)
+    inputName = os.path.basename(inputCSV)
+    with timeStage('parse',file=inputName) as timer:
+        testPerceptions = ps.read_csv(inputCSV)
+        timer.count(rows=len(testPerceptions))
+    with timeStage('shuffle',file=inputName) as timer:
+        testPerceptions = testPerceptions.sample(frac=1,random_state=seed).reset_index(drop=True)
+        timer.count(rows=len(testPerceptions))
     # reduce the dataset ram footprint to just the necessary information
     testPerceptions['l_id'] = testPerceptions['l_img'].str[:]
     testPerceptions['r_id'] = testPerceptions['r_img'].str[:]
@@ -194,9 +346,11 @@ def createGameDict(inputCSV):
 
     # create a mutlinomial TS dictionary, and update the dictionary with the siamese perception model predictions
     imgDict = createPerceptionDict(testPerceptions)
-    for rowIndex in range(testPerceptions.count()[0]):
-        curRow = testPerceptions.iloc[rowIndex]
-        if(rowIndex%100000==0):
-            print(rowIndex)
-        imgDict = performTSGame(imgDict,curRow['l_id'],curRow['r_id'],curRow['pred'])
+    with timeStage('rating_update',file=inputName,sequential=True) as timer:
+        for rowIndex in range(testPerceptions.count()[0]):
+            curRow = testPerceptions.iloc[rowIndex]
+            if(rowIndex%100000==0):
+                print(rowIndex)
+            imgDict = performTSGame(imgDict,curRow['l_id'],curRow['r_id'],curRow['pred'],pruning)
+        timer.count(games=len(testPerceptions))
     return(imgDict)
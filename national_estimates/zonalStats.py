@@ -0,0 +1,284 @@
+# Author: Andrew Larkin
+# Date Created: Oct 18th, 2026
+# Summary: census tract averages of the national perception rasters.  Tract polygons are rasterized once onto
+#          the grid of the perception rasters as int32 zone ids, and the zone grid is cached as a tiled GeoTIFF
+#          next to a table of zone ids and tract GEOIDs.  The mean, count, and standard deviation of every tract
+#          are then calculated for every raster on the same grid in one streaming pass over the tiles: each tile
+#          of the zone grid is read once, and the values of all rasters in the tile are reduced with bincount
+#          sums over the tracts present in the tile.  Tiles are processed in parallel by a process pool.
+
+# import dependencies
+import numpy as np
+import pandas as ps
+import hashlib
+import json
+import os
+from multiprocessing import Pool
+import rasterio
+from rasterio.features import rasterize
+from rasterio.warp import transform_geom
+from rasterio.windows import Window
+from pipelineManifest import createTaskKey, isTaskComplete, recordTaskComplete, getTempPath, commitTempFile, MANIFEST_FILENAME
+from tableStorage import writeTable, getTablePath, DEFAULT_FORMAT
+from telemetry import timeStage
+from rasterStorage import getGrid, getTileWindows, getSource, closeSources
+try:
+    # tract polygons can also be read from GeoJSON without fiona
+    import fiona
+except ImportError:
+    fiona = None
+
+# define global constants
+PARENT_FOLDER = "insert absolute folderpath where perception rasters are stored here"
+RASTER_FOLDER = PARENT_FOLDER + "PerceptionRasters/" # int rasters created by convertPerceptionPointsToRaster
+TRACT_FILE = PARENT_FOLDER + "Tracts/us_census_tracts.shp" # census tract polygons, e.g. TIGER/Line tracts for all states
+TRACT_ID_FIELD = 'GEOID'
+ZONE_FOLDER = PARENT_FOLDER + "TractZones/" # cached tract zone grids, one per raster grid
+OUT_BASE = PARENT_FOLDER + "tract_perceptions" # tract averages, without file extension
+MANIFEST_FILE = PARENT_FOLDER + MANIFEST_FILENAME # tracks completed tasks so interrupted runs resume where they stopped
+STORAGE_FORMAT = DEFAULT_FORMAT # format of the tract averages table, 'parquet' (requires pyarrow) or 'csv'
+YEARS = [2008,2012,2016,2020]
+OUTCOMES = ['be_ci','be_ct','na_ci','na_ct','re_ci','re_ct','sw_ci','sw_ct','sc_ci','sc_ct']
+CRS = 'EPSG:4326' # coordinate system of the perception rasters, tract polygons are transformed into it
+NO_ZONE = 0 # zone id of cells whose center is not inside a tract.  Tracts have zone ids 1 to n tracts
+TILE_SIZE = 2048 # width and height of the tiles processed at a time, a multiple of the GeoTIFF tile size
+BLOCK_SIZE = 512 # GeoTIFF tile width and height of the zone grid, matches the perception rasters
+COMPRESSION = 'deflate'
+N_WORKERS = 8 # number of CPU workers that process tiles
+STATISTICS = ['count','sum','sumSquares'] # sums accumulated for each tract and raster
+
+# read census tract polygons and transform them into the coordinate system of the perception rasters
+# INPUTS:
+#    tractFile (string) - absolute filepath of a shapefile or GeoPackage (requires fiona), or a GeoJSON file
+#    idField (string) - tract id field
+# OUTPUTS:
+#    list of (tract id, GeoJSON-like geometry) tuples
+def readTracts(tractFile,idField=TRACT_ID_FIELD):
+    if(tractFile.endswith('.geojson') or tractFile.endswith('.json')):
+        with open(tractFile) as f:
+            collection = json.load(f)
+        # GeoJSON coordinates are always WGS 1984
+        return([(str(feature['properties'][idField]),feature['geometry']) for feature in collection['features'] if feature['geometry'] is not None])
+    if(fiona is None):
+        raise ImportError("fiona is required to read %s, or convert the tracts to GeoJSON" %(tractFile))
+    tracts = []
+    with fiona.open(tractFile) as src:
+        for feature in src:
+            if(feature['geometry'] is None):
+                continue
+            tracts.append((str(feature['properties'][idField]),transform_geom(src.crs,CRS,feature['geometry'])))
+    return(tracts)
+
+# get the bounding box of a polygon or multipolygon
+# INPUTS:
+#    geometry (dictionary) - GeoJSON-like geometry
+# OUTPUTS:
+#    tuple of (xmin, ymin, xmax, ymax)
+def getBounds(geometry):
+    rings = geometry['coordinates'] if geometry['type']=='Polygon' else [ring for polygon in geometry['coordinates'] for ring in polygon]
+    coords = np.concatenate([np.asarray(ring,dtype=np.float64)[:,:2] for ring in rings])
+    return((coords[:,0].min(),coords[:,1].min(),coords[:,0].max(),coords[:,1].max()))
+
+# get the filepaths of the cached zone grid of a raster grid.  Each year of perception rasters has its own
+# extent, so each grid has its own zone grid
+# INPUTS:
+#    grid (tuple) - created by getGrid
+#    zoneFolder (string) - absolute folderpath of the cached zone grids
+# OUTPUTS:
+#    tuple of (zone grid GeoTIFF, csv of zone ids and tract ids)
+def getZoneFiles(grid,zoneFolder=ZONE_FOLDER):
+    gridName = hashlib.md5(repr(grid).encode('utf-8')).hexdigest()[:12]
+    return((zoneFolder + "tract_zones_" + gridName + ".tif",zoneFolder + "tract_zones_" + gridName + ".csv"))
+
+# rasterize tract polygons onto a grid as int32 zone ids, one tile at a time so the national grid never has to
+# fit in memory.  Cells are assigned to the tract that contains the cell center, the same as zonal statistics
+# in ArcGIS.  Tracts smaller than a cell may not contain any cell center and are left out
+# INPUTS:
+#    tracts (list of tuples) - (tract id, geometry) tuples created by readTracts
+#    grid (tuple) - created by getGrid
+#    outFile (string) - absolute filepath of the zone grid GeoTIFF
+#    tableFile (string) - absolute filepath of the csv of zone ids and tract ids
+def createZoneGrid(tracts,grid,outFile,tableFile):
+    crs,transform,width,height = grid
+    bounds = np.array([getBounds(geometry) for tractId,geometry in tracts]).reshape(-1,4)
+    tempFile = getTempPath(outFile)
+    with timeStage('zone_grid') as timer, rasterio.open(
+        tempFile,'w',driver='GTiff',width=width,height=height,count=1,dtype='int32',nodata=NO_ZONE,
+        crs=crs,transform=transform,tiled=True,blockxsize=BLOCK_SIZE,blockysize=BLOCK_SIZE,
+        compress=COMPRESSION,sparse_ok=True,BIGTIFF='IF_SAFER'
+    ) as dst:
+        for colOff,rowOff,tileWidth,tileHeight in getTileWindows(width,height,TILE_SIZE):
+            window = Window(colOff,rowOff,tileWidth,tileHeight)
+            xmin,ymax = transform*(colOff,rowOff)
+            xmax,ymin = transform*(colOff + tileWidth,rowOff + tileHeight)
+            inTile = np.flatnonzero((bounds[:,0]<=xmax) & (bounds[:,2]>=xmin) & (bounds[:,1]<=ymax) & (bounds[:,3]>=ymin))
+            if(len(inTile)==0):
+                continue
+            zones = rasterize(
+                [(tracts[index][1],index + 1) for index in inTile],out_shape=(tileHeight,tileWidth),
+                transform=rasterio.windows.transform(window,transform),fill=NO_ZONE,dtype='int32'
+            )
+            if(zones.any()):
+                dst.write(zones,1,window=window)
+            timer.count(tiles=1)
+    commitTempFile(tempFile,outFile)
+    zoneTable = ps.DataFrame({'zone':np.arange(1,len(tracts) + 1,dtype=np.int32),'tractId':[tractId for tractId,geometry in tracts]})
+    tempTable = getTempPath(tableFile)
+    zoneTable.to_csv(tempTable,index=False)
+    commitTempFile(tempTable,tableFile)
+
+# get the zone grid of a raster grid, creating it if it does not exist or the tract polygons changed since it
+# was created
+# INPUTS:
+#    grid (tuple) - created by getGrid
+#    tractFile (string) - absolute filepath of the tract polygons
+#    zoneFolder (string) - absolute folderpath of the cached zone grids
+#    tracts (list of tuples) - optional, tracts already read from tractFile
+# OUTPUTS:
+#    tuple of (zone grid GeoTIFF, pandas dataframe of zone ids and tract ids)
+def loadZoneGrid(grid,tractFile=TRACT_FILE,zoneFolder=ZONE_FOLDER,tracts=None):
+    zoneFile,tableFile = getZoneFiles(grid,zoneFolder)
+    taskKey = createTaskKey('tract_zones',label=os.path.basename(zoneFile))
+    if not(isTaskComplete(MANIFEST_FILE,taskKey,[tractFile],[zoneFile,tableFile])):
+        os.makedirs(zoneFolder,exist_ok=True)
+        createZoneGrid(tracts if tracts is not None else readTracts(tractFile),grid,zoneFile,tableFile)
+        recordTaskComplete(MANIFEST_FILE,taskKey,[tractFile],[zoneFile,tableFile])
+        print("created tract zone grid %s" %(zoneFile))
+    return((zoneFile,ps.read_csv(tableFile,dtype={'tractId':str})))
+
+# calculate the count, sum, and sum of squares of every raster for each tract in one tile.  Called by pool
+# workers.  Rasters without data in the tile are skipped
+# INPUTS:
+#    tileTuple (tuple) - (zone grid GeoTIFF, raster filepaths, (colOff, rowOff, width, height) of the tile)
+# OUTPUTS:
+#    tuple of (int32 array of the zones in the tile, float64 array of sums with shape (n rasters, 3, n zones)),
+#    or None if the tile contains no tracts
+def processTile(tileTuple):
+    zoneFile,inFiles,(colOff,rowOff,width,height) = tileTuple
+    window = Window(colOff,rowOff,width,height)
+    zones = getSource(zoneFile).read(1,window=window).ravel()
+    inZone = np.flatnonzero(zones!=NO_ZONE)
+    if(len(inZone)==0):
+        return(None)
+    tileZones,localZones = np.unique(zones[inZone],return_inverse=True)
+    sums = np.zeros((len(inFiles),len(STATISTICS),len(tileZones)))
+    for index,inFile in enumerate(inFiles):
+        src = getSource(inFile)
+        values = src.read(1,window=window).ravel()[inZone].astype(np.float64)
+        valid = ~np.isnan(values)
+        if(src.nodata is not None):
+            valid &= values!=src.nodata
+        if not(valid.any()):
+            continue
+        zoneIndex,values = localZones[valid],values[valid]
+        sums[index,0] = np.bincount(zoneIndex,minlength=len(tileZones))
+        sums[index,1] = np.bincount(zoneIndex,weights=values,minlength=len(tileZones))
+        sums[index,2] = np.bincount(zoneIndex,weights=values*values,minlength=len(tileZones))
+    return((tileZones,sums))
+
+# calculate the mean, count, and population standard deviation of each tract for several rasters on the same
+# grid, in one pass over the tiles of the zone grid
+# INPUTS:
+#    zoneFile (string) - absolute filepath of the zone grid GeoTIFF of the grid
+#    nZones (int) - number of tracts in the zone grid
+#    inFiles (string array) - absolute filepaths of the rasters, all on the grid of the zone grid
+#    pool (multiprocessing pool) - optional, tiles are processed by the pool if provided
+# OUTPUTS:
+#    tuple of (float64 array of sums with shape (n rasters, 3, n zones + 1), bool array of zones present in the
+#    zone grid)
+def sumZones(zoneFile,nZones,inFiles,pool=None):
+    sums = np.zeros((len(inFiles),len(STATISTICS),nZones + 1))
+    present = np.zeros(nZones + 1,dtype=bool)
+    with rasterio.open(zoneFile) as src:
+        tileTuples = [(zoneFile,inFiles,window) for window in getTileWindows(src.width,src.height,TILE_SIZE)]
+    results = pool.imap_unordered(processTile,tileTuples) if pool is not None else map(processTile,tileTuples)
+    try:
+        with timeStage('zonal_tiles',rasters=len(inFiles)) as timer:
+            for result in results:
+                timer.count(tiles=1)
+                if(result is None):
+                    continue
+                tileZones,tileSums = result
+                # zones are unique within a tile, so sums can be added with fancy indexing
+                sums[:,:,tileZones] += tileSums
+                present[tileZones] = True
+    finally:
+        closeSources()
+    return((sums,present))
+
+# convert zone sums into tract statistics
+# INPUTS:
+#    sums (float64 array) - created by sumZones
+#    present (bool array) - created by sumZones
+#    zoneTable (pandas dataframe) - zone ids and tract ids created by loadZoneGrid
+#    names (string array) - output field prefix of each raster (e.g. 'be_ci')
+# OUTPUTS:
+#    pandas dataframe with one row per tract in the zone grid and <name>_mean, <name>_count, and <name>_std
+#    fields for each raster.  Means of tracts without data are NaN
+def calcZoneStats(sums,present,zoneTable,names):
+    zones = np.flatnonzero(present)
+    stats = {TRACT_ID_FIELD:zoneTable.set_index('zone')['tractId'].reindex(zones).values}
+    with np.errstate(invalid='ignore',divide='ignore'):
+        for index,name in enumerate(names):
+            count,total,squares = sums[index,0,zones],sums[index,1,zones],sums[index,2,zones]
+            mean = total/count
+            stats[name + "_mean"] = mean
+            stats[name + "_count"] = count.astype(np.int64)
+            stats[name + "_std"] = np.sqrt(np.maximum(squares/count - mean*mean,0))
+    return(ps.DataFrame(stats))
+
+# calculate tract statistics for every year and outcome.  Rasters on the same grid share one zone grid and one
+# pass over the tiles
+# INPUTS:
+#    rasterFolder (string) - absolute folderpath of the perception rasters
+#    years (int array) - years to include
+#    outcomes (string array) - outcomes to include
+#    tractFile (string) - absolute filepath of the tract polygons
+#    zoneFolder (string) - absolute folderpath of the cached zone grids
+#    nWorkers (int) - number of CPU workers
+# OUTPUTS:
+#    pandas dataframe with one row per tract and year, and mean, count, and std fields for each outcome
+def calcTractStats(rasterFolder=RASTER_FOLDER,years=YEARS,outcomes=OUTCOMES,tractFile=TRACT_FILE,zoneFolder=ZONE_FOLDER,nWorkers=N_WORKERS):
+    rastersByGrid = {}
+    for year in years:
+        for outcome in outcomes:
+            inFile = rasterFolder + "geo_" + str(year) + "_" + outcome + ".tif"
+            rastersByGrid.setdefault(getGrid(inFile),[]).append((year,outcome,inFile))
+    tracts = None
+    pool = Pool(processes=nWorkers) if nWorkers>1 else None
+    tables = []
+    try:
+        for grid,gridRasters in rastersByGrid.items():
+            # tracts are only read if a zone grid has to be created
+            zoneFiles = list(getZoneFiles(grid,zoneFolder))
+            if(tracts is None and not isTaskComplete(MANIFEST_FILE,createTaskKey('tract_zones',label=os.path.basename(zoneFiles[0])),[tractFile],zoneFiles)):
+                tracts = readTracts(tractFile)
+            zoneFile,zoneTable = loadZoneGrid(grid,tractFile,zoneFolder,tracts)
+            sums,present = sumZones(zoneFile,len(zoneTable),[inFile for year,outcome,inFile in gridRasters],pool)
+            stats = calcZoneStats(sums,present,zoneTable,[str(year) + "|" + outcome for year,outcome,inFile in gridRasters])
+            if(len(stats)<len(zoneTable)):
+                print("%i tracts do not contain a cell center and are left out" %(len(zoneTable) - len(stats)))
+            # each year is one row per tract
+            gridYears = sorted(set([year for year,outcome,inFile in gridRasters]))
+            for year in gridYears:
+                prefix = str(year) + "|"
+                yearStats = stats[[TRACT_ID_FIELD] + [field for field in stats.columns if field.startswith(prefix)]]
+                yearStats = yearStats.rename(columns=lambda field: field[len(prefix):] if field.startswith(prefix) else field)
+                yearStats.insert(1,'year',year)
+                tables.append(yearStats)
+            print("completed tract statistics for years %s" %(gridYears))
+    finally:
+        if(pool is not None):
+            pool.close()
+            pool.join()
+    return(ps.concat(tables,ignore_index=True).sort_values([TRACT_ID_FIELD,'year'],kind='stable').reset_index(drop=True))
+
+if __name__ == '__main__':
+    rasterFiles = [RASTER_FOLDER + "geo_" + str(year) + "_" + outcome + ".tif" for year in YEARS for outcome in OUTCOMES]
+    taskKey = createTaskKey('tract_stats')
+    outFile = getTablePath(OUT_BASE,STORAGE_FORMAT)
+    if(isTaskComplete(MANIFEST_FILE,taskKey,rasterFiles + [TRACT_FILE],[outFile])):
+        print("tract statistics already up to date")
+    else:
+        writeTable(calcTractStats(),OUT_BASE,STORAGE_FORMAT)
+        recordTaskComplete(MANIFEST_FILE,taskKey,rasterFiles + [TRACT_FILE],[outFile])